@@ -48,6 +48,7 @@ from random import randint
 import pickle
 import time
 import lib.fcns_asstopt as fcns_asstopt
+import lib.rankings as rankings
 from lib.utilities import revenue_MMNL
 
 filename_transaction        = 'transaction_data_'+  data_version + '.dat'
@@ -87,24 +88,16 @@ with open(abs_file_transaction, 'rb') as sales:
     p =                     my_depickler.load()
 
 #Opening the choice model file corresponding to the choice model specified (GDT or BM)
+#the choice models are rankings.RankingModel
 if(algo_chosen=='GDT'):
     print("Opening choice model, format GDT")
-    with open(abs_file_choice_model_GDT, 'rb') as sales:
-        my_depickler = pickle.Unpickler(sales)
-        sigma_GDT_sorted =   my_depickler.load()
-        lambda_GDT_sorted =   my_depickler.load()
+    model_GDT = rankings.load_choice_model(abs_file_choice_model_GDT)
 elif(algo_chosen=='BM'):
     print("Opening choice model, format BM")
-    with open(abs_file_choice_model_BM, 'rb') as sales:
-        my_depickler = pickle.Unpickler(sales)
-        sigma_BM_sorted =   my_depickler.load()
-        lambda_BM_sorted =   my_depickler.load()
+    model_BM = rankings.load_choice_model(abs_file_choice_model_BM)
 elif(algo_chosen=='gen'):
     print("Opening choice model, format gen (generalization) with old and new products")
-    with open(abs_file_choice_model_gen, 'rb') as sales:
-        my_depickler = pickle.Unpickler(sales)
-        sigma_GDT_sorted =   my_depickler.load()
-        lambda_GDT_sorted =   my_depickler.load()
+    model_GDT = rankings.load_choice_model(abs_file_choice_model_gen)
 
 else:
     print("Error; wrong input parameter, which algorithm do you wish to use?")
@@ -120,21 +113,20 @@ else:
 # the number of sub-columns to add is tuned by the parameters threshold, min_sub_col_per_col
 if(algo_chosen=='GDT' or algo_chosen=='gen' ):
     if(0):#1: old fashioned
-        [Lambda, Sigma] = fcns_asstopt.convert_GDT_to_bigBM(lambda_GDT_sorted, sigma_GDT_sorted, threshold,
+        [Lambda, Sigma] = fcns_asstopt.convert_GDT_to_bigBM(model_GDT.lambdas, model_GDT.to_dense(), threshold,
                                                             min_sub_col_per_col)
         t1 = time.time()
         [x_found, obj_val] = fcns_asstopt.run_asstopt(Lambda, Sigma, Revenue[:len(Sigma.T)], min_capacity, max_capacity,
                                                       verbose=verbose)
     else:
-        Lambda = lambda_GDT_sorted
-        Sigma = sigma_GDT_sorted
         t1 = time.time()
-        [x_found, obj_val] = fcns_asstopt.run_asstopt_GDT(Lambda, Sigma, Revenue[:len(Sigma.T)], min_capacity, max_capacity,
+        #the constraints are built directly from the ranked prefixes of the model
+        [x_found, obj_val] = fcns_asstopt.run_asstopt_GDT(None, model_GDT, Revenue[:model_GDT.nb_prod], min_capacity, max_capacity,
                                                       verbose=verbose)
     t2 = time.time()
 elif(algo_chosen=='BM'):
-    Lambda = lambda_BM_sorted
-    Sigma = sigma_BM_sorted
+    Lambda = model_BM.lambdas
+    Sigma = model_BM.to_dense()
     t1 = time.time()
     [x_found, obj_val] = fcns_asstopt.run_asstopt(Lambda, Sigma, Revenue[:len(Sigma.T)], min_capacity, max_capacity,
                                                       verbose=verbose)
@@ -22,6 +22,8 @@ import pickle
 import time
 import lib.fcns_asstopt as fcns_asstopt
 import lib.gen_GDT as gen_GDT
+import lib.choice_engine as choice_engine
+import lib.rankings as rankings
 
 filename_transaction        = 'transaction_data_'+  data_version + '.dat'
 filename_choice_model_gen   = 'choice_model_gen_'+  data_version + '.dat'
@@ -53,10 +55,9 @@ with open(abs_file_transaction, 'rb') as sales:
 
 #Opening the choice model file corresponding to the 'gen' choice model
 print("Opening choice model, format gen (generalization) with old and new products")
-with open(abs_file_choice_model_gen, 'rb') as sales:
-    my_depickler = pickle.Unpickler(sales)
-    sigma_GDT_sorted =   my_depickler.load()
-    lambda_GDT_sorted =   my_depickler.load()
+model_gen = rankings.load_choice_model(abs_file_choice_model_gen)
+sigma_GDT_sorted = model_gen.to_dense()
+lambda_GDT_sorted = model_gen.lambdas
 
 (nb_asst, nb_prod) = Inventories_train.shape
 (nb_col, nb_all_prod) = sigma_GDT_sorted.shape
@@ -71,13 +72,13 @@ nb_new_prod = nb_all_prod - nb_prod
 #  Computation of the error epsilon on new products
 
 # 1 - application of the choice model (sigma_GDT_sorted, lambda_GDT_sorted) on Inventories_test
-# -> A_test; .shape=(nb_col, nb_all_prod, nb_asst)
-A_test = gen_GDT.multiple_sigma2a(sigma_GDT_sorted, Inventories_test)
+# -> A_test in the compact encoding of choice_engine (products chosen); .shape=(nb_col, nb_asst)
+A_test = choice_engine.batch_choices(sigma_GDT_sorted, Inventories_test)
 
 # 2 - computation of epsilon_new
-eps_all = gen_GDT.compute_eps(A_test, lambda_GDT_sorted, Proba_product_test)
-eps_old = gen_GDT.compute_eps(A_test[:,:nb_prod,:], lambda_GDT_sorted, Proba_product_test[:,:nb_prod])
-eps_new = gen_GDT.compute_eps(A_test[:,nb_prod:,:], lambda_GDT_sorted, Proba_product_test[:,nb_prod:])
+eps_all = gen_GDT.compute_eps(A_test, lambda_GDT_sorted, Proba_product_test, Inventories_test)
+eps_old = gen_GDT.compute_eps(A_test, lambda_GDT_sorted, Proba_product_test, Inventories_test, products=slice(None, nb_prod))
+eps_new = gen_GDT.compute_eps(A_test, lambda_GDT_sorted, Proba_product_test, Inventories_test, products=slice(nb_prod, None))
 
 # 3 - display the error per product, for old and new products
 err_per_old_prod = eps_old/nb_prod
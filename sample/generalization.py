@@ -34,6 +34,7 @@ from random import randint
 import pickle
 import time
 import lib.generalization_GDT as generalization_GDT
+import lib.rankings as rankings
 
 filename_transaction        = 'transaction_data_'   +data_version+'.dat'
 filename_features           = 'features_data_'      +data_version+'.dat'
@@ -79,10 +80,7 @@ with open(abs_file_features, 'rb') as sales:
 
 
 print("Opening choice model, format GDT")
-with open(abs_file_choice_model_GDT, 'rb') as sales:
-    my_depickler = pickle.Unpickler(sales)
-    sigma_GDT_sorted =   my_depickler.load()
-    lambda_GDT_sorted =   my_depickler.load()
+model_GDT = rankings.load_choice_model(abs_file_choice_model_GDT)
 
 #(nb_prod, nb_asst) = Inventories_train.shape
 #  End of the importation
@@ -92,19 +90,16 @@ with open(abs_file_choice_model_GDT, 'rb') as sales:
 
 #############################
 #  Generalization of the GDT choice model
-[sigma_gen, lambda_gen] = generalization_GDT.run_generalization(sigma_GDT_sorted, lambda_GDT_sorted, features_old, features_new, restriction=0.1, alpha=0.5)
+model_gen = generalization_GDT.run_generalization(model_GDT, None, features_old, features_new, restriction=0.1, alpha=0.5)
 #  End of generalization
 #############################
 
-print(sigma_gen)
-print(sigma_GDT_sorted)
+print(model_gen.to_dense())
+print(model_GDT.to_dense())
 
 #############################
 # Saving the data in filename_choice_model_gen
-with open(abs_file_choice_model_gen, 'wb') as sales:
-    my_pickler = pickle.Pickler(sales,protocol=2)
-    my_pickler.dump(sigma_gen)
-    my_pickler.dump(lambda_gen)
+rankings.save_choice_model(abs_file_choice_model_gen, model_gen)
 
 print("Generalization to new products completed")
 print("generalized choice model file has been saved in /sample/data/.")
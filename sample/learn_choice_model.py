@@ -6,7 +6,9 @@
 #  proposed by Bertsimas & Misic, in "Data-Driven Assortment Optimization", 
 #  work in revision for Management Science, 2016
 #  
-#  Input: command-line parameter algo_chosen (values: GDT, BM) and data_version(int).
+#  Input: command-line parameter algo_chosen (values: GDT, BM) and data_version(int), and optionally 'resume' to go on
+#  with the learning from its last checkpoint (see write_checkpoints), or 'update' followed by the versions of new
+#  transaction data, to update the choice model with their training assortments.
 #  Returns a file choice_model_version.dat file
 #  
 print("################################# File learn_choice_model.py #################################")
@@ -22,10 +24,36 @@ import sys
 #if eps_stop is different than 0, NB_ITER ignored
 NB_ITER = 200
 eps_stop= 0.01
+#solver of the master problem: 'gurobi', or 'highs'/'scipy' on machines without a Gurobi license
+master_backend = 'gurobi'
+#if True, the identical assortments of the training set are merged before the learning (see dataset.deduplicate):
+#the learning then fits the mean sales of each distinct assortment, weighted by its number of observations, which is a
+#different L1 objective (eps_stop applies to it)
+deduplicate_assortments = False
+#if > 0, the learning runs on a coreset of at most coreset_size assortments (see dataset.coreset), and the lambdas are
+#then refitted on the full training set
+coreset_size = 0
+#if True, with a coreset, the learning is also run on the full training set, to measure the speedup of the coreset
+coreset_measure_full = False
+#if > 0, GDT learns on mini-batches of batch_size assortments, with periodic solves on the full data (see
+#gen_GDT.run_GDT_minibatch), for the training sets with a large number of assortments
+batch_size = 0
+#if True, checkpoints of the learning are written in data/checkpoint_algo_version.dat (see lib/checkpoint.py); a learning
+#which died can then be resumed with 'python learn_choice_model.py data_version algo resume'
+#the last checkpoint of a learning also allows to update its choice model with the training assortments of new
+#transaction data, appended after the ones of data_version: 'python learn_choice_model.py data_version algo update
+#new_version_1 new_version_2 ...' (the versions given to the previous update first), without learning again from scratch
+write_checkpoints = False
+#if > 0, a random fraction validation_fraction of the training assortments is kept aside: the learning stops when the
+#error on them has not improved during utilities.stop_validation_patience iterations, and returns the model of lowest
+#validation error (see utilities.Validation)
+validation_fraction = 0
 
 try:
     algo_chosen =    sys.argv[2]
     data_version =  sys.argv[1]
+    resume = (len(sys.argv) > 3 and sys.argv[3] in ['resume', 'update'])
+    new_versions = sys.argv[4:] if (len(sys.argv) > 3 and sys.argv[3] == 'update') else []
 except:
     print("Error; wrong input parameter, please specify: 'python learn_choice_model.py algo data_version'?")
 
@@ -44,6 +72,11 @@ import pickle
 import time
 import lib.gen_GDT as gen_GDT
 import lib.gen_BM as gen_BM
+import lib.rankings as rankings
+import lib.dataset as dataset
+import lib.choice_engine as choice_engine
+import lib.master_backends as master_backends
+import lib.checkpoint as checkpoint
 
 #  End of the preliminary definitions & imports
 #############################
@@ -68,6 +101,15 @@ with open(abs_file_transaction, 'rb') as sales:
     u =                     my_depickler.load()
     p =                     my_depickler.load()
 
+#training sets of the new transaction data, for an update
+new_training_sets = []
+for new_version in new_versions:
+    with open(os.path.join(script_dir, "data/transaction_data_"+new_version+".dat"), 'rb') as sales:
+        my_depickler = pickle.Unpickler(sales)
+        Proba_product_new = my_depickler.load()
+        Inventories_new =   my_depickler.load()
+    new_training_sets.append([Inventories_new, Proba_product_new])
+
 #definitions preparing the future exports
 #Definition of the name of the file to write, to be consistent with the file opened
 filename_choice_model_GDT   = 'choice_model_GDT_'+str(data_version)+'.dat'
@@ -79,21 +121,80 @@ abs_file_choice_model_GDT = os.path.join(script_dir, rel_path_choice_model_GDT)
 rel_path_choice_model_BM = "data/"+filename_choice_model_BM
 abs_file_choice_model_BM = os.path.join(script_dir, rel_path_choice_model_BM)
 
+#checkpoints of the learning, when written or resumed
+checkpointer = None
+if write_checkpoints or resume:
+    abs_file_checkpoint = os.path.join(script_dir, "data/checkpoint_"+algo_chosen+"_"+str(data_version)+".dat")
+    checkpointer = checkpoint.Checkpointer(abs_file_checkpoint)
+
 #  End of the importation
 #############################
 
 
+#############################
+#  Merging of the identical assortments: the master has one block of constraints per distinct assortment
+if deduplicate_assortments:
+    [data_train, inverse] = dataset.deduplicate(Inventories_train, Proba_product_train)
+    print(len(Inventories_train), "assortments,", len(data_train), "distinct")
+    (Inventories_train, Proba_product_train) = (data_train, None)
+#  End of the merging
+#############################
+
+
+#############################
+#  Appending of the new training sets, for an update: each one is merged on its own, so that the assortments of the
+#  learning checkpointed keep their rows, and the new ones come after them
+for [Inventories_new, Proba_product_new] in new_training_sets:
+    if deduplicate_assortments:
+        data_new = dataset.deduplicate(Inventories_new, Proba_product_new)[0]
+    else:
+        data_new = dataset.as_dataset(Inventories_new, Proba_product_new)
+    print("Update with", len(data_new), "new assortments")
+    data_train = dataset.append(dataset.as_dataset(Inventories_train, Proba_product_train), data_new)
+    (Inventories_train, Proba_product_train) = (data_train, None)
+if len(new_training_sets) > 0 and coreset_size > 0:
+    sys.exit("Error; a choice model learned on a coreset cannot be updated")
+#  End of the appending
+#############################
+
+
+#############################
+#  Split of a validation set out of the training set, for the early stopping (with the same seed on resume)
+data_validation = None
+if validation_fraction > 0:
+    if len(new_training_sets) > 0 or batch_size > 0:
+        sys.exit("Error; the validation set cannot be used by an update nor by the mini-batch learning")
+    [data_train, data_validation] = dataset.split(dataset.as_dataset(Inventories_train, Proba_product_train), None,
+                                                  validation_fraction)
+    print("Validation set of", len(data_validation), "assortments out of", len(data_train) + len(data_validation))
+    (Inventories_train, Proba_product_train) = (data_train, None)
+#  End of the split
+#############################
+
+
+#############################
+#  Compression of the training set into a coreset: the learning runs on the representative assortments
+if coreset_size > 0:
+    data_full = dataset.as_dataset(Inventories_train, Proba_product_train)
+    [data_train, assignment] = dataset.coreset(data_full, None, coreset_size)
+    coreset_error = dataset.coreset_error(data_full, None, data_train, assignment)
+    print("Coreset of", len(data_train), "assortments out of", len(data_full), ", approximation error:", coreset_error)
+    (Inventories_train, Proba_product_train) = (data_train, None)
+#  End of the compression
+#############################
+
+
 #############################
 #  Calling the GDT choice model or the BM if specified
 if(algo_chosen=='GDT' or algo_chosen=='gen'):
     print("GDT algorithm chosen")
     t1=time.time()
-    [sigma_GDT_sorted, lambda_GDT_sorted, obj_val_master, history_obj_val] = gen_GDT.run_GDT(Inventories_train, Proba_product_train, NB_ITER, eps_stop=eps_stop)
+    [sigma_GDT_sorted, lambda_GDT_sorted, obj_val_master, history_obj_val] = gen_GDT.run_GDT(Inventories_train, Proba_product_train, NB_ITER, eps_stop=eps_stop, backend=master_backend, batch_size=batch_size, checkpointer=checkpointer, resume=resume, validation=data_validation)
     t2=time.time()
 elif(algo_chosen=='BM'):
     print("BM algorithm chosen")
     t1=time.time()
-    [sigma_BM_sorted, lambda_BM_sorted, obj_val_master, history_obj_val] = gen_BM.run_BM(Inventories_train, Proba_product_train, NB_ITER, eps_stop)
+    [sigma_BM_sorted, lambda_BM_sorted, obj_val_master, history_obj_val] = gen_BM.run_BM(Inventories_train, Proba_product_train, NB_ITER, eps_stop, backend=master_backend, checkpointer=checkpointer, resume=resume, validation=data_validation)
     t2=time.time()
 else:
     print("Error; wrong input parameter, which algorithm do you wish to use?")
@@ -105,25 +206,50 @@ print("History of objective values:")
 print(history_obj_val)
 
 
+#############################
+#  Refit of the lambdas on the full training set, when the learning ran on a coreset
+if coreset_size > 0 and algo_chosen in ['GDT', 'gen', 'BM']:
+    indifference = (algo_chosen != 'BM')
+    sigmas = sigma_GDT_sorted if indifference else sigma_BM_sorted
+    t_refit = time.time()
+    lambdas = master_backends.refit_lambdas(sigmas, data_full, None, indifference, master_backend)[0]
+    t_refit = time.time() - t_refit
+    eps_full = gen_GDT.compute_eps(choice_engine.batch_choices(sigmas, data_full, indifference), lambdas, None, data_full)
+    print("Error on the full training set after the refit:", eps_full, "(coreset approximation error:", coreset_error, ")")
+    print("Learning on the coreset in", t2 - t1, "s, refit on the full training set in", t_refit, "s")
+    if coreset_measure_full:
+        # the same learning on the full training set, without checkpoints: its time is measured, not estimated
+        t_full = time.time()
+        if indifference:
+            gen_GDT.run_GDT(data_full, None, NB_ITER, eps_stop=eps_stop, backend=master_backend, batch_size=batch_size,
+                            validation=data_validation)
+        else:
+            gen_BM.run_BM(data_full, None, NB_ITER, eps_stop, backend=master_backend, validation=data_validation)
+        t_full = time.time() - t_full
+        print("Learning on the full training set in", t_full, "s: speedup of the coreset (learning and refit)",
+              t_full / (t2 - t1 + t_refit), "(coreset approximation error:", coreset_error, ")")
+    # we keep the columns of nonzero lambda, sorted by order of lambda
+    order = np.argsort(lambdas)[::-1][:np.count_nonzero(lambdas)]
+    if indifference:
+        [sigma_GDT_sorted, lambda_GDT_sorted] = [sigmas[order], lambdas[order]]
+    else:
+        [sigma_BM_sorted, lambda_BM_sorted] = [sigmas[order], lambdas[order]]
+#  End of the refit
+#############################
+
+
 ##############################
 #  Exportation of the generated choice model
 
 
-#we save the results into a file
-#Use of protocol 2 to ensure back-compatibility with Python 2.7
+#we save the results into a file, as a rankings.RankingModel (ranked prefixes of the columns)
 #we separate cases depending on GDT or BM:
 if(algo_chosen=='GDT' or algo_chosen=='gen'):
     print("Saving choice model, format GDT")
-    with open(abs_file_choice_model_GDT, 'wb') as sales:
-        my_pickler = pickle.Pickler(sales,protocol=2)
-        my_pickler.dump(sigma_GDT_sorted)
-        my_pickler.dump(lambda_GDT_sorted)
+    rankings.save_choice_model(abs_file_choice_model_GDT, rankings.RankingModel.from_dense(sigma_GDT_sorted, lambda_GDT_sorted))
 elif(algo_chosen=='BM'):
     print("Saving choice model, format BM")
-    with open(abs_file_choice_model_BM, 'wb') as sales:
-        my_pickler = pickle.Pickler(sales,protocol=2)
-        my_pickler.dump(sigma_BM_sorted)
-        my_pickler.dump(lambda_BM_sorted)
+    rankings.save_choice_model(abs_file_choice_model_BM, rankings.RankingModel.from_dense(sigma_BM_sorted, lambda_BM_sorted))
 else:
     print("Error; wrong input parameter, which algorithm do you wish to use?")
 
@@ -131,7 +257,7 @@ print("Learning completed in ", t2-t1, "seconds.")
 print("Choice model file has been saved in /sample/data/.")
 print("#######################################################################################")
 
-#gen_GDT.sigma_digest(sigma_BM_sorted, lambda_BM_sorted, len(sigma_BM_sorted.T))
+#gen_GDT.sigma_digest(sigma_BM_sorted, lambda_BM_sorted)
 
 
 #  End of the exportation
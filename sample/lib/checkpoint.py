@@ -0,0 +1,198 @@
+import numpy as np
+import os
+import pickle
+import random
+import threading
+import time
+import uuid
+import lib.choice_engine as choice_engine
+import lib.column_pool as column_pool
+import lib.dataset as dataset
+
+
+#############################
+#  FILE checkpoint.py
+#  Checkpoints of the learnings run_GDT and run_BM, to resume a long learning which died (memory, license, preemption)
+#  from its last checkpoint instead of from scratch, or to update a choice model with a new batch of transactions.
+#  A checkpoint is the state of the learning at the end of an iteration (see learning_state): the columns of the pool
+#  (sigmas and choices), the variables of its loop (lambda, duals, best model, histories), the state of its master
+#  (columns in the master and basis, see utilities.RestrictedMaster.state), of its dual smoothing and stopping policy,
+#  and of the RNGs of numpy and random. The last state of a learning is always written.
+#  The learning is updated by resuming it on its data followed by new assortments (see restore_learning): the choices
+#  of the columns are only computed on the new assortments, and the master, with their rows, is warm started with the
+#  basis of the checkpoint. The learning then goes on from its columns, as a new learning.
+#  A Checkpointer writes a checkpoint every every_iterations iterations or every_seconds seconds. The learning only
+#  copies its state, without the columns of its pool (possibly memory-mapped, see column_pool): the state refers to the
+#  pool and holds its number of columns. The state is written by a background thread:
+#   - the columns added to the pool since the last checkpoint are copied and appended to the file of the columns
+#     (filename.columns.<key>, one row sigma+choices of int32 per column), which is flushed to the disk. The first
+#     checkpoint of a Checkpointer writes all the columns, in a new file of columns
+#   - the state is pickled in a temporary file which is flushed to the disk, then renamed to the file of the checkpoints
+#  The renaming is atomic: the file always holds a complete checkpoint, whose columns are the first ones of its file
+#  of columns (the columns of the next checkpoints may follow them).
+#
+#############################
+
+# a checkpoint is written every CHECKPOINT_ITERATIONS iterations or every CHECKPOINT_SECONDS seconds (0: not by this
+# criterion), whichever comes first
+CHECKPOINT_ITERATIONS = 50
+CHECKPOINT_SECONDS = 600
+
+
+class Checkpointer:
+    # filename: file of the checkpoints of a learning, replaced by each new checkpoint
+    def __init__(self, filename, every_iterations=CHECKPOINT_ITERATIONS, every_seconds=CHECKPOINT_SECONDS):
+        self.filename = filename
+        self.every_iterations = every_iterations
+        self.every_seconds = every_seconds
+        self.last_iteration = 0
+        self.last_time = time.time()
+        self.nb_written = 0
+        # the file of the columns of the checkpoints (in the directory of filename), and its number of columns
+        self.columns_filename = None
+        self.nb_columns_written = 0
+        # the state waiting to be written, and the thread writing it (None when no write is in progress)
+        self.pending = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    #tells if a checkpoint is due at the end of the iteration iteration (counted from the beginning of the learning)
+    def due(self, iteration):
+        return ((self.every_iterations > 0 and iteration - self.last_iteration >= self.every_iterations)
+                or (self.every_seconds > 0 and time.time() - self.last_time >= self.every_seconds))
+
+    #hands the state of the iteration iteration to the writing thread, and returns immediately; the state must not be
+    #modified afterwards, and the columns of its pool must stay the same until the writes end (see learning_state). If
+    #the previous state is not written yet, only the new one is written.
+    def save(self, iteration, state):
+        self.last_iteration = iteration
+        self.last_time = time.time()
+        with self.lock:
+            self.pending = state
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._write_pending, daemon=True)
+                self.thread.start()
+
+    def _write_pending(self):
+        while True:
+            with self.lock:
+                [state, self.pending] = [self.pending, None]
+                if state is None:
+                    self.thread = None
+                    return
+            try:
+                self.write_columns(state)
+                write(self.filename, state)
+                self.nb_written += 1
+                self.remove_old_columns()
+            except Exception as error:
+                # the learning goes on: the previous checkpoint is still complete
+                print("Checkpoint of the iteration", state['iteration'], "not written:", error)
+
+    #appends the columns of the pool of the state not written yet to the file of the columns, and replaces the pool in
+    #the state by the description of this file
+    def write_columns(self, state):
+        pool = state.pop('pool')
+        nb_columns = state['nb_columns']
+        if self.columns_filename is None:
+            self.columns_filename = self.filename + '.columns.' + uuid.uuid4().hex[:8]
+            self.nb_columns_written = 0
+        with open(self.columns_filename, 'ab') as file:
+            file.truncate(self.nb_columns_written * row_size(pool))
+            for first in range(self.nb_columns_written, nb_columns, column_pool.BLOCK_COLUMNS):
+                [sigmas, choices] = pool.copy(first, min(first + column_pool.BLOCK_COLUMNS, nb_columns))
+                file.write(np.hstack((sigmas, choices)).astype(np.int32).tobytes())
+            file.flush()
+            os.fsync(file.fileno())
+        self.nb_columns_written = nb_columns
+        state['columns'] = {'filename': os.path.basename(self.columns_filename),
+                            'nb_prod': pool.sigmas.row_shape[0], 'nb_asst': pool.choices.row_shape[0]}
+
+    #removes the files of columns of filename which are not the one of the last checkpoint
+    def remove_old_columns(self):
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        prefix = os.path.basename(self.filename) + '.columns.'
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name != os.path.basename(self.columns_filename):
+                os.remove(os.path.join(directory, name))
+
+    #waits for the end of the writes in progress, e.g. at the end of the learning
+    def close(self):
+        thread = self.thread
+        if thread is not None:
+            thread.join()
+
+
+#writes the state in filename atomically: in filename.tmp, flushed to the disk, then renamed to filename
+def write(filename, state):
+    tmp_filename = filename + '.tmp'
+    with open(tmp_filename, 'wb') as file:
+        pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_filename, filename)
+
+
+#size in bytes of a column of the pool in the file of the columns
+def row_size(pool):
+    return (pool.sigmas.row_shape[0] + pool.choices.row_shape[0]) * np.dtype(np.int32).itemsize
+
+
+#returns the last checkpoint written in filename by a learning of the algorithm algo ('GDT' or 'BM'), with the sigmas
+#and the choices of its columns, read in its file of columns
+def load(filename, algo):
+    with open(filename, 'rb') as file:
+        state = pickle.load(file)
+    if state['algo'] != algo:
+        raise Exception('The checkpoint ' + filename + ' was written by ' + state['algo'] + ', not by ' + algo)
+    columns = state['columns']
+    row_length = columns['nb_prod'] + columns['nb_asst']
+    rows = np.fromfile(os.path.join(os.path.dirname(os.path.abspath(filename)), columns['filename']), dtype=np.int32,
+                       count=state['nb_columns'] * row_length).reshape((state['nb_columns'], row_length))
+    state['sigmas'] = rows[:, :columns['nb_prod']]
+    state['choices'] = rows[:, columns['nb_prod']:]
+    return state
+
+
+#returns the state of a learning of the algorithm algo at the end of the iteration iteration, copied so that the
+#learning can go on while it is written: variables is the list of the variables of its loop (arrays and numbers), in
+#the order expected by the learning on resume. The columns of the pool are not copied: the state holds the pool and
+#its number of columns, and the new columns are copied by the writer (see Checkpointer.write_columns); the learning
+#only appends columns to its pool while the checkpoints are written.
+def learning_state(algo, iteration, variables, pool, model, stabilization, stopping):
+    return {'algo': algo,
+            'iteration': iteration,
+            'variables': [np.copy(variable) if isinstance(variable, np.ndarray) else variable for variable in variables],
+            'pool': pool,
+            'nb_columns': len(pool),
+            'master': model.state(),
+            'smoothing': stabilization.state(),
+            'stopping': stopping.state(),
+            'rng': [np.random.get_state(), random.getstate()]}
+
+
+#restores the state of a learning in its new pool of columns (empty), master (not initialized), dual smoothing and
+#stopping policy, and the RNGs; the master is warm started with the basis of the checkpoint
+#assortments: the assortments of the learning checkpointed, possibly followed by new assortments; the choices of the
+#columns are computed on the new assortments only
+#indifference: True for GDT, False for BM (see choice_engine.batch_choices)
+#returns [iteration, variables]: the learning goes on at the iteration following iteration; with new assortments, it
+#returns [0, None]: the variables of the loop are not valid anymore, and the master must be solved again
+def restore_learning(state, pool, model, stabilization, stopping, v, assortments, indifference):
+    choices = state['choices']
+    nb_asst_checkpoint = choices.shape[1]
+    nb_asst = dataset.offers_csr(assortments).shape[0]
+    if nb_asst < nb_asst_checkpoint or len(state['sigmas'][0]) != len(v):
+        raise Exception('The data does not extend the data of the checkpoint')
+    if nb_asst > nb_asst_checkpoint:
+        new_assortments = dataset.take(assortments, np.arange(nb_asst_checkpoint, nb_asst))
+        choices = np.hstack((choices, choice_engine.batch_choices(state['sigmas'], new_assortments, indifference)))
+    pool.append(state['sigmas'], choices)
+    model.restore(state['master'], pool.A(), v, assortments)
+    np.random.set_state(state['rng'][0])
+    random.setstate(state['rng'][1])
+    if nb_asst > nb_asst_checkpoint:
+        return [0, None]
+    stabilization.restore(state['smoothing'])
+    stopping.restore(state['stopping'])
+    return [state['iteration'], state['variables']]
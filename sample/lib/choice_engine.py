@@ -0,0 +1,180 @@
+import numpy as np
+import scipy.sparse as sp
+import lib.dataset as dataset
+
+
+#############################
+#  FILE choice_engine.py
+#  Batched simulation of the choices of several consumer behaviors (sigmas) on several assortments
+#  Used by gen_GDT and gen_BM in place of the loops over the assortments calling product_chosen
+#
+#############################
+
+# maximal number of elements of the intermediate (nb_col, nb_asst, nb_prod) arrays: the sigmas are processed by blocks
+BLOCK_ELEMENTS = 2 ** 24
+
+
+# Returns the matrix of choices chosen, of shape (nb_col, nb_asst), of the sigmas on the assortments
+# chosen[k,m] is the product chosen by sigmas[k] in the assortment m
+# with indifference=True (GDT), chosen[k,m] is -1 when the customer is indifferent, as in gen_GDT.product_chosen:
+#   when the best rank present in the assortment is shared by several products of sigma (which includes the case
+#   where no ranked product is present), or when the assortment is empty
+# with indifference=False (BM), the first product of best rank is chosen, and the product 0 for an empty assortment,
+#   as in gen_BM.product_chosen
+# the assortments are either the dense Inventories, or an AssortmentData which is processed by walk_choices
+def batch_choices(sigmas, assortments, indifference=True):
+    sigmas = np.asarray(sigmas)
+    if isinstance(assortments, dataset.AssortmentData):
+        ret = np.empty((len(sigmas), len(assortments)), dtype=np.int32)
+        for k in range(len(sigmas)):
+            ret[k] = walk_choices(sigmas[k], assortments, indifference)
+        return ret
+    assortments = np.asarray(assortments, dtype=bool)
+    (nb_col, nb_prod) = sigmas.shape
+    nb_asst = len(assortments)
+    ret = np.empty((nb_col, nb_asst), dtype=np.int32)
+    if nb_col == 0 or nb_asst == 0:
+        return ret
+
+    # rank given to the products absent of the assortment: worse than any rank of sigmas
+    not_offered = sigmas.max() + 1
+    block = max(1, BLOCK_ELEMENTS // (nb_asst * nb_prod))
+    for k0 in range(0, nb_col, block):
+        sigmas_block = sigmas[k0:k0 + block]
+        # ranks[k,m,i] is the rank of the product i in sigma k if it is present in the assortment m
+        ranks = np.where(assortments[None, :, :], sigmas_block[:, None, :], not_offered)
+        chosen = np.argmin(ranks, axis=2)
+        if indifference:
+            best_rank = np.take_along_axis(ranks, chosen[:, :, None], axis=2)
+            # number of products of sigma having the best rank present in the assortment
+            nb_best = (sigmas_block[:, None, :] == best_rank).sum(axis=2)
+            chosen[(nb_best != 1) | (best_rank[:, :, 0] == not_offered)] = -1
+        ret[k0:k0 + block] = chosen
+    return ret
+
+
+# Returns the choices of a single sigma on the assortments of an AssortmentData, same result as batch_choices
+# the products are taken by order of rank (the ranked prefix of sigma first), and the assortments carrying them are found
+# with the inverted index of the data: the first rank present in an assortment decides the choice
+# with indifference=True, the walk stops at the products not ranked (rank nb_prod-1), unless a single one is left
+def walk_choices(sigma, data, indifference=True):
+    nb_prod = len(sigma)
+    ret = np.full(data.nb_asst, -1 if indifference else 0, dtype=np.int32)
+    resolved = np.zeros(data.nb_asst, dtype=bool)
+    nb_resolved = 0
+    products = np.argsort(sigma, kind='stable')
+    # the products of a same rank are consecutive in products: they are processed together
+    first_of_rank = np.concatenate(([0], np.nonzero(np.diff(sigma[products]))[0] + 1, [nb_prod]))
+    for r in range(len(first_of_rank) - 1):
+        products_rank = products[first_of_rank[r]:first_of_rank[r + 1]]
+        if indifference and len(products_rank) >= 2 and sigma[products_rank[0]] == nb_prod - 1:
+            break  # indifferent between the products not ranked: the remaining assortments stay at -1
+        assts = np.concatenate([data.assortments_with(i) for i in products_rank])
+        products_asst = np.repeat(products_rank, [len(data.assortments_with(i)) for i in products_rank])
+        keep = ~resolved[assts]
+        (assts, products_asst) = (assts[keep], products_asst[keep])
+        if len(assts) == 0:
+            continue
+        if indifference and len(products_rank) >= 2:
+            # tie between several products of the same rank: indifferent
+            assts = np.unique(assts)
+            ret[assts] = -1
+        else:
+            # the first product (lowest index) of the rank present in the assortment
+            (assts, first) = np.unique(assts, return_index=True)
+            ret[assts] = products_asst[first]
+        resolved[assts] = True
+        nb_resolved += len(assts)
+        if nb_resolved == data.nb_asst:
+            break
+    return ret
+
+
+# Expands the matrix of choices returned by batch_choices into the choice tensor A of shape (nb_col, nb_prod, nb_asst)
+# the indifferent customers (-1) split uniformly their choice between the products of the assortment: 1/|S|
+def choices2a(chosen, assortments):
+    (nb_col, nb_asst) = chosen.shape
+    nb_prod = assortments.shape[1]
+    ret = np.zeros((nb_col, nb_prod, nb_asst), dtype=np.float64)
+    [cols, rows, vals] = choice_coefficients(chosen, assortments)
+    ret[cols, rows // nb_asst, rows % nb_asst] = vals
+    return ret
+
+
+# Returns the choice tensor A of shape (nb_col, nb_prod, nb_asst) associated to the sigmas and the assortments
+# with array operations only; equivalent to calling gen_GDT.sigma2a (or gen_BM.sigma2a if indifference=False) on each sigma
+def batch_sigma2a(sigmas, assortments, indifference=True):
+    return choices2a(batch_choices(sigmas, assortments, indifference), assortments)
+
+
+#############################
+#  Compact encoding of A
+#  A column of A is stored as its row of choices, of shape (nb_asst), with int32 values: the product chosen in each
+#  assortment, or -1 when the customer is indifferent. The side table of the indifferent assortments is shared by all
+#  the columns: it is the assortment itself, each of its products receiving the share 1/|S| (see indifference_shares).
+#  The memory is O(nb_col*nb_asst) instead of O(nb_col*nb_prod*nb_asst).
+#
+
+# Returns the share 1/|S| received by each product of the assortments when the customer is indifferent, of shape (nb_asst)
+# the share is 0 for an empty assortment
+def indifference_shares(assortments):
+    nb_prod_pst_in_asst = np.diff(dataset.offers_csr(assortments).indptr)
+    share = np.zeros(len(nb_prod_pst_in_asst))
+    share[nb_prod_pst_in_asst > 0] = 1 / nb_prod_pst_in_asst[nb_prod_pst_in_asst > 0]
+    return share
+
+
+# Returns the nonzero coefficients of the columns encoded by the choices, as three arrays [cols, rows, vals]
+# rows follow the numbering of the distance constraints of the master problem: row i*nb_asst+m for (product i, asst m)
+def choice_coefficients(chosen, assortments):
+    offers = dataset.offers_csr(assortments)
+    (nb_col, nb_asst) = chosen.shape
+    share = indifference_shares(offers)
+
+    # the customer chooses a single product: coefficient 1
+    (k_chosen, m_chosen) = np.nonzero(chosen != -1)
+    rows_chosen = chosen[k_chosen, m_chosen].astype(np.int64) * nb_asst + m_chosen
+
+    # the customer is indifferent: coefficient 1/|S| for all the products of the assortment, read in the offers
+    (k_indiff, m_indiff) = np.nonzero(chosen == -1)
+    repeats = np.diff(offers.indptr)[m_indiff]
+    position = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    m_indiff_rep = np.repeat(m_indiff, repeats)
+    rows_indiff = offers.indices[np.repeat(offers.indptr[m_indiff], repeats) + position].astype(np.int64) * nb_asst \
+        + m_indiff_rep
+
+    cols = np.concatenate((k_chosen, np.repeat(k_indiff, repeats)))
+    rows = np.concatenate((rows_chosen, rows_indiff))
+    vals = np.concatenate((np.ones(len(rows_chosen)), share[m_indiff_rep]))
+    return [cols, rows, vals]
+
+
+# Computes the reduced costs rc = -alpha * a - nu of all the columns encoded by the choices
+# this is a gather on alpha: alpha[chosen[k,m], m], the indifferent choices reading the mean of alpha on the assortment
+def reduced_costs(chosen, alpha, nu, assortments):
+    offers = dataset.offers_csr(assortments)
+    nb_asst = offers.shape[0]
+    asst_of_offer = np.repeat(np.arange(nb_asst), np.diff(offers.indptr))
+    alpha_indiff = np.bincount(asst_of_offer, weights=alpha[offers.indices, asst_of_offer], minlength=nb_asst) \
+        * indifference_shares(offers)
+    # the last row of alpha_ext is read by the choices -1
+    alpha_ext = np.vstack((alpha, alpha_indiff))
+    return -alpha_ext[chosen, np.arange(nb_asst)].sum(axis=1) - nu
+
+
+# Returns the probabilities of purchase predicted by the columns encoded by the choices and the lambdas, on the offers:
+# a sparse matrix of shape (nb_asst, nb_prod) like Proba_product, with the pattern of dataset.offers_csr(assortments)
+def predicted_shares(chosen, lambdas, assortments):
+    offers = dataset.offers_csr(assortments)
+    (nb_asst, nb_prod) = offers.shape
+    asst_of_offer = np.repeat(np.arange(nb_asst), np.diff(offers.indptr))
+    # the offers are sorted by (assortment, product): we find the position of the products chosen with their key
+    keys = asst_of_offer.astype(np.int64) * nb_prod + offers.indices
+    (k_chosen, m_chosen) = np.nonzero(chosen != -1)
+    position = np.searchsorted(keys, m_chosen.astype(np.int64) * nb_prod + chosen[k_chosen, m_chosen])
+    vals = np.bincount(position, weights=lambdas[k_chosen], minlength=len(keys)).astype(np.float64)
+    lambda_indiff = np.matmul(lambdas, chosen == -1)
+    vals += (lambda_indiff * indifference_shares(offers))[asst_of_offer]
+    return sp.csr_matrix((vals, offers.indices, offers.indptr), shape=(nb_asst, nb_prod))
+#
+#############################
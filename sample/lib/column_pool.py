@@ -0,0 +1,140 @@
+import numpy as np
+import os
+import shutil
+import tempfile
+import threading
+
+
+#############################
+#  FILE column_pool.py
+#  Storage of the columns generated by run_GDT and run_BM: their sigmas and their choices (compact encoding of A,
+#  see choice_engine), appended at each iteration instead of being copied by np.concatenate.
+#  By default the pool is in RAM. If a directory is given, the columns are kept in memory-mapped files on the disk:
+#  the files are preallocated and grown geometrically, and the pool is read by blocks of columns.
+#  The columns of a pool can be copied by another thread while the learning appends new ones (see copy), e.g. by the
+#  writer of the checkpoints (see checkpoint.py).
+#
+#############################
+
+# initial number of columns of the pool; the capacity is doubled when it is reached
+INITIAL_CAPACITY = 1024
+# number of columns read at once when streaming over the pool
+BLOCK_COLUMNS = 4096
+
+
+# Array of rows of shape row_shape, which can be appended, in RAM (filename=None) or memory-mapped on filename
+# beware: the views returned by rows() before a growth are not valid anymore after it
+class _GrowableArray:
+    def __init__(self, row_shape, dtype, filename=None, capacity=INITIAL_CAPACITY):
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.filename = filename
+        self.nb_rows = 0
+        self.data = None
+        self._allocate(max(1, capacity))
+
+    def _allocate(self, capacity):
+        shape = (capacity,) + self.row_shape
+        if self.filename is None:
+            new_data = np.empty(shape, dtype=self.dtype)
+            if self.data is not None:
+                new_data[:self.nb_rows] = self.data[:self.nb_rows]
+            self.data = new_data
+        else:
+            # the file is extended in place, then mapped again: the rows already written are not copied
+            if self.data is not None:
+                self.data.flush()
+                self.data = None
+            with open(self.filename, 'r+b' if os.path.exists(self.filename) else 'w+b') as file:
+                file.truncate(int(np.prod(shape)) * self.dtype.itemsize)
+            self.data = np.memmap(self.filename, dtype=self.dtype, mode='r+', shape=shape)
+        self.capacity = capacity
+
+    def append(self, rows):
+        rows = np.asarray(rows).reshape((-1,) + self.row_shape)
+        if self.nb_rows + len(rows) > self.capacity:
+            self._allocate(max(2 * self.capacity, self.nb_rows + len(rows)))
+        self.data[self.nb_rows:self.nb_rows + len(rows)] = rows
+        self.nb_rows += len(rows)
+
+    # keeps only the rows of the mask keep, moved to the beginning of the array
+    def compact(self, keep):
+        kept = np.nonzero(keep)[0]
+        self.data[:len(kept)] = self.data[kept]
+        self.nb_rows = len(kept)
+
+    def rows(self):
+        return self.data[:self.nb_rows]
+
+    def flush(self):
+        if self.filename is not None:
+            self.data.flush()
+
+
+class ColumnPool:
+    # nb_prod, nb_asst: size of the sigmas and of the choices of the columns
+    # directory: None for a pool in RAM, else a directory of the local disk in which the memory-mapped files are created
+    def __init__(self, nb_prod, nb_asst, directory=None, capacity=INITIAL_CAPACITY):
+        self.directory = None
+        if directory is not None:
+            self.directory = tempfile.mkdtemp(prefix='column_pool_', dir=directory)
+        self.sigmas = _GrowableArray((nb_prod,), np.int32, self._filename('sigmas.dat'), capacity)
+        self.choices = _GrowableArray((nb_asst,), np.int32, self._filename('choices.dat'), capacity)
+        # held while the arrays are modified, and while they are copied by copy()
+        self.lock = threading.Lock()
+
+    def _filename(self, name):
+        if self.directory is None:
+            return None
+        return os.path.join(self.directory, name)
+
+    def __len__(self):
+        return self.sigmas.nb_rows
+
+    # adds the columns (sigmas, choices); returns the ids of the new columns in the pool
+    def append(self, sigmas, choices):
+        with self.lock:
+            first_id = len(self)
+            self.sigmas.append(sigmas)
+            self.choices.append(choices)
+        return np.arange(first_id, len(self))
+
+    # keeps only the columns of the mask keep; their ids become 0, 1, ... in the same order
+    def compact(self, keep):
+        with self.lock:
+            self.sigmas.compact(keep)
+            self.choices.compact(keep)
+
+    # sigmas of all the columns, of shape (nb_col, nb_prod): a view on the pool (memory-mapped if on the disk)
+    def sigma(self):
+        return self.sigmas.rows()
+
+    # choices of all the columns, of shape (nb_col, nb_asst): a view on the pool (memory-mapped if on the disk)
+    def A(self):
+        return self.choices.rows()
+
+    # copies in RAM of the sigmas and choices of the columns ids
+    def take(self, ids):
+        return [np.array(self.sigma()[ids]), np.array(self.A()[ids])]
+
+    # copies in RAM of the sigmas and choices of the columns first to last-1; can be called by another thread while
+    # columns are appended
+    def copy(self, first, last):
+        with self.lock:
+            return [np.array(self.sigmas.data[first:last]), np.array(self.choices.data[first:last])]
+
+    # iterates over the pool by blocks of columns: yields [first id of the block, sigmas, choices]
+    def blocks(self, block_columns=BLOCK_COLUMNS):
+        for k0 in range(0, len(self), block_columns):
+            yield [k0, self.sigma()[k0:k0 + block_columns], self.A()[k0:k0 + block_columns]]
+
+    def flush(self):
+        self.sigmas.flush()
+        self.choices.flush()
+
+    # releases the pool; the files of a pool on the disk are deleted
+    def close(self):
+        self.sigmas.data = None
+        self.choices.data = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
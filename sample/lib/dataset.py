@@ -0,0 +1,265 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+#############################
+#  FILE dataset.py
+#  Sparse storage of the transaction data: the assortments offered (Inventories) and the sales (Proba_product)
+#  An AssortmentData can be given to the learning (run_GDT, run_BM), to the evaluation (compute_eps) and to
+#  revenue_MMNL in place of the dense arrays of shape (nb_asst, nb_prod)
+#  An AssortmentData may weight its assortments, e.g. when it merges the identical assortments of several observations
+#  (see deduplicate): the errors on the assortment m count weights[m] times in the master and in compute_eps
+#
+#############################
+
+# weight of the offers in the distance between two assortments of coreset, relative to the distance of their sales
+OFFER_WEIGHT = 0.1
+
+
+class AssortmentData:
+    # offers: boolean array or sparse matrix of shape (nb_asst, nb_prod), like Inventories
+    # sales: array or sparse matrix of the same shape, like Proba_product; only its values on the offers are kept
+    # weights: weight of each assortment, of shape (nb_asst); None for a weight 1
+    def __init__(self, offers, sales=None, weights=None):
+        offers = sp.csr_matrix(offers, dtype=bool)
+        offers.eliminate_zeros()
+        offers.sort_indices()
+        # offers, in CSR form: offers.indices[offers.indptr[m]:offers.indptr[m+1]] are the products of the assortment m
+        self.offers = offers
+        (self.nb_asst, self.nb_prod) = offers.shape
+        self.shape = offers.shape
+        self.sizes = np.diff(offers.indptr)
+        # assortment of each offer, aligned with offers.indices
+        self.asst_of_offer = np.repeat(np.arange(self.nb_asst), self.sizes)
+
+        # inverted index: prod_assts[prod_ptr[i]:prod_ptr[i+1]] are the assortments (sorted) carrying the product i
+        inverted = offers.tocsc()
+        inverted.sort_indices()
+        self.prod_ptr = inverted.indptr
+        self.prod_assts = inverted.indices
+
+        # sales, in CSR form with exactly the pattern of the offers
+        self.sales = None
+        if sales is not None:
+            if sp.issparse(sales):
+                values = _values_at(sales, self.asst_of_offer, offers.indices)
+            else:
+                values = np.asarray(sales)[self.asst_of_offer, offers.indices]
+            self.sales = sp.csr_matrix((values.astype(np.float64), offers.indices.copy(), offers.indptr.copy()),
+                                       shape=self.shape)
+        self.weights = None if weights is None else np.asarray(weights, dtype=np.float64)
+
+    def __len__(self):
+        return self.nb_asst
+
+    # assortments carrying the product i
+    def assortments_with(self, i):
+        return self.prod_assts[self.prod_ptr[i]:self.prod_ptr[i + 1]]
+
+    # products of the assortment m
+    def products_in(self, m):
+        return self.offers.indices[self.offers.indptr[m]:self.offers.indptr[m + 1]]
+
+    # dense Inventories, of shape (nb_asst, nb_prod)
+    def toarray(self):
+        return self.offers.toarray()
+
+    # dense Proba_product, of shape (nb_asst, nb_prod)
+    def sales_array(self):
+        return self.sales.toarray()
+
+    # the data restricted to the assortments assts (indices or mask)
+    def take(self, assts):
+        return AssortmentData(self.offers[assts], None if self.sales is None else self.sales[assts],
+                              None if self.weights is None else self.weights[assts])
+
+
+#############################
+#  Functions accepting either the dense arrays or an AssortmentData
+#
+
+# Returns an AssortmentData for (Inventories, Proba_product); an AssortmentData is returned unchanged
+def as_dataset(Inventories, Proba_product=None):
+    if isinstance(Inventories, AssortmentData):
+        return Inventories
+    return AssortmentData(Inventories, Proba_product)
+
+
+# Returns the offers of the assortments in CSR form, with sorted indices
+def offers_csr(assortments):
+    if isinstance(assortments, AssortmentData):
+        return assortments.offers
+    if sp.issparse(assortments):
+        offers = sp.csr_matrix(assortments, dtype=bool)
+    else:
+        offers = sp.csr_matrix(np.asarray(assortments, dtype=bool))
+    offers.sort_indices()
+    return offers
+
+
+# Returns the dense Proba_product, taken in the AssortmentData if Proba_product is not given
+def sales_array(assortments, Proba_product=None):
+    if Proba_product is None:
+        return assortments.sales_array()
+    if sp.issparse(Proba_product):
+        return Proba_product.toarray()
+    return np.asarray(Proba_product)
+
+
+# Returns the values of the sales on the offers of the assortments, aligned with offers_csr(assortments).indices
+def sales_on_offers(assortments, Proba_product=None):
+    if Proba_product is None:
+        return assortments.sales.data
+    offers = offers_csr(assortments)
+    asst_of_offer = np.repeat(np.arange(offers.shape[0]), np.diff(offers.indptr))
+    if sp.issparse(Proba_product):
+        return _values_at(Proba_product, asst_of_offer, offers.indices)
+    return np.asarray(Proba_product)[asst_of_offer, offers.indices]
+
+
+# Returns the values of the sparse matrix at the positions (rows, cols), 0 where nothing is stored
+def _values_at(matrix, rows, cols):
+    matrix = sp.csr_matrix(matrix)
+    matrix.sum_duplicates()
+    nb_cols = matrix.shape[1]
+    # the entries are sorted by (row, col): they are found with their key
+    keys = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr)).astype(np.int64) * nb_cols + matrix.indices
+    queries = np.asarray(rows, dtype=np.int64) * nb_cols + cols
+    position = np.minimum(np.searchsorted(keys, queries), max(len(keys) - 1, 0))
+    ret = np.zeros(len(queries))
+    if len(keys) > 0:
+        found = keys[position] == queries
+        ret[found] = matrix.data[position[found]]
+    return ret
+
+
+# Returns the weights of the assortments, of shape (nb_asst): 1 for the dense arrays and the AssortmentData not weighted
+def weights(assortments):
+    if isinstance(assortments, AssortmentData) and assortments.weights is not None:
+        return assortments.weights
+    return np.ones(offers_csr(assortments).shape[0])
+
+
+# Merges the identical assortments of the observations (Inventories, Proba_product) into an AssortmentData:
+# - the sales of a distinct assortment are the mean of the sales of its observations, weighted by their volumes
+# - its weight is the total volume of its observations, divided by the mean volume of an observation, so that the
+#   weights sum to the number of observations
+# volumes: volume (e.g. number of transactions) of each observation, of shape (nb_asst); None for the weights of
+# Inventories (1 for dense arrays)
+# Returns [data, inverse]: data holds the distinct assortments, and inverse[k] is the assortment of data of the
+# observation k
+def deduplicate(Inventories, Proba_product=None, volumes=None):
+    data = as_dataset(Inventories, Proba_product)
+    volumes = weights(data) if volumes is None else np.asarray(volumes, dtype=np.float64)
+    offers = data.offers
+    # each assortment is packed as a row of bits, one row of bytes per assortment
+    packed = np.zeros((data.nb_asst, (data.nb_prod + 7) // 8), dtype=np.uint8)
+    np.bitwise_or.at(packed, (data.asst_of_offer, offers.indices // 8),
+                     np.left_shift(1, 7 - offers.indices % 8).astype(np.uint8))
+    [first, inverse] = np.unique(packed, axis=0, return_index=True, return_inverse=True)[1:]
+    inverse = inverse.ravel()
+    nb_distinct = len(first)
+    # weighted sum of the observations of each distinct assortment, with the matrix of the observations by assortment
+    merge = sp.csr_matrix((volumes, (inverse, np.arange(data.nb_asst))), shape=(nb_distinct, data.nb_asst))
+    total_volumes = np.asarray(merge.sum(axis=1)).ravel()
+    sales = None
+    if data.sales is not None:
+        sales = sp.diags(1. / total_volumes) @ merge @ data.sales
+    return [AssortmentData(offers[first], sales, total_volumes / volumes.mean()), inverse]
+
+
+# Compresses the assortments into a weighted coreset of at most K representative assortments
+# The representatives are chosen by a farthest-first traversal (greedy k-center, from the heaviest assortment) for the
+# distance |v_m - v_c|_1 + OFFER_WEIGHT * |o_m - o_c|_1 between the sales v and the offers o of two assortments, and
+# each assortment is represented by its nearest representative. A representative keeps its offers; its sales are the
+# weighted mean of the sales of the assortments it represents, restricted to these offers (and rescaled to the same
+# total), and its weight is the sum of their weights.
+# Returns [data, assignment]: data holds the representatives, and assignment[m] is the representative of the
+# assortment m
+def coreset(Inventories, Proba_product=None, K=1000, offer_weight=OFFER_WEIGHT):
+    data = as_dataset(Inventories, Proba_product)
+    nb_asst = data.nb_asst
+    features = sp.hstack((data.sales, offer_weight * data.offers.astype(np.float64)), format='csr')
+    row_of = np.repeat(np.arange(nb_asst), np.diff(features.indptr))
+    norms = np.bincount(row_of, weights=np.abs(features.data), minlength=nb_asst)
+    distance = np.full(nb_asst, np.inf)
+    assignment = np.zeros(nb_asst, dtype=np.int64)
+    centers = []
+    center = int(np.argmax(weights(data)))
+    while len(centers) < min(K, nb_asst) and distance[center] > 0:
+        c = features[center].toarray().ravel()
+        c_nz = c[features.indices]
+        # |x - c|_1 = |x|_1 + |c|_1, corrected on the nonzeros of x
+        d = norms + np.abs(c).sum() + np.bincount(row_of, weights=np.abs(features.data - c_nz) - np.abs(features.data)
+                                                  - np.abs(c_nz), minlength=nb_asst)
+        d[center] = 0
+        closer = d < distance
+        distance[closer] = d[closer]
+        assignment[closer] = len(centers)
+        centers.append(center)
+        center = int(np.argmax(distance))
+
+    # weighted sum of the assortments represented by each representative
+    merge = sp.csr_matrix((weights(data), (assignment, np.arange(nb_asst))), shape=(len(centers), nb_asst))
+    total_weights = np.asarray(merge.sum(axis=1)).ravel()
+    mean_sales = sp.csr_matrix(sp.diags(1. / total_weights) @ merge @ data.sales)
+    ret = AssortmentData(data.offers[centers], mean_sales, total_weights)
+    totals = np.asarray(mean_sales.sum(axis=1)).ravel()
+    kept = np.asarray(ret.sales.sum(axis=1)).ravel()
+    ret.sales = sp.csr_matrix(sp.diags(np.divide(totals, kept, out=np.ones_like(kept), where=kept > 0)) @ ret.sales)
+    return [ret, assignment]
+
+
+# Returns the approximation error of a coreset (see coreset): the weighted mean of |v_m - v_rep(m)|_1 / 2 over the
+# assortments m, between the sales of m and the sales of its representative rep(m); in the units of compute_eps
+def coreset_error(Inventories, Proba_product, representatives, assignment):
+    data = as_dataset(Inventories, Proba_product)
+    difference = data.sales - sp.csr_matrix(representatives.sales)[assignment]
+    err = np.asarray(abs(difference).sum(axis=1)).ravel()
+    return (weights(data) * err).sum() / (2. * weights(data).sum())
+
+
+# Returns the assortments assts (indices or mask), in the same format as assortments
+def take(assortments, assts):
+    if isinstance(assortments, AssortmentData):
+        return assortments.take(assts)
+    return np.asarray(assortments)[assts, :]
+
+
+# Returns an AssortmentData holding the assortments of data, followed by the ones of new_data (e.g. a new batch of
+# transactions, see checkpoint.restore_learning)
+def append(data, new_data):
+    [data, new_data] = [as_dataset(data), as_dataset(new_data)]
+    sales = None
+    if data.sales is not None and new_data.sales is not None:
+        sales = sp.vstack((data.sales, new_data.sales))
+    weights_appended = None
+    if data.weights is not None or new_data.weights is not None:
+        weights_appended = np.concatenate((weights(data), weights(new_data)))
+    return AssortmentData(sp.vstack((data.offers, new_data.offers)), sales, weights_appended)
+
+
+# Splits the assortments at random into a training set and a validation set holding a fraction of them (at least one),
+# e.g. for the early stopping of the learning on the validation error (see utilities.Validation)
+# seed: seed of the random split, so that a learning resumed splits its data in the same way
+# Returns [train, validation], in the same format as assortments (and [Proba_product_train, Proba_product_validation]
+# after them for the dense arrays)
+def split(assortments, Proba_product=None, fraction=0.2, seed=0):
+    nb_asst = offers_csr(assortments).shape[0]
+    nb_validation = min(max(int(round(fraction * nb_asst)), 1), nb_asst - 1)
+    is_validation = np.zeros(nb_asst, dtype=bool)
+    is_validation[np.random.default_rng(seed).permutation(nb_asst)[:nb_validation]] = True
+    ret = [take(assortments, ~is_validation), take(assortments, is_validation)]
+    if Proba_product is not None:
+        ret += [np.asarray(Proba_product)[~is_validation, :], np.asarray(Proba_product)[is_validation, :]]
+    return ret
+
+
+# Returns the mask of the products present in at least one of the assortments, of shape (nb_prod)
+def products_offered(assortments):
+    offers = offers_csr(assortments)
+    ret = np.zeros(offers.shape[1], dtype=bool)
+    ret[offers.indices] = True
+    return ret
+#
+#############################
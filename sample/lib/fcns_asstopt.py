@@ -1,6 +1,7 @@
 import numpy as np
 import random
 from gurobipy import *
+import lib.rankings as rankings
 
 
 
@@ -126,7 +127,7 @@ def my_callback(m, where):
     if where == GRB.Callback.MIPSOL:
         nb_prod = m._nb_prod
         nb_col = m._nb_col
-        Sigma = m._Sigma
+        unranked = m._unranked
         sol_x = np.array(m.cbGetSolution([m._x[i] for i in range(nb_prod)])).astype(bool)
         #sol_y = np.array(m.cbGetSolution( [[m._y[k,i] for i in range(nb_prod)] for k in range(nb_col)] ))
         # extraction of the solutions found y
@@ -142,7 +143,7 @@ def my_callback(m, where):
             for i in real_products:
                 if(sol_x[i]):
                     for j in range(0, i):
-                        if sol_x[j] and Sigma[k, j] == Sigma[k, i]:
+                        if sol_x[j] and unranked[k, j] and unranked[k, i]:
                             #if the lazy constraint is violated, we add it
                             if (sol_y[k, i] - sol_y[k, j] > 2 - sol_x[i] - sol_x[j]):
                                 m.cbLazy(m._y[k, i] - m._y[k, j] <= 2 - m._x[i] - m._x[j])
@@ -155,11 +156,21 @@ def my_callback(m, where):
 
             #############################
     #  Main function: run_asstopt_GDT runs the assortment optimization problem for choice models WITH INDIFFERENCE
+    #  Sigma may be the dense sigmas or a rankings.RankingModel (Lambda=None); the constraints are built from the prefixes
     #
 def run_asstopt_GDT(Lambda, Sigma, Revenue, min_capacity, max_capacity, verbose=False):
 
     # definition of the parameters according to the data
-    (nb_col, nb_prod) = Sigma.shape
+    if not isinstance(Sigma, rankings.RankingModel):
+        Sigma = rankings.RankingModel.from_dense(Sigma, Lambda)
+    Lambda = Sigma.lambdas
+    (nb_col, nb_prod) = (len(Sigma), Sigma.nb_prod)
+    # position[k,j] is the rank of the product j in the column k; len(prefix) for the products not ranked
+    position = np.empty((nb_col, nb_prod), dtype=np.int64)
+    for k in range(nb_col):
+        position[k, :] = len(Sigma.prefix(k))
+        position[k, Sigma.prefix(k)] = np.arange(len(Sigma.prefix(k)))
+    unranked = position == Sigma.lengths()[:, None]
     # creation of a GurubiPython instance
     model = Model('MIO')
     model.setParam('OutputFlag', verbose)
@@ -206,24 +217,17 @@ def run_asstopt_GDT(Lambda, Sigma, Revenue, min_capacity, max_capacity, verbose=
         for i in real_products:
             model.addConstr(y[k, i] <= x[i], name='%s_must_be_in_asst_TBC_by_permutation_%s' % (i, k))
 
+    # only the ranked products have less preferred products: the products after them in the prefix, and the products
+    # not ranked
     for k in range(nb_col):
-        for i in real_products:
-            new_constraint = LinExpr()
-            new_constraint = 0
-            for j in range(nb_prod):
-                if Sigma[k, j] > Sigma[k, i]:
-                    new_constraint += y[k, j]
-            model.addConstr(new_constraint <= 1 - x[i],
+        for i in Sigma.prefix(k):
+            model.addConstr(quicksum(y[k, j] for j in np.where(position[k, :] > position[k, i])[0]) <= 1 - x[i],
                             name='less_prefered_than_%s_not_included_for_permutation_%s' % (i, k))
 
     for k in range(nb_col):
-        new_constraint = LinExpr()
-        new_constraint = 0
-        for j in real_products:
-            if Sigma[k, j] > Sigma[k, 0]:
-                new_constraint += y[k, j]
-        model.addConstr(new_constraint, GRB.EQUAL, 0,
-                        name='less_prefered_than_NO_PURCHASE_not_included_for_permutation_%s' % k)
+        if not unranked[k, 0]:
+            model.addConstr(quicksum(y[k, j] for j in np.where(position[k, :] > position[k, 0])[0]) == 0,
+                            name='less_prefered_than_NO_PURCHASE_not_included_for_permutation_%s' % k)
 
     # no more than max_capacity products per assortment: capacity constraint
     model.addConstr(quicksum(x[i] for i in range(nb_prod)) <= max_capacity + 1, name='capacity_constraint')
@@ -236,7 +240,7 @@ def run_asstopt_GDT(Lambda, Sigma, Revenue, min_capacity, max_capacity, verbose=
     # Compute optimal solution
     model._nb_col = nb_col
     model._nb_prod = nb_prod
-    model._Sigma = Sigma
+    model._unranked = unranked
     model._x = x
     model._y = y
     model.update()
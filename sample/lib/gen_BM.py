@@ -1,8 +1,12 @@
 import numpy as np
 import time
 from random import randint
-from gurobipy import *
 import lib.utilities as utilities
+import lib.choice_engine as choice_engine
+import lib.dataset as dataset
+import lib.column_pool as column_pool
+import lib.master_backends as master_backends
+import lib.checkpoint as checkpoint
 
 #############################
 #  Parameters of BM algorithm
@@ -23,92 +27,161 @@ NB_COLS_TO_KEEP = 1
 #############################
 #  run_BM runs the BM algorithm, generating columns at each iteration and optimizing with repeated calls to the master problem
 #  inputs: Inventories, sales data Proba_product, stop criterion ITERATIONS_MAX and eps_stop
+#  Inventories may also be a dataset.AssortmentData holding the sales (Proba_product=None)
+#  column_store: None to keep the columns generated in RAM, or a directory of the local disk where they are memory-mapped
+#  (see column_pool), for the long runs
+#  backend: solver of the master problem, one of master_backends.BACKENDS ('gurobi', 'highs', 'scipy')
+#  smoothing: weight of the stability center in the duals used by the pricing (see utilities.DualSmoothing), 0 for none,
+#  None for utilities.dual_smoothing
+#  stopping: a utilities.StoppingPolicy for more stopping criteria, or None for ITERATIONS_MAX and eps_stop only; its
+#  criterion tells which one fired. The model returned is the best one found (lowest objective of the master).
+#  checkpointer: a checkpoint.Checkpointer writing checkpoints of the learning, or None
+#  resume: if True, the learning goes on from the last checkpoint of checkpointer, instead of starting from scratch; the
+#  data must be the one of the learning checkpointed, possibly followed by new assortments to update the choice model
+#  (see checkpoint.restore_learning)
+#  validation: hold-out assortments, as a dataset.AssortmentData holding their sales, or None; their error is tracked
+#  at each iteration (see utilities.Validation), the learning stops when it does not improve anymore (criterion
+#  'validation' of stopping) and the model returned is the one of lowest validation error
 #  returns a BM choice model (sigma_GDT_sorted, lambda_GDT_sorted), as well as the history of reduced costs to track the learning efficiency
-def run_BM(Inventories, Proba_product, ITERATIONS_MAX=10, eps_stop=0):
-    
+def run_BM(Inventories, Proba_product, ITERATIONS_MAX=10, eps_stop=0, column_store=None, backend='gurobi',
+           smoothing=None, stopping=None, checkpointer=None, resume=False, validation=None):
+    t1 = time.time()
     #to print the line of progress. Only possible when the ITERATIONS_MAX stop criterion is used.
     if(eps_stop==0):
         utilities.startProgress("Progress of iterations:")
 
     #if eps_stop=0, then we use the number of iterations specified as stop criterion
     #if eps_stop=0, then the stop criteron becomes obj < obj_stop=eps_stop*2*len(Inventories)
+    #(len(Inventories) being the sum of the weights of the assortments, see dataset.weights)
     if eps_stop>0:
-        obj_stop = eps_stop*2*len(Inventories)
+        obj_stop = eps_stop*2*dataset.weights(Inventories).sum()
         ITERATIONS_MAX = 10**9 #should not be limited by this number of iteration
     else:
         obj_stop=0
+    stopping = utilities.stopping_policy(stopping, obj_stop, ITERATIONS_MAX)
     
     
-    nb_prod = len(Inventories.T)
-    nb_asst = len(Inventories)
+    (nb_asst, nb_prod) = Inventories.shape
     
     #to store the history of the reduced costs
     history_obj_val = np.zeros(1, dtype=np.float32)
     
     #Initializations
-    v = Proba_product.T#to be consistent in notation with BM
-    sigma_CG = np.zeros((1,nb_prod))
-    A=np.zeros((1, nb_prod,nb_asst))
+    v = dataset.sales_array(Inventories, Proba_product).T#to be consistent in notation with BM
+    #the sigmas and A are appended to the pool of columns: pool.sigma() and pool.A() are views on all the columns
+    #A is stored in the compact encoding of choice_engine: the product chosen by each column in each assortment
+    pool = column_pool.ColumnPool(nb_prod, nb_asst, directory=column_store)
+    #the model of the master problem, solved by the backend chosen
+    model = utilities.RestrictedMaster(master_backends.new_master(backend))
+    stabilization = utilities.DualSmoothing(v, smoothing)
+    first_iteration = 0
     
-    #we begin the first phase: warm start
-    for first_cols in range(FIRST_RANDOM_COLS):
-        sigma_found = random_sigma_first_fixed(nb_prod, first_cols%nb_prod, randint(0,nb_prod-1))
-        [A, sigma_CG] = formatting(A, sigma_CG, sigma_found, nb_prod, Inventories, first_cols)
-
-    # first call to restricted master: we initialize the GUROBI model
-    model = Model('finding_lambda')
+    if resume:
+        #the columns, the master (warm started), the variables of the loop and the RNGs of the last checkpoint; with new
+        #assortments, the variables are None and the master restored is solved again
+        [first_iteration, variables] = checkpoint.restore_learning(checkpoint.load(checkpointer.filename, 'BM'), pool,
+                                                                   model, stabilization, stopping, v, Inventories, False)
+        if variables is not None:
+            [lambda_found, alpha_found, nu_found, obj_val_master, best_lambda, best_obj_val, history_obj_val] = variables
+        else:
+            [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = \
+                utilities.restricted_master(pool.A(), v, Inventories, model, verbose=False)
+            history_obj_val[0] = obj_val_master
+            [best_lambda, best_obj_val] = [np.copy(lambda_found), obj_val_master]
+    else:
+        #we begin the first phase: warm start
+        for first_cols in range(FIRST_RANDOM_COLS):
+            sigma_found = random_sigma_first_fixed(nb_prod, first_cols%nb_prod, randint(0,nb_prod-1))
+            add_column(pool, sigma_found, Inventories)
 
-    [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = \
-        utilities.restricted_master(A, v, model, verbose=False)
-    
-    #we save the objective value of this iteration
-    history_obj_val[0] = obj_val_master
-    
-    #cleaning the unusefull columns (associated to a lambda null)
-    [lambda_found, sigma_CG, A, nb_col_gen]= clean_columns(lambda_found, sigma_CG, A)
+        # first call to restricted master: we initialize the model of the master problem
+        [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = \
+            utilities.restricted_master(pool.A(), v, Inventories, model, verbose=False)
+        
+        #we save the objective value of this iteration
+        history_obj_val[0] = obj_val_master
+        
+        #cleaning the unusefull columns (associated to a lambda null), in the pool and in the master
+        model.keep_columns(lambda_found != 0)
+        pool.compact(lambda_found != 0)
+        lambda_found = lambda_found[lambda_found != 0]
+        
+        #reoptimization, without the unusefull columns
+        [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = \
+            utilities.restricted_master(pool.A(), v, Inventories, model, verbose=False)
+        #end of the warm start phase
+        #the best model found: its lambda over the columns of the pool, and its objective
+        [best_lambda, best_obj_val] = [np.copy(lambda_found), obj_val_master]
     
-    #reoptimization, without the unusefull columns
-    [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = \
-        utilities.restricted_master(A, v, model, verbose=False)
-    #end of the warm start phase
+    #the validation error of the models, and the lowest one so far
+    validation_set = None if validation is None else utilities.Validation(validation, None, False)
+    best_validation_error = min(stopping.validation_history, default=np.inf)
     
     #Loop for column generation
     #At each iteration, we add NB_COLS_TO_KEEP new columns to the matrix of choices A
-    for w in range(ITERATIONS_MAX):
+    for w in range(first_iteration, ITERATIONS_MAX):
         #we generate NB_COLS_TO_FIND, and we select the NB_COLS_TO_KEEP best
         collection_found = np.full((NB_COLS_TO_FIND), False, dtype=bool)
         collection_sigma_found = np.full((NB_COLS_TO_FIND, nb_prod), 0, dtype=np.int32)
         collection_red_cost_new_sigma = np.full((NB_COLS_TO_FIND), 100, dtype=np.float32)
         for i in range(NB_COLS_TO_FIND):
-            [collection_found[i], collection_sigma_found[i,:], collection_red_cost_new_sigma[i]] = looking_for_new_column(alpha_found, nu_found, Inventories, nb_prod, TENACITY)
+            [collection_found[i], collection_sigma_found[i,:], collection_red_cost_new_sigma[i]] = looking_for_new_column(alpha_found, nu_found, Inventories, nb_prod, TENACITY, stabilization)
             #selection of the NB_COLS_TO_KEEP best columns
         #the arguments of the NB_COLS_TO_KEEP best reduced costs. The [collection_found] is there to ensure to prevent from taking positive reduced costs
         argts_cols_to_keep = collection_red_cost_new_sigma[collection_found].argsort()[:NB_COLS_TO_KEEP]
         
         # if we have found at least one column, then we add it
+        bound = None
         if(len(argts_cols_to_keep)!=0):
             sigma_to_keep = collection_sigma_found[collection_found][argts_cols_to_keep]
             red_costs_to_keep = collection_red_cost_new_sigma[collection_found][argts_cols_to_keep]
+            #Lagrangian bound at the duals of this iteration
+            bound = obj_val_master + red_costs_to_keep.min()
             #we add the found columns into A and sigma
             for i in range(len(red_costs_to_keep)):
-                [A, sigma_CG] = formatting(A, sigma_CG, sigma_to_keep[i], nb_prod, Inventories, 1)
+                add_column(pool, sigma_to_keep[i], Inventories)
             #execution of the master problem
-            [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = utilities.restricted_master(A, v, model, verbose=False)
+            [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = utilities.restricted_master(pool.A(), v, Inventories, model, verbose=False)
             history_obj_val = np.append(history_obj_val, obj_val_master)
+            if validation_set is None and obj_val_master < best_obj_val:
+                [best_lambda, best_obj_val] = [np.copy(lambda_found), obj_val_master]
         else:
             print("No column found at iteration", w)
+        
+        #the validation error of the model of this iteration; the model kept is then the one of lowest validation error
+        validation_error = None
+        if validation_set is not None:
+            validation_error = validation_set.error(pool.sigma(), lambda_found)
+            if validation_error < best_validation_error:
+                [best_lambda, best_obj_val, best_validation_error] = \
+                    [np.copy(lambda_found), obj_val_master, validation_error]
                 
         #updating the progress bar
         if(eps_stop==0):
             utilities.progress(100*w/ITERATIONS_MAX)
         
-        #Check if we have to stop because obj_stop is achieved 
-        if(obj_stop>0 and obj_val_master < obj_stop):
+        #Check if we have to stop, by one of the criteria of stopping
+        stop = stopping.check(obj_val_master, len(pool), bound, validation_error)
+        #the checkpoint is copied here, and written in the background
+        if checkpointer is not None and not stop and checkpointer.due(w + 1):
+            checkpointer.save(w + 1, checkpoint.learning_state(
+                'BM', w + 1, [lambda_found, alpha_found, nu_found, obj_val_master, best_lambda, best_obj_val,
+                              history_obj_val], pool, model, stabilization, stopping))
+        if stop:
             break
     
-    #we keep only the nonzero components of lambda, and sigma associated
-    a = sigma_CG[np.nonzero(lambda_found)]
+    #the last state of the learning is checkpointed, to update the choice model later with new assortments
+    if checkpointer is not None:
+        checkpointer.save(len(stopping.history), checkpoint.learning_state(
+            'BM', len(stopping.history), [lambda_found, alpha_found, nu_found, obj_val_master, best_lambda,
+                                          best_obj_val, history_obj_val], pool, model, stabilization, stopping))
+        checkpointer.close()
+    
+    #we keep only the nonzero components of the best lambda, and sigma associated
+    [lambda_found, obj_val_master] = [best_lambda, best_obj_val]
+    a = pool.take(np.nonzero(lambda_found)[0])[0]
     b = lambda_found[np.nonzero(lambda_found)]
+    pool.close()
     #we sort the columns by order of lambda
     sigma_CG_sorted = a[np.argsort(b),:][::-1]
     lambda_CG_sorted = b[np.argsort(b)][::-1]
@@ -116,6 +189,8 @@ def run_BM(Inventories, Proba_product, ITERATIONS_MAX=10, eps_stop=0):
     #to close the connection to the line of progress
     if(eps_stop==0):
         utilities.endProgress()
+    t2 = time.time()
+    utilities.report_convergence(stopping, len(history_obj_val) - 1, t2 - t1, stabilization)
     
     return [sigma_CG_sorted, lambda_CG_sorted, obj_val_master, history_obj_val]
 #
@@ -184,16 +259,14 @@ def neighboors(sigma):
         ret[i,j1] = i
     return ret
     
+#same choices as product_chosen on each assortment, computed by the batched choice engine (no indifference in BM)
 def sigma2a(sigma, assortments):
-    nb_asst = len(assortments)
-    nb_prod = len(sigma)
-    ret = np.zeros((nb_prod, nb_asst))    
-    for m in range(nb_asst):
-        ret[ int(product_chosen(sigma, assortments[m][:])) , m] = 1
-    return ret
+    return choice_engine.batch_sigma2a(np.reshape(sigma, (1, -1)), assortments, indifference=False)[0]
     
+#gather of alpha on the products chosen by sigma (compact encoding of choice_engine)
 def reduced_cost(sigma, alpha, nu, Inventories):
-    return - np.sum(np.sum((alpha * sigma2a(sigma, Inventories)), axis=0), axis=0) - nu
+    chosen = choice_engine.batch_choices(np.reshape(sigma, (1, -1)), Inventories, indifference=False)
+    return choice_engine.reduced_costs(chosen, alpha, nu, Inventories)[0]
     
 def find_local_opt(sigma, alpha, nu, Inventories, verbose=False):
     nb_prod = len(sigma)
@@ -214,29 +287,34 @@ def find_local_opt(sigma, alpha, nu, Inventories, verbose=False):
         return(find_local_opt(neighboors_sigma[i_min], alpha, nu, Inventories, verbose))
 
 
-def clean_columns(lambdas, sigmas, A):
-    mask = ~np.in1d(lambdas, 0)
-    return [lambdas[mask], sigmas[mask,:], A[mask,:,:], len(lambdas[mask])]
-
-#Concatenate sigma_found to the good shape into a new column of A and into sigma_CG
-def formatting(A, sigma_CG, sigma_found, nb_prod, Inventories, first_cols):
-    sigma_found_2D = np.zeros((1,nb_prod))
-    sigma_found_2D[0,:] = sigma_found[:]
-    a_found = sigma2a(sigma_found, Inventories)
-    
-    if first_cols == 0:
-        sigma_CG[first_cols,:] = sigma_found[:]    
-        A[0,:,:] = a_found
-    else:
-        sigma_CG = np.concatenate((sigma_CG, sigma_found_2D), axis=0)
-        aa_found = np.zeros((1, nb_prod,len(Inventories)))
-        aa_found[0,:,:] = a_found
-        A = np.concatenate((A, aa_found), axis=0)
-    return [A, sigma_CG]
+#Appends sigma_found and its column of A to the pool of columns
+def add_column(pool, sigma_found, Inventories):
+    sigma_found_2D = np.asarray(sigma_found).reshape((1, -1))
+    pool.append(sigma_found_2D, choice_engine.batch_choices(sigma_found_2D, Inventories, indifference=False))
 
 #looking for a column to add
-def looking_for_new_column(alpha_found, nu_found, Inventories, nb_prod, TENACITY):
+#stabilization: a utilities.DualSmoothing, or None; if active, the local searches are first run at the smoothed duals,
+#and then at alpha_found, nu_found if the column found there has no negative reduced cost for alpha_found, nu_found
+#the reduced cost returned is always the one for alpha_found, nu_found
+def looking_for_new_column(alpha_found, nu_found, Inventories, nb_prod, TENACITY, stabilization=None):
+    if stabilization is not None and stabilization.active():
+        [alpha_smoothed, nu_smoothed] = stabilization.pricing_point(alpha_found, nu_found)
+        [found, sigma_found, red_cost] = local_search_column(alpha_smoothed, nu_smoothed, Inventories, nb_prod, TENACITY)
+        if found:
+            stabilization.update(alpha_smoothed, nu_smoothed, red_cost)
+            red_cost = reduced_cost(sigma_found, alpha_found, nu_found, Inventories)
+            if red_cost < -0.0001:
+                return [found, sigma_found, red_cost]
+        stabilization.nb_mispricings += 1
+    [found, sigma_found, red_cost] = local_search_column(alpha_found, nu_found, Inventories, nb_prod, TENACITY)
+    if stabilization is not None and found:
+        stabilization.update(alpha_found, nu_found, red_cost)
+    return [found, sigma_found, red_cost]
+
+#runs up to TENACITY local searches from random sigmas, until a column with a negative reduced cost is found
+def local_search_column(alpha_found, nu_found, Inventories, nb_prod, TENACITY):
     found = False
+    red_cost = 0
     for j in range(TENACITY):
         sigma_found = find_local_opt(random_sigma(nb_prod), alpha_found, nu_found, Inventories, False)
         if reduced_cost(sigma_found, alpha_found, nu_found, Inventories) <  -0.0001:
@@ -1,15 +1,56 @@
 import numpy as np
+import scipy.sparse as sp
 import time
-from gurobipy import *
 import lib.utilities as utilities
+import lib.choice_engine as choice_engine
+import lib.dataset as dataset
+import lib.rankings as rankings
+import lib.column_pool as column_pool
+import lib.master_backends as master_backends
+import lib.checkpoint as checkpoint
 
+# mini-batch learning (see run_GDT_minibatch): the master is solved on the full data every FULL_SOLVE_EVERY iterations
+FULL_SOLVE_EVERY = 10
 
 
 #############################
 #  run_GDT runs the GDT algorithm, generating columns at each iteration and optimizing with repeated calls to the master problem
 #  inputs: Inventories, sales data Proba_product, stop criterion ITERATIONS_MAX and eps_stop
+#  Inventories may also be a dataset.AssortmentData holding the sales (Proba_product=None)
+#  column_store: None to keep the columns generated in RAM, or a directory of the local disk where they are memory-mapped
+#  (see column_pool), for the long runs
+#  backend: solver of the master problem, one of master_backends.BACKENDS ('gurobi', 'highs', 'scipy')
+#  smoothing: weight of the stability center in the duals used by the pricing (see utilities.DualSmoothing), 0 for none,
+#  None for utilities.dual_smoothing
+#  batch_size: if > 0 and smaller than the number of assortments, the learning runs on mini-batches of batch_size
+#  assortments (see run_GDT_minibatch)
+#  stopping: a utilities.StoppingPolicy for more stopping criteria, or None for ITERATIONS_MAX and eps_stop only; its
+#  criterion tells which one fired. The model returned is the best one found (lowest objective of the master).
+#  checkpointer: a checkpoint.Checkpointer writing checkpoints of the learning, or None; not with mini-batches
+#  resume: if True, the learning goes on from the last checkpoint of checkpointer, instead of starting from scratch; the
+#  data must be the one of the learning checkpointed, possibly followed by new assortments to update the choice model
+#  (see checkpoint.restore_learning)
+#  validation: hold-out assortments, as a dataset.AssortmentData holding their sales, or None; their error is tracked
+#  at each iteration (see utilities.Validation), the learning stops when it does not improve anymore (criterion
+#  'validation' of stopping) and the model returned is the one of lowest validation error
+#  branching: a utilities.BranchingSchedule giving the number of nodes expanded and of children kept at each iteration,
+#  or None for the schedule set in utilities (adaptive_branching); its log holds the values chosen at each iteration
+#  pricing: 'sampled' to expand the branching.nodes columns drawn by choose_n at each iteration, or 'exhaustive' to
+#  score the children of all the columns which have not ranked the no-choice option (see
+#  exhaustive_lowest_reduced_cost), or None for utilities.gdt_pricing; the branching.children children of lowest reduced
+#  costs are added
 #  returns a GDT choice model (sigma_GDT_sorted, lambda_GDT_sorted), as well as the history of reduced costs to track the learning efficiency
-def run_GDT(Inventories, Proba_product, ITERATIONS_MAX=10, eps_stop=0):
+def run_GDT(Inventories, Proba_product, ITERATIONS_MAX=10, eps_stop=0, column_store=None, backend='gurobi',
+            smoothing=None, batch_size=0, stopping=None, checkpointer=None, resume=False,
+            validation=None, branching=None, pricing=None):
+    pricing = utilities.setting(pricing, 'gdt_pricing')
+    if pricing not in ['sampled', 'exhaustive']:
+        raise Exception('Unknown pricing ' + str(pricing) + ' of the GDT')
+    if 0 < batch_size < len(Inventories):
+        if checkpointer is not None or validation is not None:
+            raise Exception('The mini-batch learning does not write checkpoints, nor track a validation error')
+        return run_GDT_minibatch(Inventories, Proba_product, ITERATIONS_MAX, eps_stop, column_store, backend, batch_size,
+                                 stopping=stopping, branching=branching, pricing=pricing)
     t1 = time.time()
     # to print the line of progress. Only possible when the ITERATIONS_MAX stop criterion is used.
     if (eps_stop == 0):
@@ -17,87 +58,150 @@ def run_GDT(Inventories, Proba_product, ITERATIONS_MAX=10, eps_stop=0):
 
     # if eps_stop=0, then we use the number of iterations specified as stop criterion
     # if eps_stop=0, then the stop criteron becomes obj < obj_stop=eps_stop*2*len(Inventories)
+    # (len(Inventories) being the sum of the weights of the assortments, see dataset.weights)
     if eps_stop > 0:
-        obj_stop = eps_stop * 2 * len(Inventories)
+        obj_stop = eps_stop * 2 * dataset.weights(Inventories).sum()
         ITERATIONS_MAX = 10 ** 9  # should not be limited by this number of iteration
     else:
         obj_stop = 0
+    stopping = utilities.stopping_policy(stopping, obj_stop, ITERATIONS_MAX)
 
     # definition of the parameters according to the data
     (nb_asst, nb_prod) = Inventories.shape
     # Inventories=Inventories.astype(bool)#to use the ivt as selectors
-    v = Proba_product.T  # to be consistent with the notations of the article of BM
-
-    # definition of P: the total number of products in all assortments
-    P = (Inventories == True).sum()
+    v = dataset.sales_array(Inventories, Proba_product).T  # to be consistent with the notations of the article of BM
     # print("worst CM when obj_val=", 2*nb_asst)
     # to store the history of the reduced costs and of the time_method
     history_obj_val = np.zeros(1, dtype=np.float32)
     history_time_method = np.zeros(1, dtype=np.float32)
 
-    # Initialization: we built nb_prod possible columns of A, as specified in the thesis
-    # nb_col = nb_prod#for the initialization
-    sigma_GDT = np.full((nb_prod, nb_prod), fill_value=nb_prod - 1, dtype=np.int32)
-    A = np.full((nb_prod, nb_prod, nb_asst), fill_value=0,
-                dtype=np.float64)  # first component is the number of columns generated at the begining
-    for k in range(nb_prod):
-        sigma_GDT[k, k] = 0
-        A[k, :, :] = sigma2a(sigma_GDT[k, :], Inventories)
-
-    # first call to restricted master: we initialize the GUROBI model
-    model = Model('finding_lambda')
-
-    [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = \
-        utilities.restricted_master(A, v, model, verbose=False)
-    history_obj_val[0] = obj_val_master
-    history_time_method[0] = time_method
+    # A is stored in the compact encoding of choice_engine: the product chosen by each column in each assortment
+    # (-1 if indifferent), of shape (nb_col, nb_asst)
+    # the sigmas and A are appended to the pool of columns: pool.sigma() and pool.A() are views on all the columns
+    pool = column_pool.ColumnPool(nb_prod, nb_asst, directory=column_store)
+    # the model of the master problem, solved by the backend chosen
+    model = utilities.RestrictedMaster(master_backends.new_master(backend))
+    stabilization = utilities.DualSmoothing(v, smoothing)
+    if branching is None:
+        branching = utilities.BranchingSchedule()
+    first_iteration = 0
+    variables = None
+
+    if resume:
+        # the columns, the master (warm started), the variables of the loop and the RNGs of the last checkpoint; with
+        # new assortments, the variables are None
+        [first_iteration, variables] = checkpoint.restore_learning(checkpoint.load(checkpointer.filename, 'GDT'), pool,
+                                                                   model, stabilization, stopping, v, Inventories, True)
+    else:
+        # Initialization: we built nb_prod possible columns of A, as specified in the thesis
+        # nb_col = nb_prod#for the initialization
+        sigma_GDT = np.full((nb_prod, nb_prod), fill_value=nb_prod - 1, dtype=np.int32)
+        for k in range(nb_prod):
+            sigma_GDT[k, k] = 0
+        pool.append(sigma_GDT, choice_engine.batch_choices(sigma_GDT, Inventories))
+
+    if variables is not None:
+        [lambda_found, alpha_found, nu_found, obj_val_master, best_lambda, best_obj_val, history_obj_val,
+         history_time_method, branching_state] = variables
+        branching.restore(branching_state)
+    else:
+        # first call to restricted master: we initialize the model of the master problem (or solve the master restored)
+        [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = \
+            utilities.restricted_master(pool.A(), v, Inventories, model, verbose=False)
+        history_obj_val[0] = obj_val_master
+        history_time_method[0] = time_method
+        # the best model found: its lambda over the columns of the pool, and its objective
+        [best_lambda, best_obj_val] = [np.copy(lambda_found), obj_val_master]
 
-    rc = reduced_cost_matrix(A, alpha_found, nu_found)
+    # the validation error of the models, and the lowest one so far
+    validation_set = None if validation is None else utilities.Validation(validation, None, True)
+    best_validation_error = min(stopping.validation_history, default=np.inf)
 
     # Iterations of the columns generation procedure
     # if stop criterion is the maximum number of iterations, then we stop after ITERATIONS_MAX iterations
-    for w in range(ITERATIONS_MAX):
+    for w in range(first_iteration, ITERATIONS_MAX):
 
         # We do not want to consider splitting a consumer's behavior that has already put the no-choice option in the sequence
         # the consumer's behaviors that already have ranked the no-choice option are therefore excluded from the set of set_k_possible
         lambda_found_bis = np.copy(lambda_found)
-        lambda_found_bis[(sigma_GDT[:, 0] != nb_prod - 1)] = 0
+        lambda_found_bis[(pool.sigma()[:, 0] != nb_prod - 1)] = 0
         if (lambda_found_bis.sum() <= 0.01):  # then nearly all columns have a 0 ranked
             print("Nearly all columns have a 0 ranked: we stop the learning")
+            stopping.stop('no column to split')
             break
 
-        # We choose 10 random columns with depending on the probability distribution lambda_found_bis
-        set_k_possible = choose_n(utilities.repair_lambda(lambda_found_bis), 10)
-
-        # chooses the N lowest reduced costs among the branches of lambda_found, and returns the new_sigma_GDT with the new sigmas
-        [new_sigma_GDT, new_A, new_rc] = lowest_reduced_cost(set_k_possible, sigma_GDT, nb_prod, alpha_found, nu_found,
-                                                             Inventories, 20)
+        t_pricing = time.time()
+        if pricing == 'exhaustive':
+            # the N lowest reduced costs among the branches of all the columns which have not ranked the no-choice option
+            [new_sigma_GDT, new_A, new_rc] = exhaustive_lowest_reduced_cost(pool, nb_prod, alpha_found, nu_found,
+                                                                            Inventories, branching.children,
+                                                                            stabilization)
+        else:
+            # We choose branching.nodes random columns with depending on the probability distribution lambda_found_bis
+            set_k_possible = choose_n(utilities.repair_lambda(lambda_found_bis), branching.nodes)
+
+            # chooses the N lowest reduced costs among the branches of lambda_found, and returns the new_sigma_GDT with the new sigmas
+            [new_sigma_GDT, new_A, new_rc] = lowest_reduced_cost(set_k_possible, pool.sigma(), pool.A(), nb_prod,
+                                                                 alpha_found, nu_found, Inventories, branching.children,
+                                                                 stabilization)
+        pricing_time = time.time() - t_pricing
         #print("new_rc", new_rc)
-        # concatenates sigma, A
-        sigma_GDT = np.concatenate((sigma_GDT, new_sigma_GDT), axis=0)
-        A = np.concatenate((A, new_A), axis=0)
+        # Lagrangian bound at the duals of this iteration
+        bound = obj_val_master + new_rc.min() if len(new_rc) > 0 else None
+        # appends sigma, A to the pool
+        pool.append(new_sigma_GDT, new_A)
 
-        nb_col = len(A)
+        nb_col = len(pool)
 
+        t_master = time.time()
         [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = \
-            utilities.restricted_master(A, v, model, verbose=False)
+            utilities.restricted_master(pool.A(), v, Inventories, model, verbose=False)
+        # the numbers of nodes and children of the next iteration
+        branching.record(pricing_time, time.time() - t_master, new_rc)
 
         history_obj_val = np.append(history_obj_val, obj_val_master)
         history_time_method = np.append(history_time_method, time_method)
+        validation_error = None
+        if validation_set is None:
+            if obj_val_master < best_obj_val:
+                [best_lambda, best_obj_val] = [np.copy(lambda_found), obj_val_master]
+        else:
+            validation_error = validation_set.error(pool.sigma(), lambda_found)
+            if validation_error < best_validation_error:
+                [best_lambda, best_obj_val, best_validation_error] = \
+                    [np.copy(lambda_found), obj_val_master, validation_error]
 
         # updating the progress bar
         if (eps_stop == 0):
             utilities.progress(100 * w / ITERATIONS_MAX)
 
-        # checking the stop criterion if this is not with a defined number of iterations
-        if (obj_stop > 0 and obj_val_master < obj_stop):
+        # checking the stop criteria
+        stop = stopping.check(obj_val_master, len(pool), bound, validation_error)
+        # the checkpoint is copied here, and written in the background
+        if checkpointer is not None and not stop and checkpointer.due(w + 1):
+            checkpointer.save(w + 1, checkpoint.learning_state(
+                'GDT', w + 1, [lambda_found, alpha_found, nu_found, obj_val_master, best_lambda, best_obj_val,
+                               history_obj_val, history_time_method, branching.state()],
+                pool, model, stabilization, stopping))
+        if stop:
             break
         else:
             print(obj_val_master, "> value fixed=", obj_stop)
-
-    # we keep only the nonzero components of lambda, and sigma associated
-    a = sigma_GDT[np.nonzero(lambda_found)]
+            branching.report()
+
+    # the last state of the learning is checkpointed, to update the choice model later with new assortments
+    if checkpointer is not None:
+        checkpointer.save(len(stopping.history), checkpoint.learning_state(
+            'GDT', len(stopping.history), [lambda_found, alpha_found, nu_found, obj_val_master, best_lambda,
+                                           best_obj_val, history_obj_val, history_time_method, branching.state()],
+            pool, model, stabilization, stopping))
+        checkpointer.close()
+
+    # we keep only the nonzero components of the best lambda, and sigma associated
+    [lambda_found, obj_val_master] = [best_lambda, best_obj_val]
+    a = pool.take(np.nonzero(lambda_found)[0])[0]
     b = lambda_found[np.nonzero(lambda_found)]
+    pool.close()
     # we sort the columns by order of lambda
     sigma_GDT_sorted = a[np.argsort(b), :][::-1]
     lambda_GDT_sorted = b[np.argsort(b)][::-1]
@@ -108,6 +212,7 @@ def run_GDT(Inventories, Proba_product, ITERATIONS_MAX=10, eps_stop=0):
     t2=time.time()
     print("Time to compute:", history_time_method)
     print("total time:", t2-t1)
+    utilities.report_convergence(stopping, len(history_obj_val) - 1, t2 - t1, stabilization)
     return [sigma_GDT_sorted, lambda_GDT_sorted, obj_val_master, history_obj_val]
 
 
@@ -117,43 +222,264 @@ def run_GDT(Inventories, Proba_product, ITERATIONS_MAX=10, eps_stop=0):
 
 
 
+#############################
+#  run_GDT_minibatch runs the GDT algorithm on rotating mini-batches of assortments, for the data sets with a large
+#  number of assortments: the time of an iteration depends on batch_size, not on the number of assortments
+#  - the assortments are shuffled once and split into batches of batch_size; the iteration w works on the batch
+#    w % nb_batches: its master is solved on the columns found so far, and the children of its columns are priced on it
+#  - each batch keeps its own pool of columns (their choices on the batch only) and its own master, warm started from
+#    one visit to the next; the choices of a column on a batch are computed when it first visits this batch
+#  - every full_solve_every iterations, and at the end, the master is solved on the full data: its objective is the
+#    history returned, the stopping criteria are checked on it, and the choice model returned is its solution
+#  - the branching schedule is adapted from the times of the pricing and of the master solve on the batches
+#  - as in run_GDT, the learning stops with the criterion 'no column to split' when no batch adds a column during a
+#    full rotation of the batches: all of them have seen all the columns, so that nothing can change anymore
+#  same inputs and outputs as run_GDT
+def run_GDT_minibatch(Inventories, Proba_product, ITERATIONS_MAX=10, eps_stop=0, column_store=None, backend='gurobi',
+                      batch_size=1000, full_solve_every=FULL_SOLVE_EVERY, stopping=None, branching=None,
+                      pricing=None):
+    t1 = time.time()
+    pricing = utilities.setting(pricing, 'gdt_pricing')
+    if eps_stop > 0:
+        obj_stop = eps_stop * 2 * dataset.weights(Inventories).sum()
+        ITERATIONS_MAX = 10 ** 9  # should not be limited by this number of iteration
+    else:
+        obj_stop = 0
+    # the criterion 'iterations' is checked after the last iteration
+    stopping = utilities.stopping_policy(stopping, obj_stop, 10 ** 9)
+    if branching is None:
+        branching = utilities.BranchingSchedule()
+
+    data = dataset.as_dataset(Inventories, Proba_product)
+    (nb_asst, nb_prod) = data.shape
+    v = data.sales_array().T
+
+    # the columns found so far, by blocks (one block per iteration): sigma_blocks[b] are the sigmas of the block b
+    sigma_GDT = np.full((nb_prod, nb_prod), fill_value=nb_prod - 1, dtype=np.int32)
+    for k in range(nb_prod):
+        sigma_GDT[k, k] = 0
+    sigma_blocks = [sigma_GDT]
+
+    # the batches, with their data, pool of columns, master, and the number of blocks of columns already in their pool
+    permutation = np.random.permutation(nb_asst)
+    batches = []
+    for b0 in range(0, nb_asst, batch_size):
+        assts = np.sort(permutation[b0:b0 + batch_size])
+        batches.append({'data': data.take(assts), 'v': v[:, assts], 'pool': None, 'model': None, 'nb_blocks': 0})
+
+    # the master on the full data, with its own pool of columns (their choices on all the assortments)
+    full = {'data': data, 'v': v, 'pool': column_pool.ColumnPool(nb_prod, nb_asst, directory=column_store),
+            'model': utilities.RestrictedMaster(master_backends.new_master(backend)), 'nb_blocks': 0}
+    [lambda_found, obj_val_master] = solve_on(full, sigma_blocks)[:2]
+    history_obj_val = np.array([obj_val_master], dtype=np.float32)
+
+    # number of consecutive iterations which added no column
+    nb_empty = 0
+    for w in range(ITERATIONS_MAX):
+        batch = batches[w % len(batches)]
+        if batch['pool'] is None:
+            batch['pool'] = column_pool.ColumnPool(nb_prod, len(batch['data']))
+            batch['model'] = utilities.RestrictedMaster(master_backends.new_master(backend))
+        t_master = time.time()
+        [lambda_batch, obj_batch, alpha_batch, nu_batch] = solve_on(batch, sigma_blocks)
+        master_time = time.time() - t_master
+        pool = batch['pool']
+
+        # as in run_GDT, the columns which have ranked the no-choice option are not split anymore
+        lambda_batch[(pool.sigma()[:, 0] != nb_prod - 1)] = 0
+        nb_empty += 1
+        if lambda_batch.sum() > 0.01:
+            t_pricing = time.time()
+            if pricing == 'exhaustive':
+                [new_sigma_GDT, new_A, new_rc] = exhaustive_lowest_reduced_cost(pool, nb_prod, alpha_batch, nu_batch,
+                                                                                batch['data'], branching.children)
+            else:
+                set_k_possible = choose_n(utilities.repair_lambda(lambda_batch), branching.nodes)
+                [new_sigma_GDT, new_A, new_rc] = lowest_reduced_cost(set_k_possible, pool.sigma(), pool.A(), nb_prod,
+                                                                     alpha_batch, nu_batch, batch['data'],
+                                                                     branching.children)
+            branching.record(time.time() - t_pricing, master_time, new_rc)
+            if len(new_sigma_GDT) > 0:
+                # the new columns are known on this batch: they are appended to its pool with their choices
+                sigma_blocks.append(new_sigma_GDT)
+                pool.append(new_sigma_GDT, new_A)
+                batch['nb_blocks'] = len(sigma_blocks)
+                nb_empty = 0
+        if nb_empty >= len(batches):
+            print("No column added by any batch: we stop the learning")
+            stopping.stop('no column to split')
+            break
+
+        # periodic solve of the master on the full data, to certify the progress
+        if (w + 1) % full_solve_every == 0 or w == ITERATIONS_MAX - 1:
+            [lambda_found, obj_val_master] = solve_on(full, sigma_blocks)[:2]
+            history_obj_val = np.append(history_obj_val, obj_val_master)
+            if stopping.check(obj_val_master, sum(len(block) for block in sigma_blocks)):
+                break
+            print(obj_val_master, "> value fixed=", obj_stop)
+
+    # the last solve on the full data holds all the columns
+    if full['nb_blocks'] < len(sigma_blocks):
+        [lambda_found, obj_val_master] = solve_on(full, sigma_blocks)[:2]
+        history_obj_val = np.append(history_obj_val, obj_val_master)
+    if stopping.criterion is None:
+        stopping.stop('iterations')
+    a = full['pool'].take(np.nonzero(lambda_found)[0])[0]
+    b = lambda_found[np.nonzero(lambda_found)]
+    full['pool'].close()
+    for batch in batches:
+        if batch['pool'] is not None:
+            batch['pool'].close()
+    sigma_GDT_sorted = a[np.argsort(b), :][::-1]
+    lambda_GDT_sorted = b[np.argsort(b)][::-1]
+    print("total time:", time.time() - t1, "for", len(batches), "batches of", batch_size, "assortments")
+    print("Stopped by the criterion", stopping.criterion)
+    return [sigma_GDT_sorted, lambda_GDT_sorted, obj_val_master, history_obj_val]
+
+
+# Adds to the pool of a batch (or of the full data) the blocks of columns it has not seen yet, and solves its master
+# returns [lambda, obj_value, alpha, nu]
+def solve_on(batch, sigma_blocks):
+    if batch['nb_blocks'] < len(sigma_blocks):
+        new_sigmas = np.concatenate(sigma_blocks[batch['nb_blocks']:], axis=0)
+        batch['pool'].append(new_sigmas, choice_engine.batch_choices(new_sigmas, batch['data']))
+        batch['nb_blocks'] = len(sigma_blocks)
+    [lambda_found, alpha_found, nu_found, obj_val_master, time_method] = \
+        utilities.restricted_master(batch['pool'].A(), batch['v'], batch['data'], batch['model'], verbose=False)
+    return [lambda_found, obj_val_master, alpha_found, nu_found]
+#
+#############################
+
+
+
+
 #############################
 #  Various functions
 #
 #
 # User-friendly printing of the choice model  
-def sigma_digest(sigmas, lambdas, nb_prod):
-    a = sigmas[np.nonzero(lambdas)]
-    b = lambdas[np.nonzero(lambdas)]
-    sigmas_sorted = a[np.argsort(b), :][::-1]
-    lambdas_sorted = b[np.argsort(b)][::-1]
-    for i in range(len(sigmas_sorted)):
-        nb_prod_indiff = (sigmas_sorted[i, :] == nb_prod - 1).sum()
-        prod_prefered = np.argsort(sigmas_sorted[i, :])  # including the indiff products
-        print("Sigma number ", i, ", probability associated:", lambdas_sorted[i], ", prefered products in order:")
+# sigmas may also be a rankings.RankingModel, whose ranked prefixes are printed directly (lambdas, nb_prod not needed)
+def sigma_digest(sigmas, lambdas=None, nb_prod=None):
+    if not isinstance(sigmas, rankings.RankingModel):
+        sigmas = rankings.RankingModel.from_dense(sigmas, lambdas)
+    model_sorted = sigmas.sorted()
+    for i in range(len(model_sorted)):
+        print("Sigma number ", i, ", probability associated:", model_sorted.lambdas[i], ", prefered products in order:")
         # print the list of preferred in order of preference
-        print(prod_prefered[:nb_prod - nb_prod_indiff])
+        print(model_sorted.prefix(i))
     return 1
 
 
 # Computes the reduced cost of all columns of A, given rc=-alpha * a - nu
-def reduced_cost_matrix(A, alpha, nu):
-    return -np.sum(A * alpha, axis=(1, 2)) - nu
+# A is given in the compact encoding of choice_engine: the reduced costs are a gather on alpha, which only reads the
+# pairs (i,m) offered (alpha is 0 elsewhere, where the master has no constraint)
+def reduced_cost_matrix(A, alpha, nu, assortments):
+    return choice_engine.reduced_costs(A, alpha, nu, assortments)
 
 
 # returns the n_new_branches smallest reduced costs (and their sigma, A associated), taken from all the possible k defined by set_k_possible
-def lowest_reduced_cost(set_k_possible, sigma_GDT, nb_prod, alpha_found, nu_found, assortments, n_new_branches=100):
-    nb_col = len(sigma_GDT)
-    new_sigma_GDT = sigma_GDT
-    for k in set_k_possible:
-        new_new_sigma_GDT = add_new_sigma_GDT(sigma_GDT[k, :], nb_prod)
-        new_sigma_GDT = np.concatenate((new_sigma_GDT, new_new_sigma_GDT), axis=0)
-    new_sigma_GDT = new_sigma_GDT[nb_col:, :]  # we exclude the columns already in the dictionnary
-    new_A = multiple_sigma2a(new_sigma_GDT, assortments)
-    new_rc = reduced_cost_matrix(new_A, alpha_found, nu_found)
-    sort = np.argsort(new_rc)[:min(n_new_branches, len(
-        new_rc))]  # we take the n_new_branches smallest rc (exception if n_new_branches is > len(rc) )
-    return [new_sigma_GDT[sort, :], new_A[sort, :, :], new_rc[sort]]
+# the choices of the children are derived from the choices A[k] of their parent (see children_GDT)
+# stabilization: a utilities.DualSmoothing, or None; if active, the children are ranked by their reduced costs at the
+# smoothed duals (the reduced costs returned are always those for alpha_found, nu_found)
+def lowest_reduced_cost(set_k_possible, sigma_GDT, A, nb_prod, alpha_found, nu_found, assortments, n_new_branches=100,
+                        stabilization=None):
+    children = [children_GDT(sigma_GDT[k, :], A[k, :], assortments) for k in set_k_possible]
+    new_sigma_GDT = np.concatenate([np.empty((0, nb_prod), dtype=sigma_GDT.dtype)] + [c[0] for c in children], axis=0)
+    new_A = np.concatenate([np.empty((0, len(assortments)), dtype=np.int32)] + [c[1] for c in children], axis=0)
+    new_rc = reduced_cost_matrix(new_A, alpha_found, nu_found, assortments)
+    n_new_branches = min(n_new_branches, len(new_rc))  # exception if n_new_branches is > len(rc)
+    sort = np.argsort(new_rc)[:n_new_branches]  # we take the n_new_branches smallest rc
+    if stabilization is not None and len(new_rc) > 0:
+        if stabilization.active():
+            [alpha_smoothed, nu_smoothed] = stabilization.pricing_point(alpha_found, nu_found)
+            smoothed_rc = reduced_cost_matrix(new_A, alpha_smoothed, nu_smoothed, assortments)
+            stabilization.update(alpha_smoothed, nu_smoothed, smoothed_rc.min())
+            sort_smoothed = np.argsort(smoothed_rc)[:n_new_branches]
+            if (new_rc[sort_smoothed] < 0).any():
+                sort = sort_smoothed
+            else:
+                stabilization.nb_mispricings += 1
+        stabilization.update(alpha_found, nu_found, new_rc.min())
+    return [new_sigma_GDT[sort, :], new_A[sort, :], new_rc[sort]]
+
+
+# exhaustive pricing: returns the n_new_branches smallest reduced costs (and their sigma, A associated) among the
+# children of all the columns of the pool which have not ranked the no-choice option, as lowest_reduced_cost
+# the children are scored by blocks of columns of the pool (see children_reduced_costs), without being built: only the
+# children kept are built, and their reduced costs returned are computed on their columns of choices
+def exhaustive_lowest_reduced_cost(pool, nb_prod, alpha_found, nu_found, assortments, n_new_branches=100,
+                                   stabilization=None):
+    [parents, products, lowest_rc] = lowest_children(pool, nb_prod, alpha_found, nu_found, assortments, n_new_branches)
+    if stabilization is not None and len(parents) > 0:
+        if stabilization.active():
+            [alpha_smoothed, nu_smoothed] = stabilization.pricing_point(alpha_found, nu_found)
+            [parents_smoothed, products_smoothed, lowest_rc_smoothed] = \
+                lowest_children(pool, nb_prod, alpha_smoothed, nu_smoothed, assortments, n_new_branches)
+            stabilization.update(alpha_smoothed, nu_smoothed, lowest_rc_smoothed)
+            [new_sigma_GDT, new_A] = build_children(pool, parents_smoothed, products_smoothed, assortments)
+            new_rc = reduced_cost_matrix(new_A, alpha_found, nu_found, assortments)
+            if (new_rc < 0).any():
+                stabilization.update(alpha_found, nu_found, lowest_rc)
+                return [new_sigma_GDT, new_A, new_rc]
+            stabilization.nb_mispricings += 1
+        stabilization.update(alpha_found, nu_found, lowest_rc)
+    [new_sigma_GDT, new_A] = build_children(pool, parents, products, assortments)
+    return [new_sigma_GDT, new_A, reduced_cost_matrix(new_A, alpha_found, nu_found, assortments)]
+
+
+# returns [parents, products, lowest reduced cost]: the children of lowest reduced costs of the columns of the pool,
+# the child c ranking products[c] after the ranked products of the column parents[c], sorted by reduced cost
+def lowest_children(pool, nb_prod, alpha, nu, assortments, n_new_branches):
+    nb_asst = len(assortments)
+    [parents, products, rc] = [np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)]
+    block_columns = max(1, choice_engine.BLOCK_ELEMENTS // max(nb_asst, nb_prod))
+    for [k0, sigmas, choices] in pool.blocks(block_columns):
+        rc_block = children_reduced_costs(np.asarray(sigmas), np.asarray(choices), alpha, nu, assortments)
+        (k_block, j_block) = np.nonzero(rc_block < np.inf)
+        parents = np.concatenate((parents, k0 + k_block))
+        products = np.concatenate((products, j_block))
+        rc = np.concatenate((rc, rc_block[k_block, j_block]))
+        if len(rc) > n_new_branches:
+            kept = np.argpartition(rc, n_new_branches)[:n_new_branches]
+            [parents, products, rc] = [parents[kept], products[kept], rc[kept]]
+    sort = np.argsort(rc)
+    return [parents[sort], products[sort], rc.min() if len(rc) > 0 else np.inf]
+
+
+# Computes the reduced costs of the children of the columns (sigmas, choices), of shape (nb_col, nb_prod): the entry
+# [k, j] is the reduced cost of the child ranking j after the ranked products of sigmas[k], np.inf if there is no such
+# child (j ranked, sigmas[k] has ranked the no-choice option or all its products but one, or the child makes the same
+# choices as sigmas[k], see children_GDT)
+# a child only differs from its parent on the assortments where the parent is indifferent and j is offered: there, no
+# ranked product is offered, and the child chooses j. Its reduced cost is the one of its parent plus, on these
+# assortments, alpha[j] subtracted and the mean of alpha on the assortment added back (see choice_engine.reduced_costs):
+# all the children are scored at once by a product with the sparse matrix of these differences
+def children_reduced_costs(sigmas, choices, alpha, nu, assortments):
+    nb_prod = sigmas.shape[1]
+    offers = dataset.offers_csr(assortments)
+    nb_asst = offers.shape[0]
+    asst_of_offer = np.repeat(np.arange(nb_asst), np.diff(offers.indptr))
+    alpha_indiff = np.bincount(asst_of_offer, weights=alpha[offers.indices, asst_of_offer], minlength=nb_asst) \
+        * choice_engine.indifference_shares(offers)
+    difference = sp.csr_matrix((alpha_indiff[asst_of_offer] - alpha[offers.indices, asst_of_offer], offers.indices,
+                                offers.indptr), shape=(nb_asst, nb_prod))
+    indiff = (choices == -1).astype(np.float64)
+    rc = choice_engine.reduced_costs(choices, alpha, nu, offers)[:, None] + (difference.T @ indiff.T).T
+    nb_offered_indiff = (offers.T.astype(np.float64) @ indiff.T).T
+    unranked = (sigmas == nb_prod - 1)
+    has_children = unranked[:, 0] & (unranked.sum(axis=1) >= 2)
+    rc[~(unranked & has_children[:, None] & (nb_offered_indiff > 0))] = np.inf
+    return rc
+
+
+# builds the children ranking products[c] after the ranked products of the columns parents[c] of the pool, with their
+# choices derived from the choices of their parents (see children_reduced_costs)
+def build_children(pool, parents, products, assortments):
+    [new_sigma_GDT, new_A] = pool.take(parents)
+    new_sigma_GDT[np.arange(len(parents)), products] = (new_sigma_GDT != new_sigma_GDT.shape[1] - 1).sum(axis=1)
+    chooses_product = (new_A == -1) & (dataset.offers_csr(assortments)[:, products].toarray().T != 0)
+    new_A[chooses_product] = np.broadcast_to(products[:, None], new_A.shape)[chooses_product]
+    return [new_sigma_GDT, new_A]
 
 
 # heuristically choose a component of lambda_found (and returns the indicium associated) with a softmax
@@ -166,7 +492,8 @@ def choose_n(lambda_found, n):
 
 # computes the reduced cost of a column expressed as sigma
 def reduced_cost(sigma, alpha, nu, Inventories):
-    return - np.sum(np.sum((alpha * sigma2a(sigma, Inventories)), axis=0), axis=0) - nu
+    return reduced_cost_matrix(choice_engine.batch_choices(np.reshape(sigma, (1, -1)), Inventories), alpha, nu,
+                               Inventories)[0]
 
 
 # returns the product chosen by the customer defined by sigma when the assortment asst is displayed to him
@@ -183,81 +510,61 @@ def product_chosen(sigma, asst):
 
 
 # Returns the column a associated to a sigma and several assortments
-# the last block is sufficient, but we can speed up the algo (approx *3) with the first three blocks that deal with the singularities very efficiently (cases where the 1st, 2nd or no product is chosen)
+# the customer chooses his preferred product present; if he is indifferent (no product ranked in the assortment, or tie),
+# the choice is split uniformly between the products of the assortment (1/|S|): see choice_engine.batch_choices
 def sigma2a(sigma, assortments):
-    nb_asst = len(assortments)
-    nb_prod = len(sigma)
-    ret = np.zeros((nb_prod, nb_asst))
-
-    # three blocks to improve efficiency:
-    # we have to process the assts_not_yet_processed, that will store the assortments not catched by the speed-ups
-    # 1. when the preferred product of sigma is present in the assortments, we fill the assortments
-    preferred_prod = np.where(sigma == 0)[0][0]
-    ret[preferred_prod, assortments[:, preferred_prod]] = 1
-    assts_not_yet_processed = np.arange(nb_asst)[np.invert(assortments[:, preferred_prod])]
-
-    # 2. same thing for the second product; we may have only the first product ranked in sigma, that is why we put a 'try' block
-    try:
-        scd_preferred_prod = np.where(sigma == 1)[0][0]
-        ret[scd_preferred_prod, np.invert(assortments[:, preferred_prod]) & assortments[:, scd_preferred_prod]] = 1
-        assts_not_yet_processed = np.arange(nb_asst)[np.invert(assortments[:, preferred_prod]) & np.invert(
-            assortments[:,
-            scd_preferred_prod])]  # absence of preferred product and presence of second preferred product
-    except:
-        a = 1  # useless
-
-    # 3. catching the assortments in which we have none of the products ordered
-    # it is equivalent to 'the products ranked==nb_prod-1 (ie not ordered) are present in number equal to the size of the assortment
-    asst_without_choice = \
-    np.where(assortments[:, np.where(sigma == nb_prod - 1)[0]].sum(axis=1) == assortments.sum(axis=1))[
-        0]  # True when  the two previous numbers are equal: ie we know that no product preferred is in the asst!
-    nb_prod_pst_in_asst = assortments.sum(axis=1)
-    for m in asst_without_choice:
-        ret[assortments[m, :], m] = 1 / nb_prod_pst_in_asst[m]
-
-    assts_not_yet_processed = np.setdiff1d(assts_not_yet_processed, asst_without_choice)
-
-    for m in assts_not_yet_processed:
-        prod_chosen = int(product_chosen(sigma, assortments[m][:]))  # is equal to -1 if no product chosen
-        if (prod_chosen != -1):
-            ret[prod_chosen, m] = 1
-        # module added to put 1/nb_prod_pst_in_asst at the components if no product chosen: GDT
-        else:
-            nb_prod_pst_in_asst = assortments[m, :].sum()
-            ret[assortments[m, :].astype(bool), m] = 1 / nb_prod_pst_in_asst
-    return ret
+    return choice_engine.batch_sigma2a(np.reshape(sigma, (1, -1)), assortments)[0]
 
 
 # get the matrix A corresponding to a list of columns sigmas
-# calls the function sigma2a several times
+# all the columns are simulated at once by the batched choice engine
 def multiple_sigma2a(sigmas, assortments):
-    nb_col = len(sigmas)
-    nb_prod = len(sigmas.T)
-    nb_asst = len(assortments)
-    ret = np.empty((nb_col, nb_prod, nb_asst), dtype=np.float64)
-    for k in range(nb_col):
-        ret[k, :, :] = sigma2a(sigmas[k, :], assortments)
-    return ret
+    return choice_engine.batch_sigma2a(sigmas, assortments)
 
 
 # defines all the sub-behaviors of rank 1 of the branch sigma in the GDT tree
-def add_new_sigma_GDT(sigma_to_duplicate, nb_prod):
-    order = len(np.where(sigma_to_duplicate != nb_prod - 1)[0])  # number of ranked products
-    # we generate nb_prod-order sigmas in with 'order' at each position of the following mask
-    ret = np.empty((0, len(sigma_to_duplicate)), dtype=int)
-    for i in list(np.where(sigma_to_duplicate == nb_prod - 1)[0]):
-        ret = np.append(ret, [sigma_to_duplicate], axis=0)
-    for i in range(nb_prod - order):
-        ret[i, np.where(sigma_to_duplicate == nb_prod - 1)[0][i]] = order
+# if products_to_rank is given, only the sub-behaviors ranking those (not yet ranked) products are defined
+def add_new_sigma_GDT(sigma_to_duplicate, nb_prod, products_to_rank=None):
+    if products_to_rank is None:
+        products_to_rank = np.where(sigma_to_duplicate == nb_prod - 1)[0]
+    order = (sigma_to_duplicate != nb_prod - 1).sum()  # number of ranked products
+    # we generate one sigma per product to rank, with 'order' at the position of this product
+    ret = np.tile(sigma_to_duplicate, (len(products_to_rank), 1))
+    ret[np.arange(len(products_to_rank)), products_to_rank] = order
     return ret
 
 
-def compute_eps(A_f, lambda_f, Proba_prod):
-    (nb_col, nb_prod, nb_asst) = A_f.shape
-    err = 0
-    for m in range(nb_asst):
-        for i in range(nb_prod):
-            err = err + np.abs(np.matmul(A_f[:, i, m], lambda_f) - Proba_prod[m,i])
-    return err / (2. * nb_asst)
+# defines the sub-behaviors of rank 1 of the branch sigma, with their columns of choices derived from a, the choices of sigma
+# a child only differs from its parent on the assortments where the parent is indifferent: only those are recomputed
+# the children ranking a product never offered in those assortments make the same choices as their parent: they are skipped
+def children_GDT(sigma, a, assortments):
+    nb_prod = len(sigma)
+    indiff_assts = np.where(a == -1)[0]
+    assortments_indiff = dataset.take(assortments, indiff_assts)
+    # when a single product is not ranked, ranking it at nb_prod-1 would give back the parent
+    if (sigma != nb_prod - 1).sum() >= nb_prod - 1:
+        products_to_rank = np.empty(0, dtype=int)
+    else:
+        products_to_rank = np.where((sigma == nb_prod - 1) & dataset.products_offered(assortments_indiff))[0]
+    new_sigmas = add_new_sigma_GDT(sigma, nb_prod, products_to_rank)
+    new_a = np.tile(a, (len(new_sigmas), 1))
+    new_a[:, indiff_assts] = choice_engine.batch_choices(new_sigmas, assortments_indiff)
+    return [new_sigmas, new_a]
+
+
+# computes the error eps = sum |A lambda - v| / (2 nb_asst) of the choice model on the sales data Proba_prod
+# (if the assortments are weighted, see dataset.weights, the error of each assortment is counted with its weight)
+# A_f is given in the compact encoding of choice_engine; the error can be restricted to some products (slice or mask)
+# the products not offered are predicted and sold with probability 0: the sum runs over the offers only
+# Proba_prod may be None if assortments is a dataset.AssortmentData holding the sales
+def compute_eps(A_f, lambda_f, Proba_prod, assortments, products=slice(None)):
+    (nb_asst, nb_prod) = assortments.shape
+    Proba_predicted = choice_engine.predicted_shares(A_f, lambda_f, assortments)
+    selected = np.zeros(nb_prod, dtype=bool)
+    selected[products] = True
+    weights = dataset.weights(assortments)
+    err = np.abs(Proba_predicted.data - dataset.sales_on_offers(assortments, Proba_prod))
+    err = err * np.repeat(weights, np.diff(Proba_predicted.indptr))
+    return err[selected[Proba_predicted.indices]].sum() / (2. * weights.sum())
 
 #############################
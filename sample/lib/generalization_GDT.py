@@ -1,12 +1,15 @@
 import numpy as np
 from lib.fcns_generalize import *
+import lib.rankings as rankings
 
 
 #############################
 #  Given a choice model GDT, and the features of old and new products, this function must return the new choice model.
-#
+#  sigma_GDT may be a rankings.RankingModel (lambda_GDT=None): the generalized choice model is then a RankingModel
 #
 def run_generalization(sigma_GDT, lambda_GDT, features_old, features_new, restriction, alpha):
+    if isinstance(sigma_GDT, rankings.RankingModel):
+        return run_generalization_rankings(sigma_GDT, features_old, features_new, restriction, alpha)
     
     #definition of the parameters according to the data
     (nb_col, nb_prod) = sigma_GDT.shape
@@ -37,4 +40,29 @@ def run_generalization(sigma_GDT, lambda_GDT, features_old, features_new, restri
     return [sigma_all, lambda_all]
 #
 #  end of run_generalization
-#############################
\ No newline at end of file
+#############################
+
+#############################
+#  Same generalization, for a choice model GDT stored as a rankings.RankingModel
+#
+def run_generalization_rankings(model, features_old, features_new, restriction, alpha):
+    nb_all_prod = model.nb_prod + len(features_new)
+
+    #For each column, we save the new permutations with a new product in pole-position
+    models_np = []
+    for k in range(len(model)):
+        [sigma_np, lambda_np] = expand_sigma(model.dense_row(k), model.lambdas[k], features_old, features_new, restriction)
+        models_np.append(rankings.RankingModel.from_dense(sigma_np, lambda_np))
+    model_np = rankings.RankingModel.concatenate(models_np, nb_all_prod)
+    model_np.lambdas = model_np.lambdas/model_np.lambdas.sum()
+
+    #the original columns keep their prefixes among all the products: the new products are not ranked
+    model_old = rankings.RankingModel(model.ids, model.ptr, alpha*model.lambdas, nb_all_prod)
+    model_np.lambdas = (1-alpha)*model_np.lambdas
+
+    model_all = rankings.RankingModel.concatenate([model_old, model_np], nb_all_prod)
+    model_all.lambdas = model_all.lambdas/model_all.lambdas.sum()
+    return model_all
+#
+#  end of run_generalization_rankings
+#############################
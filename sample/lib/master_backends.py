@@ -0,0 +1,442 @@
+import numpy as np
+import scipy.sparse as sp
+import time
+import lib.choice_engine as choice_engine
+import lib.dataset as dataset
+import lib.utilities as utilities
+
+
+#############################
+#  FILE master_backends.py
+#  Solvers of the restricted master problem, called by utilities.restricted_master():
+#      min sum(w_m (eps_p + eps_m))  s.t.  A lambda + eps_p - eps_m = v  (distance_i_m),  sum(lambda) = 1  (sum_to_1)
+#  (with the L2 norm, the objective is sum(w_m (eps_p^2 + eps_m^2))), w_m being the weight of the assortment m (see
+#  dataset.weights: 1 unless the assortments were merged by dataset.deduplicate)
+#  Only the pairs (i,m) where the product i is offered in the assortment m have a constraint distance_i_m and variables
+#  eps: elsewhere v=0 and every column has a coefficient 0 (see master_rows), and the dual alpha is 0.
+#  A backend owns its solver model and the variables lambda of the columns it received, in the order they were added
+#  (utilities.RestrictedMaster maps them to the ids of the columns). It provides:
+#   - init_model(A, v, assortments, verbose): builds the master with the first columns A
+#   - add_columns(A_add, assortments, warm_start): adds the columns A_add; the current basis is kept if warm_start
+#   - remove_columns(positions): removes the variables lambda at the positions given
+#   - solve(method, warm_start): optimizes with the algorithm method (one of its methods), from the basis kept if
+#     warm_start (and method is one of its warm_methods), else from scratch; returns
+#     [lambda, alpha, nu, obj_value, time_method], alpha of shape (nb_prod, nb_asst), and sets iterations
+#   - get_basis(): the basis of the last solve (None if not available), e.g. for a checkpoint of the learning, as a
+#     dict of the statuses of the lambdas, of eps_p, eps_m and distance_i_m for each row, and of sum_to_1
+#   - set_basis(basis): warm starts the next solve with a basis of get_basis, of a model with the same columns; the
+#     model may have new assortments, appended after the ones of the basis (see align_basis)
+#   - basic_columns(): the mask of the lambdas basic in the last solve (None if no basis is available), e.g. to purge
+#     only nonbasic columns (see utilities.RestrictedMaster.manage_columns)
+#  The columns are given in the compact encoding of choice_engine (choices of shape (nb_col, nb_asst)).
+#  The backend of a learning is created by new_master(name), name being one of the keys of BACKENDS:
+#   - 'gurobi': gurobipy, L1 and L2 norms (default)
+#   - 'highs': the HiGHS solver through highspy, L1 norm, warm started with the basis kept by HiGHS
+#   - 'scipy': the HiGHS solvers of scipy.optimize.linprog, L1 norm, solved from scratch at each call
+#  The open-source backends do not need a Gurobi license, and are not limited in size. The solvers are imported by their
+#  backend only: gurobipy is not needed to learn with 'highs' or 'scipy'.
+#
+#############################
+
+
+class GurobiMaster:
+    name = 'gurobi'
+    # values of the parameter Method
+    methods = {'barrier': 2, 'dual': 1, 'primal': 0}
+    warm_methods = ['dual', 'primal']
+    # statuses of a variable nonbasic at 0 (VBasis) and of a basic constraint (CBasis)
+    nonbasic = -1
+    basic = 0
+
+    def __init__(self, model=None):
+        import gurobipy
+        self.gurobipy = gurobipy
+        self.model = gurobipy.Model('finding_lambda') if model is None else model
+        self.lmbda = []
+        # basis [VBASES, CBASES] of the variables self.lmbda + self.eps, kept when the model is modified after a solve
+        self.basis = None
+
+    #initializes the model, built in one shot from sparse matrices
+    #the variables are, in this order: the lambdas, then eps_p_i_m and eps_m_i_m for each row (i,m) of the master
+    #the constraints are distance_i_m for each row (i,m) of the master (see master_rows), then sum_to_1
+    def init_model(self, A, v, assortments, verbose=False):
+        model = self.model
+        model.setParam( 'OutputFlag', int(verbose) )
+        (nb_col,nb_asst) = A.shape
+        nb_prod = len(v)
+        self.shape = (nb_prod, nb_asst)
+        self.rows = master_rows(assortments)
+        nb_rows = len(self.rows)
+        nb_lambda = nb_col
+
+        # Create variables
+        weights = np.repeat(row_weights(assortments, self.rows), 2)
+        if utilities.norm_chosen == 1:
+            obj = np.concatenate((np.zeros(nb_lambda), weights))
+        elif utilities.norm_chosen == 2:
+            obj = np.zeros(nb_lambda + 2 * nb_rows)
+        else:
+            print("Wrong input; please choose L1 or L2")
+        x = model.addMVar(nb_lambda + 2 * nb_rows, lb=0, obj=obj)
+        eps = x[nb_lambda:]
+        if utilities.norm_chosen == 2:
+            #set the objective function sum(w_m (eps_p^2 + eps_m^2))
+            model.setObjective(eps @ sp.diags(weights) @ eps)
+        model.ModelSense = 1 #Minimization
+
+        #Create constraints: the matrix [A 0; 1 0] for the lambdas (see column_matrix), +1 for eps_p and -1 for eps_m
+        [starts, indices, values] = column_matrix(A, assortments, self.rows)
+        matrix_lambda = sp.csc_matrix((values, indices, starts), shape=(nb_rows + 1, nb_lambda))
+        matrix_eps = sp.csc_matrix((np.tile([1., -1.], nb_rows), np.repeat(np.arange(nb_rows), 2),
+                                    np.arange(2 * nb_rows + 1)), shape=(nb_rows + 1, 2 * nb_rows))
+        matrix = sp.hstack((matrix_lambda, matrix_eps), format='csr')
+        # without column, sum_to_1 is an empty row, which receives the coefficients of the columns added later (as in
+        # the other backends, the master cannot be solved before)
+        rhs = np.append(np.asarray(v, dtype=np.float64).ravel()[self.rows], 1.)
+        model.addMConstr(matrix, x, '=', rhs)
+        model.update()
+
+        #names of the variables and of the constraints
+        vars = x.tolist()
+        self.lmbda = vars[:nb_lambda]
+        self.eps = vars[nb_lambda:]
+        self.constrs = model.getConstrs()
+        pairs = list(zip((self.rows // nb_asst).tolist(), (self.rows % nb_asst).tolist()))
+        model.setAttr('VarName', vars, ['lambda_%s' % k for k in range(nb_lambda)]
+                      + [name % pair for pair in pairs for name in ['eps_p_%s_%s', 'eps_m_%s_%s']])
+        model.setAttr('ConstrName', self.constrs, ['distance_%s_%s' % pair for pair in pairs]
+                      + ['sum_to_%s' % 1])
+        model.update()
+
+    # the columns of A_add are added in one batch, with a single update of the model: each variable is created with
+    # the Column of its nonzero coefficients (constraints distance_i_m, and sum_to_1 which is the last constraint)
+    def add_columns(self, A_add, assortments, warm_start=True):
+        model = self.model
+        constrs = self.constrs
+
+        # save the basis before creation of the variables
+        vars = self.lmbda + self.eps
+        if warm_start:
+            self.save_basis()
+            warm_start = self.basis is not None
+        if warm_start:
+            [VBASES, CBASES] = self.basis
+
+        # create the new variables
+        [starts, indices, values] = column_matrix(A_add, assortments, self.rows)
+        new_vars = []
+        for k in range(len(A_add)):
+            sel = slice(starts[k], starts[k+1])
+            column = self.gurobipy.Column(values[sel].tolist(), [constrs[r] for r in indices[sel]])
+            new_vars.append(model.addVar(lb=0, vtype=self.gurobipy.GRB.CONTINUOUS, name='lambda_%s' % len(self.lmbda), obj=0,
+                                         column=column))
+            self.lmbda.append(new_vars[-1])
+        model.update()
+
+        if warm_start:
+            utilities.loadStateWarmBasis(model, vars, constrs, VBASES, CBASES)
+            model.setAttr("VBasis", new_vars, [-1] * len(new_vars))
+        self.basis = None
+
+    # the basis of the remaining variables is kept for the warm start
+    def remove_columns(self, positions):
+        if len(positions) == 0:
+            return
+        model = self.model
+        self.save_basis()
+        model.remove([self.lmbda[j] for j in positions])
+        model.update()
+        keep = np.ones(len(self.lmbda), dtype=bool)
+        keep[positions] = False
+        self.lmbda = [var for (var, kept) in zip(self.lmbda, keep) if kept]
+        if self.basis is not None:
+            [VBASES, CBASES] = self.basis
+            VBASES = np.concatenate((VBASES[:len(keep)][keep], VBASES[len(keep):]))
+            self.basis = [VBASES, CBASES]
+            utilities.loadStateWarmBasis(model, self.lmbda + self.eps, self.constrs, VBASES, CBASES)
+
+    # reads the basis of the last solve, if the model was not modified since (else, the basis kept is used)
+    def save_basis(self):
+        if self.basis is None:
+            try:
+                self.basis = utilities.saveStateWarmBasis(self.model, self.lmbda + self.eps, self.constrs)
+            except self.gurobipy.GurobiError:
+                self.basis = None # no basis available, e.g. barrier without crossover
+
+    def get_basis(self):
+        self.save_basis()
+        if self.basis is None:
+            return None
+        [VBASES, CBASES] = self.basis
+        nb_lambda = len(self.lmbda)
+        return {'shape': self.shape, 'rows': np.copy(self.rows), 'lambda': VBASES[:nb_lambda],
+                'eps_p': VBASES[nb_lambda::2], 'eps_m': VBASES[nb_lambda + 1::2], 'distance': CBASES[:len(self.rows)],
+                'sum_to_1': CBASES[len(self.rows):]}
+
+    def basic_columns(self):
+        self.save_basis()
+        if self.basis is None:
+            return None
+        return self.basis[0][:len(self.lmbda)] == self.basic
+
+    def set_basis(self, basis):
+        basis = align_basis(basis, self.rows, self.shape, self.basic, self.nonbasic)
+        eps = np.stack((basis['eps_p'], basis['eps_m']), axis=1).ravel()
+        self.basis = [np.concatenate((basis['lambda'], eps)), np.concatenate((basis['distance'], basis['sum_to_1']))]
+        utilities.loadStateWarmBasis(self.model, self.lmbda + self.eps, self.constrs, self.basis[0], self.basis[1])
+
+    def solve(self, method='dual', warm_start=True):
+        model = self.model
+        model.setParam("Method", self.methods[method])
+        if not (warm_start and method in self.warm_methods):
+            model.reset(0) # discards the basis
+        model.optimize()
+        self.basis = None
+        self.iterations = int(model.IterCount + model.BarIterCount)
+
+        # Extraction of the primal variables, with a single call to the model
+        return_lmbda = np.array(model.getAttr('X', self.lmbda), dtype=np.float64)
+
+        # Extraction of the dual variables, with a single call to the model
+        # the constraints distance_i_m are the first ones, and sum_to_1 is the last one recorded
+        Pi = np.array(model.getAttr('Pi', self.constrs), dtype=np.float64)
+        alpha = dual_matrix(Pi[:len(self.rows)], self.rows, self.shape)
+        nu = Pi[-1:]
+
+        return [return_lmbda, alpha, nu, model.ObjVal, model.Runtime]
+
+
+# L1 master solved by HiGHS through highspy; the columns are, in this order: eps_p, eps_m, then the lambdas
+class HighsMaster:
+    name = 'highs'
+    # values of the options solver and simplex_strategy
+    methods = {'barrier': ['ipm', 1], 'dual': ['simplex', 1], 'primal': ['simplex', 4]}
+    warm_methods = ['dual', 'primal']
+    # values of HighsBasisStatus: kLower (nonbasic at 0) and kBasic
+    nonbasic = 0
+    basic = 1
+
+    def __init__(self):
+        import highspy
+        self.highspy = highspy
+        self.highs = highspy.Highs()
+
+    def init_model(self, A, v, assortments, verbose=False):
+        if utilities.norm_chosen != 1:
+            raise Exception('The HiGHS backend only solves the L1 master')
+        highs = self.highs
+        highs.setOptionValue('output_flag', bool(verbose))
+        self.shape = v.shape
+        self.rows = master_rows(assortments)
+        nb_rows = len(self.rows)
+
+        # the constraints distance_i_m for the rows of the master, then sum_to_1
+        rhs = np.append(np.asarray(v, dtype=np.float64).ravel()[self.rows], 1.)
+        highs.addRows(nb_rows + 1, rhs, rhs, 0, np.zeros(nb_rows + 1, dtype=np.int32), np.zeros(0, dtype=np.int32),
+                      np.zeros(0))
+        # eps_p and eps_m: one coefficient +1 (resp. -1) on their constraint distance_i_m, and a cost w_m
+        weights = row_weights(assortments, self.rows)
+        for sign in [1., -1.]:
+            highs.addCols(nb_rows, weights, np.zeros(nb_rows), np.full(nb_rows, highs.inf), nb_rows,
+                          np.arange(nb_rows, dtype=np.int32), np.arange(nb_rows, dtype=np.int32),
+                          np.full(nb_rows, sign))
+        self.first_lambda = 2 * nb_rows
+        self.add_columns(A, assortments)
+
+    # HiGHS keeps the basis when columns are added (the new ones are nonbasic at 0): this is the warm start
+    def add_columns(self, A_add, assortments, warm_start=True):
+        [starts, indices, values] = column_matrix(A_add, assortments, self.rows)
+        nb_col = len(A_add)
+        self.highs.addCols(nb_col, np.zeros(nb_col), np.zeros(nb_col), np.full(nb_col, self.highs.inf), len(indices),
+                           starts[:-1], indices, values)
+        if not warm_start:
+            self.highs.clearSolver()
+
+    # the statuses of the columns and of the rows, as integers
+    def get_basis(self):
+        basis = self.highs.getBasis()
+        if not basis.valid:
+            return None
+        col_status = np.array([int(status) for status in basis.col_status], dtype=np.int8)
+        row_status = np.array([int(status) for status in basis.row_status], dtype=np.int8)
+        nb_rows = len(self.rows)
+        return {'shape': self.shape, 'rows': np.copy(self.rows), 'lambda': col_status[self.first_lambda:],
+                'eps_p': col_status[:nb_rows], 'eps_m': col_status[nb_rows:self.first_lambda],
+                'distance': row_status[:nb_rows], 'sum_to_1': row_status[nb_rows:]}
+
+    def basic_columns(self):
+        basis = self.highs.getBasis()
+        if not basis.valid:
+            return None
+        return np.array([int(status) == self.basic for status in basis.col_status[self.first_lambda:]], dtype=bool)
+
+    def set_basis(self, basis):
+        basis = align_basis(basis, self.rows, self.shape, self.basic, self.nonbasic)
+        highs_basis = self.highspy.HighsBasis()
+        highs_basis.col_status = [self.highspy.HighsBasisStatus(int(status))
+                                  for status in np.concatenate((basis['eps_p'], basis['eps_m'], basis['lambda']))]
+        highs_basis.row_status = [self.highspy.HighsBasisStatus(int(status))
+                                  for status in np.concatenate((basis['distance'], basis['sum_to_1']))]
+        highs_basis.valid = True
+        self.highs.setBasis(highs_basis)
+
+    def remove_columns(self, positions):
+        if len(positions) == 0:
+            return
+        self.highs.deleteCols(len(positions), (self.first_lambda + np.asarray(positions)).astype(np.int32))
+
+    def solve(self, method='dual', warm_start=True):
+        highs = self.highs
+        highs.setOptionValue('solver', self.methods[method][0])
+        highs.setOptionValue('simplex_strategy', self.methods[method][1])
+        if not (warm_start and method in self.warm_methods):
+            highs.clearSolver() # discards the basis
+        t1 = time.time()
+        highs.run()
+        time_method = time.time() - t1
+        info = highs.getInfo()
+        self.iterations = int(max(info.simplex_iteration_count, 0) + max(info.ipm_iteration_count, 0))
+        if highs.getModelStatus() != self.highspy.HighsModelStatus.kOptimal:
+            raise Exception('HiGHS could not solve the master: ' + highs.modelStatusToString(highs.getModelStatus()))
+        solution = highs.getSolution()
+        col_value = np.asarray(solution.col_value)
+        row_dual = np.asarray(solution.row_dual)
+        alpha = dual_matrix(row_dual[:-1], self.rows, self.shape)
+        nu = row_dual[-1:]
+        return [col_value[self.first_lambda:], alpha, nu, highs.getInfo().objective_function_value, time_method]
+
+
+# L1 master solved from scratch at each call by scipy.optimize.linprog (HiGHS solvers shipped with SciPy)
+class ScipyMaster:
+    name = 'scipy'
+    # values of the parameter method of linprog; the solves are never warm started
+    methods = {'barrier': 'highs-ipm', 'dual': 'highs-ds'}
+    warm_methods = []
+
+    def init_model(self, A, v, assortments, verbose=False):
+        if utilities.norm_chosen != 1:
+            raise Exception('The scipy backend only solves the L1 master')
+        self.shape = v.shape
+        self.verbose = verbose
+        self.rows = master_rows(assortments)
+        nb_rows = len(self.rows)
+        self.b_eq = np.append(np.asarray(v, dtype=np.float64).ravel()[self.rows], 1.)
+        self.weights = row_weights(assortments, self.rows)
+        eye = sp.identity(nb_rows, format='csc')
+        # blocks of columns of the constraint matrix: eps_p, eps_m, then the lambdas added
+        self.blocks = [sp.vstack((eye, sp.csc_matrix((1, nb_rows)))), sp.vstack((-eye, sp.csc_matrix((1, nb_rows))))]
+        self.nb_lambda = 0
+        self.add_columns(A, assortments)
+
+    def add_columns(self, A_add, assortments, warm_start=True):
+        nb_rows = len(self.rows)
+        [starts, indices, values] = column_matrix(A_add, assortments, self.rows)
+        self.blocks.append(sp.csc_matrix((values, indices, starts), shape=(nb_rows + 1, len(A_add))))
+        self.nb_lambda += len(A_add)
+
+    def remove_columns(self, positions):
+        keep = np.ones(self.nb_lambda, dtype=bool)
+        keep[positions] = False
+        self.blocks = self.blocks[:2] + [sp.hstack(self.blocks[2:], format='csc')[:, keep]]
+        self.nb_lambda = int(keep.sum())
+
+    # linprog is not warm started: there is no basis
+    def get_basis(self):
+        return None
+
+    def set_basis(self, basis):
+        pass
+
+    def basic_columns(self):
+        return None
+
+    def solve(self, method='dual', warm_start=False):
+        from scipy.optimize import linprog
+        nb_rows = len(self.rows)
+        c = np.concatenate((self.weights, self.weights, np.zeros(self.nb_lambda)))
+        t1 = time.time()
+        res = linprog(c, A_eq=sp.hstack(self.blocks, format='csc'), b_eq=self.b_eq, bounds=(0, None), method=self.methods[method],
+                      options={'disp': self.verbose})
+        time_method = time.time() - t1
+        self.iterations = int(res.nit)
+        if res.status != 0:
+            raise Exception('linprog could not solve the master: ' + res.message)
+        alpha = dual_matrix(res.eqlin.marginals[:-1], self.rows, self.shape)
+        nu = res.eqlin.marginals[-1:]
+        return [res.x[2 * nb_rows:], alpha, nu, res.fun, time_method]
+
+
+# Returns the rows of the master: the numbers i*nb_asst+m (sorted) of the pairs (product i, assortment m) where i is
+# offered in m. For the other pairs, v=0 and the coefficients of all the columns are 0: they are structural zeros.
+# The only exception is the product 0 chosen by BM in an empty assortment, which is the same for all the columns: it
+# only adds a constant to the objective, and is dropped.
+def master_rows(assortments):
+    offers = dataset.offers_csr(assortments)
+    nb_asst = offers.shape[0]
+    asst_of_offer = np.repeat(np.arange(nb_asst), np.diff(offers.indptr))
+    return np.sort(offers.indices.astype(np.int64) * nb_asst + asst_of_offer)
+
+
+# Returns the basis of get_basis on the rows of a master of shape (nb_prod, nb_asst) holding the assortments of the
+# basis, and possibly new assortments after them: the rows of the basis are matched by their pair (i,m). The new rows
+# get a basic constraint and nonbasic eps_p and eps_m: with a cost w_m >= 0 for eps, the basis stays dual feasible.
+def align_basis(basis, rows, shape, basic, nonbasic):
+    nb_asst_basis = basis['shape'][1]
+    if nb_asst_basis == shape[1]:
+        return basis
+    position = np.searchsorted(rows, basis['rows'] // nb_asst_basis * shape[1] + basis['rows'] % nb_asst_basis)
+    ret = {'lambda': basis['lambda'], 'sum_to_1': basis['sum_to_1']}
+    for [name, status] in [['eps_p', nonbasic], ['eps_m', nonbasic], ['distance', basic]]:
+        ret[name] = np.full(len(rows), status, dtype=basis[name].dtype)
+        ret[name][position] = basis[name]
+    return ret
+
+
+# Returns the weight w_m of each row i*nb_asst+m of the master (see dataset.weights)
+def row_weights(assortments, rows):
+    weights = dataset.weights(assortments)
+    return weights[rows % len(weights)]
+
+
+# Returns the duals alpha of shape (nb_prod, nb_asst) from the duals of the constraints distance_i_m of the rows of the
+# master; alpha is 0 on the other pairs
+def dual_matrix(duals, rows, shape):
+    alpha = np.zeros(shape)
+    alpha.ravel()[rows] = duals
+    return alpha
+
+
+# Returns the columns of choices A_add as a CSC matrix [starts, indices, values] on the constraints of the master:
+# the rows of choice_engine.choice_coefficients, numbered as in rows (see master_rows), and the coefficient 1 on
+# sum_to_1 (row len(rows))
+def column_matrix(A_add, assortments, rows_master):
+    nb_col = len(A_add)
+    nb_rows = len(rows_master)
+    [cols, keys, vals] = choice_engine.choice_coefficients(A_add, assortments)
+    in_master = np.isin(keys, rows_master)
+    cols = np.concatenate((cols[in_master], np.arange(nb_col)))
+    rows = np.concatenate((np.searchsorted(rows_master, keys[in_master]), np.full(nb_col, nb_rows)))
+    vals = np.concatenate((vals[in_master], np.ones(nb_col)))
+    order = np.lexsort((rows, cols))
+    starts = np.searchsorted(cols[order], np.arange(nb_col + 1)).astype(np.int32)
+    return [starts, rows[order].astype(np.int32), vals[order]]
+
+
+BACKENDS = {'gurobi': GurobiMaster, 'highs': HighsMaster, 'scipy': ScipyMaster}
+
+
+# Returns [lambdas, obj_value]: the probabilities of the columns sigmas (GDT if indifference, else BM) fitting best the
+# sales of the assortments, e.g. to refit on the full data a choice model learned on a coreset (see dataset.coreset)
+def refit_lambdas(sigmas, Inventories, Proba_product=None, indifference=True, backend='gurobi'):
+    A = choice_engine.batch_choices(sigmas, Inventories, indifference)
+    v = dataset.sales_array(Inventories, Proba_product).T
+    model = utilities.RestrictedMaster(new_master(backend), purge_age=0)
+    [lambdas, alpha, nu, obj_value, time_method] = model.restricted_master(A, v, Inventories)
+    return [lambdas, obj_value]
+
+
+# Returns a new master problem solved by the backend name (see BACKENDS)
+def new_master(name='gurobi'):
+    if name not in BACKENDS:
+        raise Exception('Unknown master backend ' + str(name) + ', please choose among ' + str(list(BACKENDS.keys())))
+    return BACKENDS[name]()
@@ -0,0 +1,102 @@
+import numpy as np
+import pickle
+
+
+#############################
+#  FILE rankings.py
+#  Storage of a ranking-based choice model (GDT or BM) as the ranked prefixes of its columns
+#  In the dense form, a sigma is a row of nb_prod ranks in which the rank nb_prod-1 means 'not ranked'; a GDT column
+#  usually ranks a handful of products, so only its ordered prefix of ranked products is stored here.
+#
+#############################
+
+
+class RankingModel:
+    # ids[ptr[k]:ptr[k+1]] are the products ranked by the column k, by order of preference; lambdas[k] is its probability
+    def __init__(self, ids, ptr, lambdas, nb_prod):
+        self.nb_prod = int(nb_prod)
+        self.ids = np.asarray(ids, dtype=np.uint16 if self.nb_prod <= 2 ** 16 else np.uint32)
+        self.ptr = np.asarray(ptr, dtype=np.int64)
+        self.lambdas = np.asarray(lambdas, dtype=np.float64)
+
+    # builds the model from the dense sigmas of shape (nb_col, nb_prod), as returned by run_GDT or run_BM
+    @classmethod
+    def from_dense(cls, sigmas, lambdas):
+        sigmas = np.asarray(sigmas)
+        (nb_col, nb_prod) = sigmas.shape
+        ranked = sigmas != nb_prod - 1
+        lengths = ranked.sum(axis=1)
+        # products of each row by order of rank, the products not ranked at the end
+        order = np.argsort(np.where(ranked, sigmas, nb_prod), axis=1, kind='stable')
+        ids = order[np.arange(nb_prod)[None, :] < lengths[:, None]]
+        return cls(ids, np.concatenate(([0], np.cumsum(lengths))), lambdas, nb_prod)
+
+    # concatenation of several models defined on the same products
+    @classmethod
+    def concatenate(cls, models, nb_prod):
+        lengths = np.concatenate([[0]] + [np.diff(model.ptr) for model in models])
+        ids = np.concatenate([np.zeros(0, dtype=np.int64)] + [model.ids for model in models])
+        lambdas = np.concatenate([np.zeros(0)] + [model.lambdas for model in models])
+        return cls(ids, np.cumsum(lengths), lambdas, nb_prod)
+
+    def __len__(self):
+        return len(self.ptr) - 1
+
+    # number of products ranked by each column
+    def lengths(self):
+        return np.diff(self.ptr)
+
+    # products ranked by the column k, by order of preference
+    def prefix(self, k):
+        return self.ids[self.ptr[k]:self.ptr[k + 1]]
+
+    # dense sigma of the column k, of shape (nb_prod)
+    def dense_row(self, k):
+        ret = np.full(self.nb_prod, self.nb_prod - 1, dtype=np.int32)
+        ret[self.prefix(k)] = np.arange(self.ptr[k + 1] - self.ptr[k])
+        return ret
+
+    # dense sigmas, of shape (nb_col, nb_prod)
+    def to_dense(self):
+        lengths = self.lengths()
+        ret = np.full((len(self), self.nb_prod), self.nb_prod - 1, dtype=np.int32)
+        ranks = np.arange(len(self.ids)) - np.repeat(self.ptr[:-1], lengths)
+        ret[np.repeat(np.arange(len(self)), lengths), self.ids] = ranks
+        return ret
+
+    # the model restricted to the columns cols (indices or mask)
+    def take(self, cols):
+        cols = np.arange(len(self))[cols]
+        lengths = self.lengths()[cols]
+        ptr = np.concatenate(([0], np.cumsum(lengths)))
+        positions = np.repeat(self.ptr[cols], lengths) + np.arange(ptr[-1]) - np.repeat(ptr[:-1], lengths)
+        return RankingModel(self.ids[positions], ptr, self.lambdas[cols], self.nb_prod)
+
+    # the columns of nonzero lambda, sorted by decreasing lambda (as run_GDT and run_BM return them)
+    def sorted(self):
+        nonzero = np.nonzero(self.lambdas)[0]
+        return self.take(nonzero[np.argsort(self.lambdas[nonzero])[::-1]])
+
+
+#############################
+#  Choice model files
+#  A file holds a pickled RankingModel. The files of the former format, holding the dense sigmas followed by the
+#  lambdas, can still be read.
+#
+
+def save_choice_model(filename, model):
+    # Use of protocol 2 to ensure back-compatibility with Python 2.7
+    with open(filename, 'wb') as file:
+        my_pickler = pickle.Pickler(file, protocol=2)
+        my_pickler.dump(model)
+
+
+def load_choice_model(filename):
+    with open(filename, 'rb') as file:
+        my_depickler = pickle.Unpickler(file)
+        model = my_depickler.load()
+        if not isinstance(model, RankingModel):
+            model = RankingModel.from_dense(model, my_depickler.load())
+    return model
+#
+#############################
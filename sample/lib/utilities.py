@@ -1,196 +1,537 @@
 #############################
 #  FILE warm_start.py
 #  called by utilities.restricted_master() to solve the master problem using warm start if possible
+#  the state of the master problem of a learning is held by a RestrictedMaster; the LP itself is built and solved by
+#  one of the backends of master_backends.py
 #
 #############################
 import numpy as np
-from gurobipy import *
+import sys
+import csv
 import time
+import lib.choice_engine as choice_engine
+import lib.dataset as dataset
+import lib.column_pool as column_pool
 
-#global variables
-initialized = False #set to true once the init_model() function has been called once
-nb_col_previous = 0
-lmbda = {}
-
-use_warm_start = True
+use_warm_start = True # if False, the master is always solved from scratch
 norm_chosen = 1  # parameter: choose 1 (for L1) or 2 (for L2)
-method_to_use_first_iteration = 2#for first cold start solve, the barrier (method=2) method should be the most efficient
-method_to_use_iterations = 1 #for warm starting, the dual simplex (method=1) method should be the most efficient
-
-#beware of incompatibilities: it is impossible to use warm start with VBasis/CBasis
-# with L2 norm with a method using something else than the simplex method (methods= 0 (primal simplex) or 1 (dual simplex) )
-if use_warm_start and (norm_chosen==2) and (method_to_use_first_iteration >1 or method_to_use_iterations>1):
-    raise Exception('Incompatible parameters!')
-
-#initializes the model
-def init_model(A, v, model, verbose=False):
-    global initialized
-    global nb_col_previous
-    global lmbda
-
-    #Create the Model
-
-    model.setParam( 'OutputFlag', int(verbose) )
-    (nb_col,nb_prod,nb_asst) = A.shape
-
-    # Create variables
-    for k in range(nb_col):
-        lmbda[k] = model.addVar(lb=0, vtype=GRB.CONTINUOUS, name='lambda_%s' % k,obj=0)
-    if nb_col==0:
-        lmbda[0] = model.addVar(lb=0, vtype=GRB.CONTINUOUS, name='lambda_0',obj=0)
-    eps_p = {}
-    eps_m = {}
-
-
-    if norm_chosen == 1:
-        for i in range(nb_prod):
-            for m in range(nb_asst):
-                eps_p[i,m] = model.addVar(lb=0, name='eps_p_%s_%s' % (i,m), obj=1)
-                eps_m[i,m] = model.addVar(lb=0, name='eps_m_%s_%s' % (i,m), obj=1)
-    elif norm_chosen == 2:
-        quadExpr_obj = QuadExpr()
-
-        for i in range(nb_prod):
-            for m in range(nb_asst):
-                eps_p[i,m] = model.addVar(lb=0, name='eps_p_%s_%s' % (i,m), obj=0)
-                eps_m[i,m] = model.addVar(lb=0, name='eps_m_%s_%s' % (i,m), obj=0)
-
-        model.update()
-
-        for i in range(nb_prod):
-            for m in range(nb_asst):
-                quadExpr_obj += eps_p[i,m]*eps_p[i,m] + eps_m[i,m]*eps_m[i,m]
-        #print("quadExpr_obj:",quadExpr_obj)
-        #set the objective function
-        model.setObjective(quadExpr_obj)
-    else:
-        print("Wrong input; please choose L1 or L2")
-
-    model.ModelSense = 1 #Minimization
-    model.update()
-
-    #Create constraints
-    var = [lmbda[k] for k in range(nb_col)]
-    [[model.addConstr(LinExpr(A[:,i,m], var)+ eps_p[i,m] - eps_m[i,m] - v[i,m] == 0, 'distance_%s_%s' % (i,m) ) for m in range(nb_asst)] for i in range(nb_prod)]
-    if nb_col > 0:
-        model.addConstr( LinExpr([1 for i in range(nb_col)], var) == 1, name='sum_to_%s' %1)
-
-    model.update()
-
-
-    initialized = True # next iterations should use the warm start
-    nb_col_previous = nb_col
 
-    return [model, lmbda]
-
-
-def get_primal_dual_variables(model, A):
-    (nb_col,nb_prod,nb_asst) = A.shape
-
-    # definition of the return variables with expected shape
-    return_lmbda = np.zeros(max(nb_col, 1))
-    alpha = np.zeros((nb_prod, nb_asst))
-    nu = np.zeros(1)
-
-    #obj_value = model.ObjVal
-    #print("obj_value", obj_value)
-
-    # Extraction of the primal variables
-    if nb_col > 0:
-        for k in range(nb_col):
-            return_lmbda[k] = lmbda[k].X
-    else:
-        return_lmbda[0] = 0
-
-    # Extraction of the dual variables
-    constraints = model.getConstrs()
-
-    # the constraint sum_to_1 is the last one recorded; we take its dual value
-    nu[0] = constraints[-1].getAttr('Pi')
-
-    # We take the dual value of the constraints distance_i_m
-    for i in range(nb_prod):
-        for m in range(nb_asst):
-            alpha[i, m] = constraints[i * nb_asst + m].getAttr('Pi')
-
-    return [repair_lambda(return_lmbda), alpha, nu]
-
-
-#automatically detects if we have already found a solution (=> warm start) or if we need to initialize the problem
-def restricted_master(A, v, model, verbose=False):
-    if not initialized:
-        model.setParam("Method", method_to_use_first_iteration)
-        [model, lmbda] = init_model(A, v, model, verbose=False)
-    else:
-        #print("warm start")
-        model.setParam("Method", method_to_use_iterations)
-        if use_warm_start:
-            continue_warm_start(A[len(A)-nb_col_previous:,:,:], model)
+#algorithm of the master (see SolvePolicy): 'default' for the barrier at the first solve, then the dual simplex; 'auto'
+#to choose it at each solve from the runtimes measured; or one of the methods of the backend ('primal', 'dual',
+#'barrier'); only the simplex methods can be warm started with the basis
+master_method = 'default'
+#each pair (method, warm start) is measured policy_trials times before being compared to the others
+policy_trials = 2
+#the pairs are compared on the mean runtime of their last policy_window solves
+policy_window = 5
+#every policy_explore solves, the pair solved the least recently is measured again (the master grows)
+policy_explore = 50
+#file in which the decisions of the policy are appended (CSV), None to keep them only in SolvePolicy.log
+policy_log_file = None
+
+#column management of the master (see RestrictedMaster.manage_columns)
+#a column is purged from the master after purge_age consecutive solves nonbasic with a reduced cost >= 0 (0: never)
+purge_age = 0
+#maximal number of columns in the master (0: no cap); beyond, nonbasic columns are purged, largest reduced costs first
+max_master_columns = 0
+#a column out of the master is re-activated when its reduced cost is below -reactivation_tol
+reactivation_tol = 1e-9
+#number of columns whose reduced costs are computed at once when scanning the columns out of the master
+SCAN_COLUMNS = 4096
+
+#stabilization of the pricing (see DualSmoothing): weight of the stability center, in [0, 1) (0: no stabilization)
+dual_smoothing = 0
+
+#stopping criteria of the learnings, in addition to ITERATIONS_MAX and eps_stop (see StoppingPolicy); 0 disables each
+stop_gap = 0 #maximal relative gap between the objective and the Lagrangian bound
+stop_window = 0 #number of iterations over which the objective has to improve by stop_improvement (relative)
+stop_improvement = 1e-4
+stop_time_max = 0 #maximal wall-clock time of the learning, in seconds
+stop_columns_max = 0 #maximal number of columns generated
+stop_validation_patience = 5 #number of iterations without improvement of the validation error (with a validation set)
+
+#branching of the GDT (see BranchingSchedule): number of nodes expanded and of children kept at each iteration
+branching_nodes = 10
+branching_children = 20
+#if True, the numbers of nodes and children are adapted at each iteration, within [1, branching_*_max]
+adaptive_branching = False
+branching_nodes_max = 100
+branching_children_max = 200
+branching_growth = 1.5 #factor by which a number grows or shrinks
+#pricing of the GDT: 'sampled' expands the nodes drawn by choose_n, 'exhaustive' scores the children of all the columns
+#which have not ranked the no-choice option at once (see gen_GDT.exhaustive_lowest_reduced_cost); both keep the
+#children of lowest reduced costs
+gdt_pricing = 'sampled'
+
+#returns value, or the parameter name of this module if value is None: the parameters above are read when an object
+#or a learning is created, so that they can be changed at runtime (e.g. utilities.purge_age = 20)
+def setting(value, name):
+    return globals()[name] if value is None else value
+
+#Choice of the algorithm and of the warm start for each solve of the master
+#With the method 'default', the first solve uses the barrier and the next ones the dual simplex, warm started if
+#warm_start and supported by the backend. With a method of the backend, every solve uses it.
+#With 'auto', the arm is chosen from the runtimes measured. The arms are the pairs (method, warm start) supported by
+#the backend: the barrier ignores the basis and is always solved cold. The first solve, without basis, uses the first
+#cold method of the backend (the barrier if available). Then each arm is tried trials times, and the arm of lowest mean
+#runtime over its last window solves is used; every explore solves, the arm solved the least recently is measured again.
+#Each decision is recorded in log, with the runtime and the number of iterations of the solve.
+class SolvePolicy:
+    # backend: a backend of master_backends; method: 'default', 'auto' or a method of the backend
+    # warm_start, method, log_file, trials, window, explore: None for the parameters of this module
+    def __init__(self, backend, warm_start=None, method=None, log_file=None, trials=None, window=None, explore=None):
+        warm_start = setting(warm_start, 'use_warm_start')
+        method = setting(method, 'master_method')
+        log_file = setting(log_file, 'policy_log_file')
+        self.trials = setting(trials, 'policy_trials')
+        self.window = setting(window, 'policy_window')
+        self.explore = setting(explore, 'policy_explore')
+        if method == 'default':
+            self.cold_arms = [('barrier', False)]
+            self.arms = [('dual', warm_start and 'dual' in backend.warm_methods)]
         else:
-            continue_no_warm_start(A[len(A) - nb_col_previous:, :, :], model)
-
-    model.optimize()
-    time_method=model.Runtime
-    #print("time_method", time_method)
-    [return_lmbda, alpha, nu] = get_primal_dual_variables(model, A)
-    #print("model status", model.Status)
-    obj_value = model.ObjVal
-    #print("obj value", obj_value)
-    #print("dual variables", alpha)
-    return([return_lmbda, alpha, nu, obj_value, time_method])
-
-
-def continue_warm_start(A_add, model):
-    global lmbda
-    #(nb_col, nb_prod, nb_asst) = A_add.shape
-
-    vars = model.getVars()
-    constrs = model.getConstrs()
-
-    # save the basis before creation of the variables
-    [VBASES, CBASES] = saveStateWarmBasis(vars, constrs)
-
-    # create the new variables
-    size_lmbda = len(lmbda.keys())
-    new_vars = {}#np.zeros(len(A_add))
-    for k in range(len(A_add)):
-        new_vars[k] = addNewVar(model, constrs, a_col = A_add[k,:,:])
-        lmbda[size_lmbda+k] = new_vars[k]
-
-    loadStateWarmBasis(vars, constrs, VBASES, CBASES)
-    for k in range(len(A_add)):
-        new_vars[k].setAttr("VBasis", -1)
-
-    nb_col_previous = len(A_add)
-
-    return 1#model
-
-
-#same than before, but we do not attempt to warm-start
-def continue_no_warm_start(A_add, model):
-    global lmbda
-    #(nb_col, nb_prod, nb_asst) = A_add.shape
-
-    vars = model.getVars()
-    constrs = model.getConstrs()
-
-    # save the basis before creation of the variables
-    #[VBASES, CBASES] = saveStateWarmBasis(vars, constrs)
-
-    # create the new variables
-    size_lmbda = len(lmbda.keys())
-    new_vars = {}#np.zeros(len(A_add))
-    for k in range(len(A_add)):
-        new_vars[k] = addNewVar(model, constrs, a_col = A_add[k,:,:])
-        lmbda[size_lmbda+k] = new_vars[k]
-
-    #loadStateWarmBasis(vars, constrs, VBASES, CBASES)
-    #for k in range(len(A_add)):
-    #    new_vars[k].setAttr("VBasis", -1)
-
-    nb_col_previous = len(A_add)
-
-    return 1#model
+            methods = list(backend.methods) if method == 'auto' else [method]
+            self.cold_arms = [(name, False) for name in methods]
+            self.arms = [(name, True) for name in methods if warm_start and name in backend.warm_methods] + \
+                        self.cold_arms
+        for [name, warm] in self.arms + self.cold_arms:
+            if name not in backend.methods:
+                raise Exception('Unknown method ' + str(name) + ' for the backend ' + backend.name)
+        self.runtimes = dict((arm, []) for arm in self.arms + self.cold_arms)
+        self.last_solve = dict((arm, -1) for arm in self.arms + self.cold_arms)
+        self.log_file = log_file
+        self.log = []
+        self.nb_solves = 0
+        self.last_exploration = 0
+        self.arm = None
+
+    #returns the pair [method, warm_start] for the next solve, of a master of nb_columns columns
+    def decide(self, nb_columns):
+        arms = self.arms if self.nb_solves > 0 else self.cold_arms
+        untried = [arm for arm in arms if len(self.runtimes[arm]) < self.trials]
+        if len(arms) == 1:
+            [self.arm, reason] = [arms[0], 'only choice']
+        elif self.nb_solves == 0:
+            [self.arm, reason] = [arms[0], 'first solve']
+        elif len(untried) > 0:
+            [self.arm, reason] = [untried[0], 'trial']
+        elif self.nb_solves - self.last_exploration >= self.explore:
+            [self.arm, reason] = [min(arms, key=lambda arm: self.last_solve[arm]), 'exploration']
+            self.last_exploration = self.nb_solves
+        else:
+            [self.arm, reason] = [min(arms, key=lambda arm: np.mean(self.runtimes[arm][-self.window:])), 'fastest']
+        self.log.append({'solve': self.nb_solves, 'method': self.arm[0], 'warm_start': self.arm[1], 'reason': reason,
+                         'nb_columns': nb_columns, 'runtime': None, 'iterations': None})
+        return list(self.arm)
+
+    #records the runtime and the number of iterations of the solve decided last
+    def record(self, runtime, iterations):
+        self.runtimes[self.arm].append(runtime)
+        self.last_solve[self.arm] = self.nb_solves
+        self.log[-1]['runtime'] = runtime
+        self.log[-1]['iterations'] = iterations
+        self.nb_solves += 1
+        if self.log_file is not None:
+            with open(self.log_file, 'a', newline='') as file:
+                writer = csv.DictWriter(file, fieldnames=list(self.log[-1].keys()))
+                if file.tell() == 0:
+                    writer.writeheader()
+                writer.writerow(self.log[-1])
+
+    #returns the runtimes measured, to go on with them after a checkpoint (see checkpoint.py); the log is not kept
+    def state(self):
+        return {'runtimes': self.runtimes, 'last_solve': self.last_solve, 'nb_solves': self.nb_solves,
+                'last_exploration': self.last_exploration}
+
+    #restores the runtimes of the arms which are also arms of this policy
+    def restore(self, state):
+        for arm in self.arms:
+            if arm in state['runtimes']:
+                self.runtimes[arm] = list(state['runtimes'][arm])
+                self.last_solve[arm] = state['last_solve'][arm]
+        self.nb_solves = state['nb_solves']
+        self.last_exploration = state['last_exploration']
+
+
+#Master problem of a learning: owns the backend solving the LP (see master_backends) and the bookkeeping of its columns
+#The columns are identified by their id, the row of A (the pool of columns of the learning) holding their choices.
+#The master holds the columns column_ids; the other columns of A form the side pool, from which they can be re-activated.
+#Each learning creates its own RestrictedMaster: several learnings can run in the same process.
+class RestrictedMaster:
+    # backend: a backend of master_backends, e.g. master_backends.new_master('gurobi')
+    # warm_start, purge_age, max_columns, method: None for the parameters of this module
+    def __init__(self, backend, warm_start=None, purge_age=None, max_columns=None, method=None):
+        self.backend = backend
+        self.warm_start = setting(warm_start, 'use_warm_start')
+        self.policy = SolvePolicy(backend, self.warm_start, method)
+        self.purge_age = setting(purge_age, 'purge_age')
+        self.max_columns = setting(max_columns, 'max_master_columns')
+        self.initialized = False
+        # column_ids[j] is the id of the column of the j-th variable lambda of the master, ages[j] its number of
+        # consecutive solves nonbasic with a reduced cost >= 0
+        self.column_ids = np.zeros(0, dtype=np.int64)
+        self.ages = np.zeros(0, dtype=np.int64)
+        # number of rows of A already seen: the rows of A after nb_col_seen are new columns
+        self.nb_col_seen = 0
+        # statistics of the column management
+        self.nb_purged = 0
+        self.nb_reactivated = 0
+
+    #automatically detects if we have already found a solution (=> warm start) or if we need to initialize the problem
+    #the columns of A not seen yet are added to the master, which is then solved; the columns of the side pool with a
+    #negative reduced cost are re-activated (and the master solved again), then the old columns are purged
+    #returns lambda for all the columns of A (0 for those which are not in the master)
+    def restricted_master(self, A, v, assortments, verbose=False):
+        new_ids = np.arange(self.nb_col_seen, len(A))
+        if not self.initialized:
+            self.backend.init_model(A[new_ids], v, assortments, verbose)
+            self.initialized = True # next iterations should use the warm start
+        else:
+            self.add_columns(A, new_ids, assortments)
+        self.column_ids = np.concatenate((self.column_ids, new_ids))
+        self.ages = np.concatenate((self.ages, np.zeros(len(new_ids), dtype=np.int64)))
+        self.nb_col_seen = len(A)
+
+        [lmbda_master, alpha, nu, obj_value, time_method] = self.solve()
+        reactivated = self.negative_side_pool(A, alpha, nu, assortments)
+        while len(reactivated) > 0:
+            self.add_columns(A, reactivated, assortments)
+            self.column_ids = np.concatenate((self.column_ids, reactivated))
+            self.ages = np.concatenate((self.ages, np.zeros(len(reactivated), dtype=np.int64)))
+            self.nb_reactivated += len(reactivated)
+            [lmbda_master, alpha, nu, obj_value, time_solve] = self.solve()
+            time_method += time_solve
+            reactivated = self.negative_side_pool(A, alpha, nu, assortments)
+
+        return_lmbda = np.zeros(max(len(A), 1))
+        return_lmbda[self.column_ids] = lmbda_master[:len(self.column_ids)]
+        self.manage_columns(A, lmbda_master[:len(self.column_ids)], alpha, nu, assortments)
+        return([repair_lambda(return_lmbda), alpha, nu, obj_value, time_method])
+
+    #solves the master with the method and the warm start chosen by the policy
+    def solve(self):
+        [method, warm_start] = self.policy.decide(len(self.column_ids))
+        ret = self.backend.solve(method, warm_start)
+        self.policy.record(ret[4], self.backend.iterations)
+        return ret
+
+    def add_columns(self, A, ids, assortments):
+        if len(ids) > 0:
+            self.backend.add_columns(A[ids], assortments, warm_start=self.warm_start)
+
+    #returns the ids of the columns of the side pool (seen, but not in the master) with a negative reduced cost
+    #the side pool is scanned by blocks of SCAN_COLUMNS columns
+    def negative_side_pool(self, A, alpha, nu, assortments):
+        if len(self.column_ids) == self.nb_col_seen:
+            return np.zeros(0, dtype=np.int64)
+        side_pool = np.ones(self.nb_col_seen, dtype=bool)
+        side_pool[self.column_ids] = False
+        side_ids = np.nonzero(side_pool)[0]
+        ret = []
+        for k0 in range(0, len(side_ids), SCAN_COLUMNS):
+            ids = side_ids[k0:k0 + SCAN_COLUMNS]
+            rc = choice_engine.reduced_costs(np.asarray(A[ids]), alpha, nu[0], assortments)
+            ret.append(ids[rc < -reactivation_tol])
+        return np.concatenate(ret)
+
+    #ages the columns of the master after a solve, and purges to the side pool:
+    # - the columns nonbasic with a reduced cost >= 0 during purge_age consecutive solves
+    # - if the master holds more than max_columns columns, nonbasic columns, largest reduced costs first
+    #the basic columns are never purged: the solution stays optimal, and the basis valid for the warm start. Without
+    #basis (backend scipy, or barrier without crossover), the columns with lambda=0 are taken as the nonbasic ones.
+    def manage_columns(self, A, lmbda_master, alpha, nu, assortments):
+        if self.purge_age <= 0 and self.max_columns <= 0:
+            return
+        basic = self.backend.basic_columns()
+        nonbasic = (lmbda_master == 0) if basic is None else ~basic
+        rc = choice_engine.reduced_costs(np.asarray(A[self.column_ids]), alpha, nu[0], assortments)
+        inactive = nonbasic & (rc >= -reactivation_tol)
+        self.ages = np.where(inactive, self.ages + 1, 0)
+        purge = np.zeros(len(self.column_ids), dtype=bool)
+        if self.purge_age > 0:
+            purge = self.ages >= self.purge_age
+        if self.max_columns > 0 and len(self.column_ids) - purge.sum() > self.max_columns:
+            candidates = np.nonzero(nonbasic & ~purge)[0]
+            nb_over = len(self.column_ids) - purge.sum() - self.max_columns
+            purge[candidates[np.argsort(-rc[candidates], kind='stable')[:nb_over]]] = True
+        if purge.any():
+            self.backend.remove_columns(np.nonzero(purge)[0])
+            self.column_ids = self.column_ids[~purge]
+            self.ages = self.ages[~purge]
+            self.nb_purged += int(purge.sum())
+
+    #keeps only the columns of the mask keep (over the ids of A): the others are removed from the master, and the ids
+    #of the columns kept become 0, 1, ... in the same order, as after column_pool.ColumnPool.compact(keep)
+    def keep_columns(self, keep):
+        keep = np.asarray(keep, dtype=bool)
+        in_master = keep[self.column_ids]
+        self.backend.remove_columns(np.nonzero(~in_master)[0])
+        new_id = np.cumsum(keep) - 1
+        self.column_ids = new_id[self.column_ids[in_master]]
+        self.ages = self.ages[in_master]
+        self.nb_col_seen = int(keep.sum())
+
+    #returns the state of the master, for a checkpoint of the learning (see checkpoint.py): the columns in the master and
+    #their ages, the basis of the last solve and the runtimes of the policy
+    def state(self):
+        return {'column_ids': np.copy(self.column_ids), 'ages': np.copy(self.ages), 'nb_col_seen': self.nb_col_seen,
+                'nb_purged': self.nb_purged, 'nb_reactivated': self.nb_reactivated,
+                'basis': self.backend.get_basis() if self.initialized else None, 'policy': self.policy.state()}
+
+    #restores the state of a checkpoint in a master not initialized: the model is built with the columns of A which
+    #were in the master, in the same order, and its next solve is warm started with the basis of the checkpoint
+    def restore(self, state, A, v, assortments, verbose=False):
+        self.column_ids = np.copy(state['column_ids'])
+        self.ages = np.copy(state['ages'])
+        self.nb_col_seen = state['nb_col_seen']
+        self.nb_purged = state['nb_purged']
+        self.nb_reactivated = state['nb_reactivated']
+        self.backend.init_model(np.asarray(A[self.column_ids]), v, assortments, verbose)
+        self.initialized = True
+        if self.warm_start and state['basis'] is not None:
+            self.backend.set_basis(state['basis'])
+        self.policy.restore(state['policy'])
+
+
+#Wentges smoothing of the duals used by the pricing (lowest_reduced_cost of GDT, looking_for_new_column of BM)
+#The columns are priced at the point smoothing * center + (1 - smoothing) * (duals of the master), where the stability
+#center is the dual point with the best Lagrangian bound seen so far. With sum(lambda)=1, the bound at a dual point
+#(alpha, nu) is sum(alpha*v) + nu + (lowest reduced cost); it is only an estimate here, the pricing being heuristic.
+#When the columns priced at the smoothed point have no negative reduced cost for the duals of the master (mispricing),
+#the pricing falls back on the duals of the master.
+class DualSmoothing:
+    # v: sales of shape (nb_prod, nb_asst), as given to restricted_master
+    # smoothing: None for the parameter dual_smoothing
+    def __init__(self, v, smoothing=None):
+        self.v = v
+        self.smoothing = setting(smoothing, 'dual_smoothing')
+        self.center = None
+        self.best_bound = -np.inf
+        self.nb_mispricings = 0
+
+    def active(self):
+        return self.smoothing > 0 and self.center is not None
+
+    #returns the point [alpha, nu] at which the columns are priced
+    def pricing_point(self, alpha, nu):
+        if not self.active():
+            return [alpha, nu]
+        return [self.smoothing * self.center[0] + (1 - self.smoothing) * alpha,
+                self.smoothing * self.center[1] + (1 - self.smoothing) * nu]
+
+    #moves the center to (alpha, nu) if its bound, given the lowest reduced cost found there, is the best one
+    def update(self, alpha, nu, lowest_rc):
+        bound = np.sum(alpha * self.v) + np.sum(nu) + lowest_rc
+        if bound > self.best_bound:
+            self.best_bound = bound
+            self.center = [np.copy(alpha), np.copy(nu)]
+
+    #state of the smoothing, for a checkpoint of the learning (see checkpoint.py)
+    def state(self):
+        return {'center': self.center, 'best_bound': self.best_bound, 'nb_mispricings': self.nb_mispricings}
+
+    def restore(self, state):
+        self.center = state['center']
+        self.best_bound = state['best_bound']
+        self.nb_mispricings = state['nb_mispricings']
+
+
+#Stopping policy of a learning, checked after each iteration by check(); the learning stops as soon as one criterion
+#fires, and criterion records its name:
+# - 'eps_stop': the objective is below obj_stop
+# - 'gap': the objective is within a relative gap of the Lagrangian bound of the last pricing; with sum(lambda)=1, the
+#   bound at the duals of an iteration is the objective plus the lowest reduced cost found by the pricing. The pricing
+#   being heuristic, it is an estimate, which is not kept from one iteration to the next (0 is always a bound)
+# - 'stall': the objective improved by less than improvement (relative) over the last window iterations
+# - 'time': the wall-clock time since start() is above time_max seconds
+# - 'columns': the number of columns generated is above columns_max
+# - 'validation': the validation error (see Validation) did not improve during the last patience iterations
+# - 'iterations': iterations_max iterations were run
+# - or the name given to stop(), when the learning cannot go on
+class StoppingPolicy:
+    # gap, window, improvement, time_max, columns_max, patience: None for the parameters stop_* of this module
+    def __init__(self, obj_stop=0, iterations_max=10**9, gap=None, window=None, improvement=None, time_max=None,
+                 columns_max=None, patience=None):
+        self.obj_stop = obj_stop
+        self.iterations_max = iterations_max
+        self.gap = setting(gap, 'stop_gap')
+        self.window = setting(window, 'stop_window')
+        self.improvement = setting(improvement, 'stop_improvement')
+        self.time_max = setting(time_max, 'stop_time_max')
+        self.columns_max = setting(columns_max, 'stop_columns_max')
+        self.patience = setting(patience, 'stop_validation_patience')
+        self.start()
+
+    #restarts the policy, at the beginning of a learning
+    def start(self):
+        self.t0 = time.time()
+        self.history = []
+        self.validation_history = []
+        self.bound = 0
+        self.criterion = None
+
+    #records the objective obj_val of an iteration, with nb_columns columns, the Lagrangian bound of the pricing and
+    #the validation error of its model (None if unknown); returns True if the learning must stop
+    def check(self, obj_val, nb_columns, bound=None, validation_error=None):
+        self.history.append(obj_val)
+        if bound is not None:
+            self.bound = max(bound, 0)
+        if validation_error is not None:
+            self.validation_history.append(validation_error)
+        old = self.history[-1 - self.window] if 0 < self.window < len(self.history) else None
+        since_best = len(self.validation_history) - 1 - int(np.argmin(self.validation_history)) \
+            if len(self.validation_history) > 0 else 0
+        criteria = [['eps_stop', self.obj_stop > 0 and obj_val < self.obj_stop],
+                    ['gap', self.gap > 0 and obj_val - self.bound <= self.gap * obj_val],
+                    ['stall', old is not None and old - obj_val <= self.improvement * old],
+                    ['time', self.time_max > 0 and time.time() - self.t0 >= self.time_max],
+                    ['columns', self.columns_max > 0 and nb_columns >= self.columns_max],
+                    ['validation', self.patience > 0 and since_best >= self.patience],
+                    ['iterations', len(self.history) >= self.iterations_max]]
+        for [name, fired] in criteria:
+            if fired:
+                self.stop(name)
+                return True
+        return False
+
+    def stop(self, criterion):
+        self.criterion = criterion
+
+    #state of the policy, for a checkpoint of the learning (see checkpoint.py); the criteria are not part of it
+    def state(self):
+        return {'elapsed': time.time() - self.t0, 'history': list(self.history),
+                'validation_history': list(self.validation_history), 'bound': self.bound}
+
+    #restores the state of a checkpoint, after start(): the time of the learning before the checkpoint is counted
+    def restore(self, state):
+        self.t0 = time.time() - state['elapsed']
+        self.history = list(state['history'])
+        self.validation_history = list(state['validation_history'])
+        self.bound = state['bound']
+
+
+#returns the stopping policy of a learning: stopping restarted, or a new one with the default criteria above
+def stopping_policy(stopping, obj_stop, ITERATIONS_MAX):
+    if stopping is None:
+        stopping = StoppingPolicy(obj_stop, ITERATIONS_MAX)
+    else:
+        stopping.obj_stop = obj_stop
+        stopping.iterations_max = min(stopping.iterations_max, ITERATIONS_MAX)
+    stopping.start()
+    return stopping
+
+
+#Schedule of the branching of the GDT: the number of nodes expanded (sampled by choose_n) and of children kept (by
+#lowest_reduced_cost) at each iteration. It is fixed, unless adaptive: after each iteration, record() adapts both from
+#the time of the pricing, the time of the master solve and the reduced costs of the children kept, to reduce the wall
+#time of the learning:
+# - when all the children kept have a negative reduced cost, the cutoff of the children is too low: more are kept, and
+#   each master solve adds more improving columns (fewer iterations, hence fewer solves). When fewer children have a
+#   negative reduced cost, the columns of nonnegative reduced cost only make the master larger: fewer are kept (at
+#   least the ones of negative reduced cost)
+# - when the pricing takes longer than the master solve, fewer nodes are expanded. Otherwise, when the nodes expanded
+#   do not give enough children of negative reduced cost, more nodes are expanded
+#Each number grows or shrinks by the factor growth. The values chosen are recorded in log at each iteration.
+class BranchingSchedule:
+    # the arguments None are read in the parameters adaptive_branching and branching_* of this module
+    def __init__(self, adaptive=None, nodes=None, children=None, nodes_max=None, children_max=None, growth=None):
+        self.adaptive = setting(adaptive, 'adaptive_branching')
+        self.nodes = setting(nodes, 'branching_nodes')
+        self.children = setting(children, 'branching_children')
+        self.nodes_max = setting(nodes_max, 'branching_nodes_max')
+        self.children_max = setting(children_max, 'branching_children_max')
+        self.growth = setting(growth, 'branching_growth')
+        #[nodes, children, pricing time, master time, number of children of negative reduced cost] of each iteration
+        self.log = []
+
+    #records an iteration branched with the current numbers: its times of pricing and of master solve, and the reduced
+    #costs of the children kept; then adapts the numbers of the next iteration
+    def record(self, pricing_time, master_time, rc_kept):
+        nb_negative = int(np.count_nonzero(rc_kept < 0))
+        self.log.append([self.nodes, self.children, pricing_time, master_time, nb_negative])
+        if not self.adaptive:
+            return
+        if pricing_time > master_time:
+            self.nodes = self.shrunk(self.nodes)
+        elif nb_negative < self.children:
+            self.nodes = self.grown(self.nodes, self.nodes_max)
+        if nb_negative >= self.children:
+            self.children = self.grown(self.children, self.children_max)
+        elif nb_negative > 0:
+            self.children = max(nb_negative, self.shrunk(self.children))
+
+    def grown(self, number, number_max):
+        return min(int(np.ceil(number * self.growth)), number_max)
+
+    def shrunk(self, number):
+        return max(int(number / self.growth), 1)
+
+    #prints the numbers chosen for the next iteration
+    def report(self):
+        if self.adaptive:
+            print("Branching of the next iteration:", self.nodes, "nodes,", self.children, "children kept")
+
+    #state of the schedule, for a checkpoint of the learning (see checkpoint.py)
+    def state(self):
+        return {'nodes': self.nodes, 'children': self.children, 'log': list(self.log)}
+
+    def restore(self, state):
+        self.nodes = state['nodes']
+        self.children = state['children']
+        self.log = list(state['log'])
+
+
+#Validation error of the models of a learning on hold-out assortments, computed at each iteration (see the criterion
+#'validation' of StoppingPolicy): it is the error of gen_GDT.compute_eps, without a call to it. The choices of a column
+#on the hold-out assortments are computed once, when it first appears, and the shares predicted A_val lambda are kept:
+#they are linear in lambda, so only the columns whose lambda changed since the last iteration update them.
+class Validation:
+    # assortments, Proba_product: the hold-out assortments and their sales (Proba_product=None for an AssortmentData)
+    # indifference: True for GDT, False for BM (see choice_engine.batch_choices)
+    def __init__(self, assortments, Proba_product=None, indifference=True):
+        self.data = dataset.as_dataset(assortments, Proba_product)
+        self.indifference = indifference
+        self.sales = dataset.sales_on_offers(self.data)
+        self.weights = dataset.weights(self.data)
+        # choices of the columns on the hold-out assortments, in the order of the pool of the learning
+        self.pool = column_pool.ColumnPool(self.data.nb_prod, self.data.nb_asst)
+        # lambdas of the columns in the shares predicted, aligned with the offers of data
+        self.lambdas = np.zeros(0)
+        self.shares = np.zeros(len(self.sales))
+        self.nb_updates = 0
+
+    #returns the validation error of the model (sigmas, lambdas): sigmas are the columns of the pool of the learning,
+    #whose first columns were given to the previous calls
+    def error(self, sigmas, lambdas):
+        nb_new = len(sigmas) - len(self.pool)
+        if nb_new > 0:
+            new_sigmas = np.asarray(sigmas[len(self.pool):])
+            self.pool.append(new_sigmas, choice_engine.batch_choices(new_sigmas, self.data, self.indifference))
+            self.lambdas = np.concatenate((self.lambdas, np.zeros(nb_new)))
+        changed = np.nonzero(lambdas[:len(self.pool)] != self.lambdas)[0]
+        if len(changed) > 0:
+            delta = lambdas[changed] - self.lambdas[changed]
+            self.shares += choice_engine.predicted_shares(np.asarray(self.pool.A()[changed]), delta, self.data).data
+            self.lambdas[changed] = lambdas[changed]
+            self.nb_updates += len(changed)
+        err = np.abs(self.shares - self.sales) * np.repeat(self.weights, self.data.sizes)
+        return err.sum() / (2. * self.weights.sum())
+
+
+#prints the number of iterations and the time of a learning, and the stopping criterion which fired
+def report_convergence(stopping, nb_iterations, total_time, stabilization):
+    print("Stopped by the criterion", stopping.criterion, "after", nb_iterations, "iterations, in", total_time, "s")
+    if len(stopping.validation_history) > 0:
+        print("Best validation error", min(stopping.validation_history), "at the iteration",
+              int(np.argmin(stopping.validation_history)) + 1)
+    if stabilization.smoothing > 0:
+        print("Dual smoothing", stabilization.smoothing, ":", stabilization.nb_mispricings, "mispricings")
+
+
+#solves the master problem model (a RestrictedMaster) with the columns of A
+#A is given in the compact encoding of choice_engine (choices of shape (nb_col, nb_asst)), v of shape (nb_prod, nb_asst)
+def restricted_master(A, v, assortments, model, verbose=False):
+    return model.restricted_master(A, v, assortments, verbose)
 
 
 
@@ -223,60 +564,29 @@ def repair_lambda(lambda_found):
     return lambda_found/lambda_found.sum()
 
 
-def saveStateWarmBasis(vars, constrs):
-    VBASES = np.zeros(len(vars), dtype=int)
-    for i in range(len(vars)):
-        VBASES[i] = vars[i].VBasis
-
-    CBASES = np.zeros(len(constrs), dtype=int)
-    for i in range(len(constrs)):
-        CBASES[i] = constrs[i].CBasis
-
+#the basis statuses are read and written with a single call to the model for all the variables (resp. constraints)
+def saveStateWarmBasis(model, vars, constrs):
+    VBASES = np.array(model.getAttr("VBasis", vars), dtype=int)
+    CBASES = np.array(model.getAttr("CBasis", constrs), dtype=int)
     return [VBASES, CBASES]
 
 
-def loadStateWarmBasis(vars, constrs, VBASES, CBASES):
-    for i in range(len(vars)):
-        vars[i].setAttr("Vbasis", int(VBASES[i]))
-    for i in range(len(constrs)):
-        constrs[i].setAttr("CBasis", int(CBASES[i]))
+def loadStateWarmBasis(model, vars, constrs, VBASES, CBASES):
+    model.setAttr("VBasis", vars, VBASES.tolist())
+    model.setAttr("CBasis", constrs, CBASES.tolist())
     return [vars, constrs]
 
 
-# add a single new variable
-def addNewVar(model, constrs, a_col):
-    size_lmbda = len(lmbda.keys())
-    var = model.addVar(lb = 0, vtype = GRB.CONTINUOUS, name = 'lambda_%s' % size_lmbda , obj = 0)
-    model.update()
-
-    #sets the coefficients to put to this var in the constraints
-
-    #the last constraint is sum(lambda) = 1: we put the coeff 1
-    constr = constrs[-1]
-    model.chgCoeff(constr, var, 1)
-
-    # the constraints A\lambda +eps+ - eps- = v
-    for i in range(len(constrs)-1):
-        #selection of the constraint
-        constr = constrs[i]
-        #apply the coeff found at the proper place in A_add to this variable in the constraint
-        #.reshape((-1)) results in a flattened array of 1 dimension
-        coeff = a_col.reshape((-1))[i]
-        model.chgCoeff(constr, var, coeff)
-
-    model.update()
-    return var
-
-
 # if Inventories is a boolean array of size (nb_asst_to_evaluate, nb_options), we return the array of size (nb_asst_to_evaluate) with the corresponding revenue
+# Inventories may also be a dataset.AssortmentData: for each assortment, only the products offered are read in the CSR offers
 def revenue_MMNL(Inventories, u, p, Revenue):
-    (nb_class, nb_prod) = u.shape
-    nb_asst = len(Inventories)
-    Proba_product = np.zeros_like(Inventories, dtype=np.float32)
+    offers = dataset.offers_csr(Inventories)
+    nb_asst = offers.shape[0]
+    Revenue = np.asarray(Revenue)
+    ret = np.zeros(nb_asst)
     for m in range(nb_asst):
-        for i in range(nb_prod):
-            if (Inventories[m, i]):
-                for t in range(nb_class):
-                    Proba_product[m, i] += p[t] * np.exp(u[t, i]) / (np.exp(u[t, Inventories[m, :]]).sum())
-
-    return np.matmul(Proba_product, Revenue)
\ No newline at end of file
+        products = offers.indices[offers.indptr[m]:offers.indptr[m+1]]
+        exp_u = np.exp(u[:, products])
+        Proba_product_m = np.matmul(p, exp_u / exp_u.sum(axis=1, keepdims=True))
+        ret[m] = np.matmul(Proba_product_m, Revenue[products])
+    return ret
\ No newline at end of file
@@ -0,0 +1,138 @@
+#Reference implementations of the choice kernels, as they were written in lib/gen_GDT.py and lib/gen_BM.py before
+#being replaced by the batched kernels of lib/choice_engine.py
+#They are slow but simple, and are only used by test_kernels.py to check the kernels of lib and to measure their speedup.
+#Do not optimize them.
+
+import numpy as np
+
+
+#############################
+#  GDT kernels: the customer is indifferent (uniform choice among the products of the assortment) when the best
+#  product present in the assortment is not unique in sigma
+#
+
+# returns the product chosen by the customer defined by sigma when the assortment asst is displayed to him
+def product_chosen_GDT(sigma, asst):
+    if np.sum(asst, axis=0) == 0:
+        return -1
+    # value is the rank of preference in sigma of the prefered product present in the assortment
+    value = np.min(sigma[np.nonzero(asst)])
+    where_is_value = np.where(sigma == value)[0]
+    if (len(where_is_value) == 1):
+        return where_is_value[0]
+    elif (len(where_is_value) == 0 or len(where_is_value) >= 2):
+        return -1
+
+
+# Returns the column a associated to a sigma and several assortments
+# the last block is sufficient, but we can speed up the algo (approx *3) with the first three blocks that deal with the singularities very efficiently (cases where the 1st, 2nd or no product is chosen)
+def sigma2a_GDT(sigma, assortments):
+    nb_asst = len(assortments)
+    nb_prod = len(sigma)
+    ret = np.zeros((nb_prod, nb_asst))
+
+    # three blocks to improve efficiency:
+    # we have to process the assts_not_yet_processed, that will store the assortments not catched by the speed-ups
+    # 1. when the preferred product of sigma is present in the assortments, we fill the assortments
+    preferred_prod = np.where(sigma == 0)[0][0]
+    ret[preferred_prod, assortments[:, preferred_prod]] = 1
+    assts_not_yet_processed = np.arange(nb_asst)[np.invert(assortments[:, preferred_prod])]
+
+    # 2. same thing for the second product; we may have only the first product ranked in sigma, that is why we put a 'try' block
+    try:
+        scd_preferred_prod = np.where(sigma == 1)[0][0]
+        ret[scd_preferred_prod, np.invert(assortments[:, preferred_prod]) & assortments[:, scd_preferred_prod]] = 1
+        assts_not_yet_processed = np.arange(nb_asst)[np.invert(assortments[:, preferred_prod]) & np.invert(
+            assortments[:,
+            scd_preferred_prod])]  # absence of preferred product and presence of second preferred product
+    except:
+        a = 1  # useless
+
+    # 3. catching the assortments in which we have none of the products ordered
+    # it is equivalent to 'the products ranked==nb_prod-1 (ie not ordered) are present in number equal to the size of the assortment
+    asst_without_choice = \
+    np.where(assortments[:, np.where(sigma == nb_prod - 1)[0]].sum(axis=1) == assortments.sum(axis=1))[
+        0]  # True when  the two previous numbers are equal: ie we know that no product preferred is in the asst!
+    nb_prod_pst_in_asst = assortments.sum(axis=1)
+    for m in asst_without_choice:
+        ret[assortments[m, :], m] = 1 / nb_prod_pst_in_asst[m]
+
+    assts_not_yet_processed = np.setdiff1d(assts_not_yet_processed, asst_without_choice)
+
+    for m in assts_not_yet_processed:
+        prod_chosen = int(product_chosen_GDT(sigma, assortments[m][:]))  # is equal to -1 if no product chosen
+        if (prod_chosen != -1):
+            ret[prod_chosen, m] = 1
+        # module added to put 1/nb_prod_pst_in_asst at the components if no product chosen: GDT
+        else:
+            nb_prod_pst_in_asst = assortments[m, :].sum()
+            ret[assortments[m, :].astype(bool), m] = 1 / nb_prod_pst_in_asst
+    return ret
+
+
+# get the matrix A corresponding to a list of columns sigmas
+# calls the function sigma2a several times
+def multiple_sigma2a_GDT(sigmas, assortments):
+    nb_col = len(sigmas)
+    nb_prod = len(sigmas.T)
+    nb_asst = len(assortments)
+    ret = np.empty((nb_col, nb_prod, nb_asst), dtype=np.float64)
+    for k in range(nb_col):
+        ret[k, :, :] = sigma2a_GDT(sigmas[k, :], assortments)
+    return ret
+
+
+# computes the reduced cost of a column expressed as sigma
+def reduced_cost_GDT(sigma, alpha, nu, Inventories):
+    return - np.sum(np.sum((alpha * sigma2a_GDT(sigma, Inventories)), axis=0), axis=0) - nu
+
+
+def compute_eps(A_f, lambda_f, Proba_prod):
+    (nb_col, nb_prod, nb_asst) = A_f.shape
+    err = 0
+    for m in range(nb_asst):
+        for i in range(nb_prod):
+            err = err + np.abs(np.matmul(A_f[:, i, m], lambda_f) - Proba_prod[m,i])
+    return err / (2. * nb_asst)
+#
+#############################
+
+
+#############################
+#  BM kernels: the customer chooses the first product of best rank, and the product 0 in an empty assortment
+#
+
+def product_chosen_BM(sigma, asst):
+    if np.sum(asst, axis=0) == 0:
+        return 0
+    prod_chosen = np.nonzero(asst)[0][0]
+    for i in range(len(sigma)):
+        if asst[i]:
+            if sigma[i]<sigma[prod_chosen]:
+                prod_chosen = i
+    return prod_chosen
+
+
+def sigma2a_BM(sigma, assortments):
+    nb_asst = len(assortments)
+    nb_prod = len(sigma)
+    ret = np.zeros((nb_prod, nb_asst))
+    for m in range(nb_asst):
+        ret[ int(product_chosen_BM(sigma, assortments[m][:])) , m] = 1
+    return ret
+
+
+def multiple_sigma2a_BM(sigmas, assortments):
+    nb_col = len(sigmas)
+    nb_prod = len(sigmas.T)
+    nb_asst = len(assortments)
+    ret = np.empty((nb_col, nb_prod, nb_asst), dtype=np.float64)
+    for k in range(nb_col):
+        ret[k, :, :] = sigma2a_BM(sigmas[k, :], assortments)
+    return ret
+
+
+def reduced_cost_BM(sigma, alpha, nu, Inventories):
+    return - np.sum(np.sum((alpha * sigma2a_BM(sigma, Inventories)), axis=0), axis=0) - nu
+#
+#############################
@@ -0,0 +1,56 @@
+#This test measures the adaptive branching schedule of the GDT (see utilities.BranchingSchedule):
+# - sales on random assortments are generated with a MMNL choice model, with a seeded RNG
+# - GDT choice models are learned until eps_stop with the fixed schedule (10 nodes, 20 children) and the adaptive one
+# - the schedule must log the values chosen at each iteration, within their bounds
+# - the number of iterations, of columns and the wall time to reach eps_stop are printed for each schedule
+# The functions test_* can also be run with pytest.
+#
+# Example of call: 'python test_branching.py' or 'python test_branching.py 0.005' for another eps_stop
+
+from context import sample
+import sys
+import time
+import numpy as np
+
+import lib.gen_GDT as gen_GDT
+import lib.utilities as utilities
+from test_stabilization import mmnl_instance
+
+EPS_STOP = 0.01
+NB_ITER = 30
+# the masters of the adaptive schedule may be too large for a size-limited Gurobi license
+BACKEND = 'highs'
+
+
+# Returns [iterations, columns, time, schedule] of a learning until eps_stop (or NB_ITER iterations if eps_stop=0)
+def learn(adaptive, eps_stop):
+    [Inventories, Proba_product] = mmnl_instance(0)
+    np.random.seed(0)
+    branching = utilities.BranchingSchedule(adaptive)
+    t1 = time.time()
+    [sigmas, lambdas, obj_val_master, history_obj_val] = gen_GDT.run_GDT(Inventories, Proba_product, NB_ITER, eps_stop,
+                                                                         backend=BACKEND, branching=branching)
+    return [len(history_obj_val) - 1, len(sigmas), time.time() - t1, branching]
+
+
+def test_schedule_logged():
+    for adaptive in [False, True]:
+        [nb_iterations, nb_columns, total_time, branching] = learn(adaptive, 0)
+        assert len(branching.log) == nb_iterations
+        nodes = np.array([entry[0] for entry in branching.log])
+        children = np.array([entry[1] for entry in branching.log])
+        assert (nodes >= 1).all() and (nodes <= branching.nodes_max).all()
+        assert (children >= 1).all() and (children <= branching.children_max).all()
+        if not adaptive:
+            assert (nodes == utilities.branching_nodes).all() and (children == utilities.branching_children).all()
+
+
+if __name__ == '__main__':
+    test_schedule_logged()
+    print("test_schedule_logged OK")
+    eps_stop = float(sys.argv[1]) if len(sys.argv) > 1 else EPS_STOP
+    rows = [[adaptive] + learn(adaptive, eps_stop) for adaptive in [False, True]]
+    print("Iterations and time to eps_stop =", eps_stop)
+    for [adaptive, nb_iterations, nb_columns, total_time, branching] in rows:
+        print("adaptive=%-5s iterations=%-5d columns of the model=%-5d time=%8.2fs last branching: %d nodes, %d children"
+              % (adaptive, nb_iterations, nb_columns, total_time, branching.nodes, branching.children))
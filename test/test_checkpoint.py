@@ -0,0 +1,147 @@
+#This test checks the checkpoints of the learnings (see lib/checkpoint.py):
+# - sales on random assortments are generated with a MMNL choice model, with a seeded RNG
+# - a learning of NB_ITER iterations writing checkpoints is stopped after NB_ITER_CRASH iterations (as if it died), then
+#   resumed twice from its last checkpoint up to NB_ITER iterations, after different seeds
+# - the resumed learnings must hold the history of the learning stopped, and find the same objective at the first
+#   iteration after the checkpoint, their RNGs, duals and columns being restored. The solves are not reproducible
+#   beyond (nor compared to a learning run in one go): the SolvePolicy chooses the algorithms from the runtimes
+#   measured, and a degenerate master may have several optimal duals.
+# - a learning on the first NB_ASST_OLD assortments is updated with the other ones: the first master solved by the
+#   update holds the columns of the learning, so its objective must be the one of these columns refitted on all the
+#   assortments (master_backends.refit_lambdas)
+# - checkpoints of a pool of columns on the disk, written while columns are appended: each checkpoint copies only the
+#   columns added since the previous one, and loads the columns of the pool when it was saved
+# The functions test_* can also be run with pytest.
+#
+# Example of call: 'python test_checkpoint.py'
+
+from context import sample
+import os
+import shutil
+import tempfile
+import numpy as np
+
+import lib.gen_GDT as gen_GDT
+import lib.gen_BM as gen_BM
+import lib.checkpoint as checkpoint
+import lib.column_pool as column_pool
+import lib.dataset as dataset
+import lib.master_backends as master_backends
+import lib.utilities as utilities
+from test_stabilization import mmnl_instance
+
+NB_ITER = 20
+NB_ITER_CRASH = 12
+CHECKPOINT_EVERY = 4
+NB_ASST_OLD = 20
+BACKENDS = ['gurobi', 'highs']
+NB_PROD = 10
+NB_ASST = 30
+NB_COLUMNS_ADDED = [25, 1, 0, 40]
+
+
+# Returns the history of the objectives of the learning stopped, and of the two learnings resumed
+def run_and_resume(run, backend):
+    [Inventories, Proba_product] = mmnl_instance(0)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'checkpoint.dat')
+        np.random.seed(0)
+        checkpointer = checkpoint.Checkpointer(filename, every_iterations=CHECKPOINT_EVERY, every_seconds=0)
+        history = run(Inventories, Proba_product, NB_ITER_CRASH, backend=backend, checkpointer=checkpointer)[3]
+        # the last checkpoint and its file of columns
+        assert sorted(os.listdir(directory)) == ['checkpoint.dat', os.path.basename(checkpointer.columns_filename)]
+        histories_resumed = []
+        for seed in [1, 2]:
+            # each learning resumed writes its own checkpoints
+            shutil.copy(filename, filename + str(seed))
+            np.random.seed(seed)  # the RNGs are restored from the checkpoint
+            checkpointer = checkpoint.Checkpointer(filename + str(seed), every_iterations=CHECKPOINT_EVERY,
+                                                   every_seconds=0)
+            histories_resumed.append(run(Inventories, Proba_product, NB_ITER, backend=backend,
+                                         checkpointer=checkpointer, resume=True)[3])
+    return [history] + histories_resumed
+
+
+def check(run):
+    for backend in BACKENDS:
+        [history, history_resumed_1, history_resumed_2] = run_and_resume(run, backend)
+        assert len(history_resumed_1) > len(history)
+        assert np.array_equal(history_resumed_1[:len(history)], history)
+        assert np.allclose(history_resumed_1[:len(history) + 1], history_resumed_2[:len(history) + 1], atol=1e-6)
+
+
+# Returns the objective of the first master of the update, and of the columns of the learning refitted on all the data
+def learn_and_update(run, backend, indifference):
+    [Inventories, Proba_product] = mmnl_instance(0)
+    data = dataset.AssortmentData(Inventories, Proba_product)
+    with tempfile.TemporaryDirectory() as directory:
+        checkpointer = checkpoint.Checkpointer(os.path.join(directory, 'checkpoint.dat'))
+        np.random.seed(0)
+        run(data.take(np.arange(NB_ASST_OLD)), None, NB_ITER, backend=backend, checkpointer=checkpointer)
+        sigmas = checkpoint.load(checkpointer.filename, 'GDT' if indifference else 'BM')['sigmas']
+        history_update = run(data, None, NB_ITER, backend=backend, checkpointer=checkpointer, resume=True)[3]
+    obj_refit = master_backends.refit_lambdas(sigmas, data, None, indifference, backend)[1]
+    return [history_update[0], obj_refit]
+
+
+def check_update(run, indifference):
+    for backend in BACKENDS:
+        [obj_update, obj_refit] = learn_and_update(run, backend, indifference)
+        assert np.isclose(obj_update, obj_refit, atol=1e-6)
+
+
+def test_incremental_columns():
+    np.random.seed(0)
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'checkpoint.dat')
+        pool = column_pool.ColumnPool(NB_PROD, NB_ASST, directory=directory)
+        model = utilities.RestrictedMaster(master_backends.new_master('highs'))
+        stabilization = utilities.DualSmoothing(np.zeros((NB_PROD, NB_ASST)))
+        stopping = utilities.StoppingPolicy()
+        # the columns copied by the writer of the checkpoints
+        copied = []
+        copy = pool.copy
+        def copy_recorded(first, last):
+            copied.append([first, last])
+            return copy(first, last)
+        pool.copy = copy_recorded
+        checkpointer = checkpoint.Checkpointer(filename, every_iterations=1, every_seconds=0)
+        pool.append(np.random.randint(NB_PROD, size=(5, NB_PROD)), np.random.randint(-1, NB_PROD, size=(5, NB_ASST)))
+        for iteration, nb_columns in enumerate(NB_COLUMNS_ADDED):
+            nb_saved = len(pool)
+            state = checkpoint.learning_state('GDT', iteration, [], pool, model, stabilization, stopping)
+            assert state['nb_columns'] == nb_saved and 'sigmas' not in state and 'choices' not in state
+            checkpointer.save(iteration, state)
+            # columns are appended while the checkpoint is written
+            pool.append(np.random.randint(NB_PROD, size=(nb_columns, NB_PROD)),
+                        np.random.randint(-1, NB_PROD, size=(nb_columns, NB_ASST)))
+            checkpointer.close()
+            assert copied[-1][1] == nb_saved if copied else nb_saved == 0
+            loaded = checkpoint.load(filename, 'GDT')
+            assert np.array_equal(loaded['sigmas'], pool.sigma()[:nb_saved])
+            assert np.array_equal(loaded['choices'], pool.A()[:nb_saved])
+        # each column was copied once
+        assert [first for [first, last] in copied] == [0] + [last for [first, last] in copied[:-1]]
+        pool.close()
+
+
+def test_resume_GDT():
+    check(gen_GDT.run_GDT)
+
+
+def test_resume_BM():
+    check(gen_BM.run_BM)
+
+
+def test_update_GDT():
+    check_update(gen_GDT.run_GDT, True)
+
+
+def test_update_BM():
+    check_update(gen_BM.run_BM, False)
+
+
+if __name__ == '__main__':
+    for test in [test_incremental_columns, test_resume_GDT, test_resume_BM, test_update_GDT, test_update_BM]:
+        test()
+        print(test.__name__, "OK")
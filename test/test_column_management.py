@@ -0,0 +1,100 @@
+#This test checks the column management of the master (see utilities.RestrictedMaster.manage_columns):
+# - sales on random assortments are generated with a MMNL choice model, with a seeded RNG, and batches of columns of
+#   random GDT consumer behaviors are given to the master, one batch per solve, as in a learning
+# - the master purges its old columns (purge_age) and caps its number of columns (max_columns): the columns purged
+#   must be nonbasic in the last solve, the columns re-activated from the side pool must have a negative reduced cost,
+#   and the objective must be the one of a master keeping all the columns
+# The functions test_* can also be run with pytest.
+#
+# Example of call: 'python test_column_management.py'
+
+from context import sample
+import numpy as np
+
+import lib.utilities as utilities
+import lib.choice_engine as choice_engine
+import lib.master_backends as master_backends
+from test_stabilization import mmnl_instance
+
+NB_BATCHES = 15
+BATCH_SIZE = 15
+PURGE_AGE = 2
+MAX_COLUMNS = 60
+BACKENDS = ['gurobi', 'highs', 'scipy']
+
+
+# Returns the assortments, their sales v of shape (nb_prod, nb_asst) and the choices of the batches of columns
+def instance():
+    [Inventories, Proba_product] = mmnl_instance(0)
+    nb_prod = Inventories.shape[1]
+    rng = np.random.default_rng(0)
+    sigmas = np.full((nb_prod + NB_BATCHES * BATCH_SIZE, nb_prod), nb_prod - 1, dtype=np.int32)
+    np.fill_diagonal(sigmas[:nb_prod], 0)
+    for k in range(nb_prod, len(sigmas)):
+        ranked = rng.permutation(nb_prod)[:rng.integers(1, nb_prod)]
+        sigmas[k, ranked] = np.arange(len(ranked))
+    A = choice_engine.batch_choices(sigmas, Inventories)
+    return [Inventories, Proba_product.T, [A[:nb_prod + b * BATCH_SIZE] for b in range(NB_BATCHES + 1)]]
+
+
+# Wraps the purge and the re-activation of the master model to check them; returns the counts of columns checked
+def check_management(model, A_current):
+    backend = model.backend
+    counts = {'purged': 0, 'reactivated': 0}
+    remove_columns = backend.remove_columns
+    negative_side_pool = model.negative_side_pool
+
+    def checked_remove_columns(positions):
+        basic = backend.basic_columns()
+        if basic is not None:
+            assert not basic[positions].any()
+        counts['purged'] += len(positions)
+        remove_columns(positions)
+
+    def checked_negative_side_pool(A, alpha, nu, assortments):
+        ids = negative_side_pool(A, alpha, nu, assortments)
+        if len(ids) > 0:
+            assert (choice_engine.reduced_costs(np.asarray(A[ids]), alpha, nu[0], assortments) < 0).all()
+        counts['reactivated'] += len(ids)
+        return ids
+
+    backend.remove_columns = checked_remove_columns
+    model.negative_side_pool = checked_negative_side_pool
+    return counts
+
+
+def check_backend(backend):
+    [Inventories, v, batches] = instance()
+    managed = utilities.RestrictedMaster(master_backends.new_master(backend), purge_age=PURGE_AGE,
+                                         max_columns=MAX_COLUMNS)
+    full = utilities.RestrictedMaster(master_backends.new_master(backend), purge_age=0, max_columns=0)
+    counts = check_management(managed, batches)
+    for A in batches:
+        [lambda_managed, obj_managed] = managed.restricted_master(A, v, Inventories)[0:4:3]
+        obj_full = full.restricted_master(A, v, Inventories)[3]
+        assert np.isclose(obj_managed, obj_full, atol=1e-6)
+        # beyond the cap, only basic columns are left
+        if len(managed.column_ids) > MAX_COLUMNS:
+            basic = managed.backend.basic_columns()
+            assert (lambda_managed[managed.column_ids] > 0).all() if basic is None else basic.all()
+    assert counts['purged'] > 0 and counts['purged'] == managed.nb_purged
+    assert counts['reactivated'] == managed.nb_reactivated
+    return counts
+
+
+def test_gurobi():
+    check_backend('gurobi')
+
+
+def test_highs():
+    check_backend('highs')
+
+
+def test_scipy():
+    check_backend('scipy')
+
+
+if __name__ == '__main__':
+    for test in [test_gurobi, test_highs, test_scipy]:
+        test()
+        print(test.__name__, "OK")
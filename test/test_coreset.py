@@ -0,0 +1,84 @@
+#This test measures the compression of the training assortments into a coreset (see dataset.coreset):
+# - near-identical assortments are generated around a few base assortments (a product added or removed), with their
+#   sales under a MMNL choice model, with a seeded RNG
+# - a GDT choice model is learned on the full data, then on coresets of several sizes K; the lambdas learned on a
+#   coreset are refitted on the full data (master_backends.refit_lambdas)
+# - for each K, the approximation error of the coreset is printed next to the times of the learning on the coreset and
+#   of the refit, the speedup over the learning on the full data (all measured), and the error of the refitted model on
+#   the full data
+#
+# Example of call: 'python test_coreset.py'
+
+from context import sample
+import time
+import numpy as np
+
+import lib.gen_GDT as gen_GDT
+import lib.dataset as dataset
+import lib.choice_engine as choice_engine
+import lib.master_backends as master_backends
+
+# size of the instance, and parameters of the MMNL generating the sales
+NB_PROD = 20
+NB_BASE_ASST = 20
+NB_ASST = 300
+T = 5
+L = 10
+NB_FAV_PROD = 4
+# sizes of the coresets compared
+CORESET_SIZES = [20, 50, 100]
+EPS_STOP = 0.02
+# the full data is too large for a size-limited Gurobi license
+BACKEND = 'highs'
+
+
+# Returns NB_ASST assortments, each one a base assortment with a random product added or removed (the no-choice option
+# 0 is always offered), and their sales under a random MMNL model
+def near_identical_instance(seed):
+    rng = np.random.default_rng(seed)
+    u = np.log(rng.random((T, NB_PROD)))
+    for t in range(T):
+        u[t, rng.permutation(NB_PROD)[:NB_FAV_PROD]] += np.log(L)
+    p = rng.dirichlet(np.ones(T))
+    base = rng.random((NB_BASE_ASST, NB_PROD)) < 0.5
+    Inventories = base[rng.integers(NB_BASE_ASST, size=NB_ASST)]
+    flipped = rng.integers(1, NB_PROD, size=NB_ASST)
+    Inventories[np.arange(NB_ASST), flipped] = ~Inventories[np.arange(NB_ASST), flipped]
+    Inventories[:, 0] = True
+    exp_u = np.exp(u)[:, None, :] * Inventories[None, :, :]
+    Proba_product = np.einsum('t,tmi->mi', p, exp_u / exp_u.sum(axis=2, keepdims=True))
+    return [Inventories, Proba_product]
+
+
+# Learns a GDT choice model on the data, and refits its lambdas on the data full; returns [time of the learning, time
+# of the refit, error on full]
+def learn(data, full):
+    np.random.seed(0)
+    t1 = time.time()
+    [sigmas, lambdas, obj_val_master, history_obj_val] = gen_GDT.run_GDT(data, None, eps_stop=EPS_STOP,
+                                                                         backend=BACKEND)
+    learning_time = time.time() - t1
+    t1 = time.time()
+    if data is not full:
+        lambdas = master_backends.refit_lambdas(sigmas, full, None, True, BACKEND)[0]
+    refit_time = time.time() - t1
+    return [learning_time, refit_time,
+            gen_GDT.compute_eps(choice_engine.batch_choices(sigmas, full), lambdas, None, full)]
+
+
+if __name__ == '__main__':
+    [Inventories, Proba_product] = near_identical_instance(0)
+    full = dataset.deduplicate(Inventories, Proba_product)[0]
+    [time_full, time_refit, eps_full] = learn(full, full)
+    rows = []
+    for K in CORESET_SIZES:
+        [representatives, assignment] = dataset.coreset(full, None, K)
+        approximation_error = dataset.coreset_error(full, None, representatives, assignment)
+        [time_coreset, time_refit, eps_coreset] = learn(representatives, full)
+        rows.append([len(representatives), approximation_error, time_coreset, time_refit,
+                     time_full / (time_coreset + time_refit), eps_coreset])
+    print(len(full), "distinct assortments; learning on the full data in %.2fs, error %.6f" % (time_full, eps_full))
+    for [K, approximation_error, time_coreset, time_refit, speedup, eps_coreset] in rows:
+        print("coreset K=%-5d approximation error=%.6f learning %.2fs refit %.2fs speedup=%6.1f "
+              "error of the refit on full=%.6f" % (K, approximation_error, time_coreset, time_refit, speedup,
+                                                  eps_coreset))
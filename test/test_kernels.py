@@ -0,0 +1,241 @@
+#This test checks the choice kernels of lib against their reference implementations (reference_kernels.py):
+# - on random instances generated with seeded RNGs, the choice tensors of the kernels must be bit-identical to the
+#   ones of the references, including the GDT cases of indifference and of ties, and the reduced costs and errors equal
+# - with the parameter 'bench', both are timed over a grid of nb_prod x nb_asst x nb_col, and the speedups are written
+#   in a JSON and a CSV file
+# The functions test_* can also be run with pytest.
+#
+# Example of call: 'python test_kernels.py' for the tests, 'python test_kernels.py bench kernels_speedup' for the
+# benchmark, written in kernels_speedup.json and kernels_speedup.csv
+
+from context import sample
+import sys
+import csv
+import json
+import time
+import numpy as np
+
+import reference_kernels
+import lib.choice_engine as choice_engine
+import lib.dataset as dataset
+import lib.gen_GDT as gen_GDT
+import lib.gen_BM as gen_BM
+
+# sizes (nb_prod, nb_asst, nb_col) of the instances of the tests
+TEST_SIZES = [(2, 5, 4), (5, 30, 20), (12, 60, 40), (30, 40, 25)]
+# grid of the benchmark
+BENCH_NB_PROD = [10, 50]
+BENCH_NB_ASST = [50, 200]
+BENCH_NB_COL = [10, 100]
+# each time is the best of BENCH_REPEAT runs
+BENCH_REPEAT = 3
+
+
+#############################
+#  Random instances
+#
+
+# Returns random assortments of shape (nb_asst, nb_prod); the first one is empty and the second one holds a single
+# product, to cover the singular cases of the kernels
+def random_assortments(rng, nb_prod, nb_asst):
+    ret = rng.random((nb_asst, nb_prod)) < rng.uniform(0.1, 0.6, size=(nb_asst, 1))
+    ret[0, :] = False
+    if nb_asst > 1:
+        ret[1, :] = False
+        ret[1, rng.integers(nb_prod)] = True
+    return ret
+
+
+# Returns nb_col random sigmas of the GDT: a random prefix of products ranked 0, 1, ..., the other products having the
+# rank nb_prod-1 (not ranked). The short prefixes create indifference, and ties between the products not ranked.
+def random_sigmas_GDT(rng, nb_prod, nb_col):
+    ret = np.full((nb_col, nb_prod), nb_prod - 1, dtype=np.int32)
+    for k in range(nb_col):
+        length = rng.integers(1, nb_prod + 1) if rng.random() < 0.5 else rng.integers(1, min(3, nb_prod) + 1)
+        ret[k, rng.permutation(nb_prod)[:length]] = np.arange(length)
+    return ret
+
+
+# Returns nb_col random sigmas of BM: random permutations of the ranks
+def random_sigmas_BM(rng, nb_prod, nb_col):
+    return np.argsort(rng.random((nb_col, nb_prod)), axis=1).astype(np.int32)
+
+
+# Returns random sales Proba_product on the assortments (a distribution on the products of each assortment)
+def random_sales(rng, assortments):
+    ret = rng.random(assortments.shape) * assortments
+    sums = ret.sum(axis=1, keepdims=True)
+    return np.divide(ret, sums, out=np.zeros_like(ret), where=sums > 0)
+
+
+def random_instance(seed, nb_prod, nb_asst, nb_col):
+    rng = np.random.default_rng(seed)
+    assortments = random_assortments(rng, nb_prod, nb_asst)
+    return {'assortments': assortments,
+            'sigmas_GDT': random_sigmas_GDT(rng, nb_prod, nb_col),
+            'sigmas_BM': random_sigmas_BM(rng, nb_prod, nb_col),
+            'alpha': rng.normal(size=(nb_prod, nb_asst)),
+            'nu': rng.normal(),
+            'lambdas': rng.dirichlet(np.ones(nb_col)),
+            'Proba_product': random_sales(rng, assortments)}
+
+
+def instances():
+    for (seed, (nb_prod, nb_asst, nb_col)) in enumerate(TEST_SIZES):
+        yield random_instance(seed, nb_prod, nb_asst, nb_col)
+#
+#############################
+
+
+#############################
+#  Differential tests
+#
+
+def test_product_chosen():
+    for inst in instances():
+        assortments = inst['assortments']
+        data = dataset.AssortmentData(assortments)
+        for (sigmas, reference, indifference) in [(inst['sigmas_GDT'], reference_kernels.product_chosen_GDT, True),
+                                                  (inst['sigmas_BM'], reference_kernels.product_chosen_BM, False)]:
+            expected = np.array([[reference(sigma, asst) for asst in assortments] for sigma in sigmas])
+            assert np.array_equal(choice_engine.batch_choices(sigmas, assortments, indifference), expected)
+            assert np.array_equal(choice_engine.batch_choices(sigmas, data, indifference), expected)
+
+
+def test_sigma2a_GDT():
+    for inst in instances():
+        (sigmas, assortments) = (inst['sigmas_GDT'], inst['assortments'])
+        expected = reference_kernels.multiple_sigma2a_GDT(sigmas, assortments)
+        assert np.array_equal(gen_GDT.multiple_sigma2a(sigmas, assortments), expected)
+        assert np.array_equal(gen_GDT.sigma2a(sigmas[0], assortments), expected[0])
+        chosen = choice_engine.batch_choices(sigmas, dataset.AssortmentData(assortments))
+        assert np.array_equal(choice_engine.choices2a(chosen, assortments), expected)
+
+
+def test_sigma2a_BM():
+    for inst in instances():
+        (sigmas, assortments) = (inst['sigmas_BM'], inst['assortments'])
+        expected = reference_kernels.multiple_sigma2a_BM(sigmas, assortments)
+        assert np.array_equal(choice_engine.batch_sigma2a(sigmas, assortments, indifference=False), expected)
+        for k in range(len(sigmas)):
+            assert np.array_equal(gen_BM.sigma2a(sigmas[k], assortments), expected[k])
+
+
+def test_reduced_cost():
+    for inst in instances():
+        (alpha, nu, assortments) = (inst['alpha'], inst['nu'], inst['assortments'])
+        for (sigmas, reference, kernel, indifference) in \
+                [(inst['sigmas_GDT'], reference_kernels.reduced_cost_GDT, gen_GDT.reduced_cost, True),
+                 (inst['sigmas_BM'], reference_kernels.reduced_cost_BM, gen_BM.reduced_cost, False)]:
+            expected = np.array([reference(sigma, alpha, nu, assortments) for sigma in sigmas])
+            chosen = choice_engine.batch_choices(sigmas, assortments, indifference)
+            assert np.allclose(choice_engine.reduced_costs(chosen, alpha, nu, assortments), expected, rtol=1e-12, atol=1e-12)
+            assert np.allclose([kernel(sigma, alpha, nu, assortments) for sigma in sigmas], expected, rtol=1e-12, atol=1e-12)
+
+
+def test_compute_eps():
+    for inst in instances():
+        (sigmas, lambdas, assortments, Proba_product) = \
+            (inst['sigmas_GDT'], inst['lambdas'], inst['assortments'], inst['Proba_product'])
+        expected = reference_kernels.compute_eps(reference_kernels.multiple_sigma2a_GDT(sigmas, assortments), lambdas,
+                                                 Proba_product)
+        chosen = choice_engine.batch_choices(sigmas, assortments)
+        assert np.isclose(gen_GDT.compute_eps(chosen, lambdas, Proba_product, assortments), expected, rtol=1e-12)
+        data = dataset.AssortmentData(assortments, Proba_product)
+        assert np.isclose(gen_GDT.compute_eps(chosen, lambdas, None, data), expected, rtol=1e-12)
+#
+#############################
+
+
+#############################
+#  Micro-benchmarks
+#
+
+# Returns the best time of BENCH_REPEAT calls to function, and its result
+def best_time(function):
+    times = []
+    for r in range(BENCH_REPEAT):
+        t1 = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - t1)
+    return [min(times), result]
+
+
+# Returns the kernels to compare on the instance inst, as a list of [name, reference, kernel, check]:
+# reference and kernel are functions without parameter, and check tells if their results agree
+def kernels(inst):
+    (assortments, alpha, nu, lambdas, Proba_product) = \
+        (inst['assortments'], inst['alpha'], inst['nu'], inst['lambdas'], inst['Proba_product'])
+    (sigmas_GDT, sigmas_BM) = (inst['sigmas_GDT'], inst['sigmas_BM'])
+    A_GDT = reference_kernels.multiple_sigma2a_GDT(sigmas_GDT, assortments)
+    chosen_GDT = choice_engine.batch_choices(sigmas_GDT, assortments)
+    return [
+        ['sigma2a_GDT',
+         lambda: reference_kernels.multiple_sigma2a_GDT(sigmas_GDT, assortments),
+         lambda: choice_engine.batch_sigma2a(sigmas_GDT, assortments),
+         np.array_equal],
+        ['choices_GDT',
+         lambda: reference_kernels.multiple_sigma2a_GDT(sigmas_GDT, assortments),
+         lambda: choice_engine.batch_choices(sigmas_GDT, assortments),
+         lambda expected, result: np.array_equal(choice_engine.choices2a(result, assortments), expected)],
+        ['sigma2a_BM',
+         lambda: reference_kernels.multiple_sigma2a_BM(sigmas_BM, assortments),
+         lambda: choice_engine.batch_sigma2a(sigmas_BM, assortments, indifference=False),
+         np.array_equal],
+        ['reduced_cost_GDT',
+         lambda: np.array([reference_kernels.reduced_cost_GDT(sigma, alpha, nu, assortments) for sigma in sigmas_GDT]),
+         lambda: choice_engine.reduced_costs(choice_engine.batch_choices(sigmas_GDT, assortments), alpha, nu,
+                                             assortments),
+         np.allclose],
+        ['reduced_cost_BM',
+         lambda: np.array([reference_kernels.reduced_cost_BM(sigma, alpha, nu, assortments) for sigma in sigmas_BM]),
+         lambda: choice_engine.reduced_costs(choice_engine.batch_choices(sigmas_BM, assortments, False), alpha, nu,
+                                             assortments),
+         np.allclose],
+        ['compute_eps',
+         lambda: reference_kernels.compute_eps(A_GDT, lambdas, Proba_product),
+         lambda: gen_GDT.compute_eps(chosen_GDT, lambdas, Proba_product, assortments),
+         np.isclose]]
+
+
+# Times the references and the kernels over the grid; returns the rows of the speedup table
+def benchmark():
+    rows = []
+    seed = 0
+    for nb_prod in BENCH_NB_PROD:
+        for nb_asst in BENCH_NB_ASST:
+            for nb_col in BENCH_NB_COL:
+                inst = random_instance(seed, nb_prod, nb_asst, nb_col)
+                seed += 1
+                for [name, reference, kernel, check] in kernels(inst):
+                    [time_reference, expected] = best_time(reference)
+                    [time_kernel, result] = best_time(kernel)
+                    rows.append({'kernel': name, 'nb_prod': nb_prod, 'nb_asst': nb_asst, 'nb_col': nb_col,
+                                 'time_reference': time_reference, 'time_kernel': time_kernel,
+                                 'speedup': time_reference / time_kernel, 'identical': bool(check(expected, result))})
+                    print("%-18s nb_prod=%-4d nb_asst=%-5d nb_col=%-5d speedup=%8.1f identical=%s"
+                          % (name, nb_prod, nb_asst, nb_col, rows[-1]['speedup'], rows[-1]['identical']))
+    return rows
+
+
+def write_table(rows, filename):
+    with open(filename + '.json', 'w') as file:
+        json.dump(rows, file, indent=1)
+    with open(filename + '.csv', 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+#
+#############################
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        rows = benchmark()
+        write_table(rows, sys.argv[2] if len(sys.argv) > 2 else 'kernels_speedup')
+        if not all(row['identical'] for row in rows):
+            sys.exit("Some kernels disagree with their reference")
+    else:
+        for test in [test_product_chosen, test_sigma2a_GDT, test_sigma2a_BM, test_reduced_cost, test_compute_eps]:
+            test()
+            print(test.__name__, "OK")
@@ -0,0 +1,119 @@
+#This test checks the backends of the master problem (see lib/master_backends.py):
+# - sales on random assortments are generated with a MMNL choice model, with a seeded RNG, and the columns of random
+#   GDT consumer behaviors
+# - the master built in one shot by GurobiMaster must have the objective and the duals of the reference master, built
+#   constraint by constraint with gurobipy as before the sparse build, with the L1 and the L2 norms
+# - with the L1 norm, the HiGHS and scipy backends must find the same objective and duals as Gurobi
+# - a master initialized without column, then given the columns, must find the same solution with all the backends
+# The duals are compared on the rows of the master (the pairs offered): elsewhere, alpha is 0 (see master_rows).
+# The functions test_* can also be run with pytest.
+#
+# Example of call: 'python test_master_backends.py'
+
+from context import sample
+import numpy as np
+from gurobipy import *
+
+import lib.utilities as utilities
+import lib.choice_engine as choice_engine
+import lib.master_backends as master_backends
+from test_stabilization import mmnl_instance
+
+# sizes (nb_asst, nb_col) of the instances: the reference master of the L2 norm, a QP with all the pairs (i,m), must fit
+# in a size-limited Gurobi license
+SIZE_L1 = (30, 40)
+SIZE_L2 = (4, 10)
+BACKENDS = ['gurobi', 'highs', 'scipy']
+
+
+# Returns nb_asst assortments, their sales v of shape (nb_prod, nb_asst) and the choices of nb_col random GDT columns
+def instance(nb_asst, nb_col):
+    [Inventories, Proba_product] = [array[:nb_asst] for array in mmnl_instance(0)]
+    nb_prod = Inventories.shape[1]
+    rng = np.random.default_rng(0)
+    sigmas = np.full((nb_col, nb_prod), nb_prod - 1, dtype=np.int32)
+    for k in range(nb_col):
+        ranked = rng.permutation(nb_prod)[:rng.integers(1, nb_prod)]
+        sigmas[k, ranked] = np.arange(len(ranked))
+    return [Inventories, Proba_product.T.astype(np.float64), choice_engine.batch_choices(sigmas, Inventories)]
+
+
+# Returns [obj_value, alpha, nu] of the master built constraint by constraint with gurobipy
+def reference_master(A, v, Inventories, norm):
+    (nb_prod, nb_asst) = v.shape
+    a = choice_engine.choices2a(A, Inventories)
+    model = Model('reference')
+    model.setParam('OutputFlag', 0)
+    lmbda = [model.addVar(lb=0) for k in range(len(A))]
+    eps_p = {}
+    eps_m = {}
+    for i in range(nb_prod):
+        for m in range(nb_asst):
+            eps_p[i, m] = model.addVar(lb=0, obj=int(norm == 1))
+            eps_m[i, m] = model.addVar(lb=0, obj=int(norm == 1))
+    model.update()
+    if norm == 2:
+        model.setObjective(quicksum(eps_p[i, m] * eps_p[i, m] + eps_m[i, m] * eps_m[i, m]
+                                    for i in range(nb_prod) for m in range(nb_asst)))
+    distance = {}
+    for i in range(nb_prod):
+        for m in range(nb_asst):
+            distance[i, m] = model.addConstr(LinExpr(a[:, i, m].tolist(), lmbda) + eps_p[i, m] - eps_m[i, m]
+                                             == v[i, m])
+    sum_to_1 = model.addConstr(quicksum(lmbda) == 1)
+    model.optimize()
+    alpha = np.array([[distance[i, m].Pi for m in range(nb_asst)] for i in range(nb_prod)])
+    return [model.ObjVal, alpha, np.array([sum_to_1.Pi])]
+
+
+# Returns [obj_value, alpha, nu] of the master solved by the backend; with init_empty, the master is initialized
+# without column, and the columns are added before the solve
+def backend_master(backend, A, v, Inventories, init_empty=False):
+    master = master_backends.new_master(backend)
+    if init_empty:
+        master.init_model(A[:0], v, Inventories)
+        master.add_columns(A, Inventories)
+    else:
+        master.init_model(A, v, Inventories)
+    [lmbda, alpha, nu, obj_value, time_method] = master.solve('dual', False)
+    return [obj_value, alpha, nu]
+
+
+def check_same(solution, reference, offered):
+    assert np.isclose(solution[0], reference[0], atol=1e-6)
+    assert np.allclose(solution[1][offered], reference[1][offered], atol=1e-6)
+    assert np.allclose(solution[2], reference[2], atol=1e-6)
+
+
+def check_norm(norm):
+    [Inventories, v, A] = instance(*(SIZE_L1 if norm == 1 else SIZE_L2))
+    norm_chosen = utilities.norm_chosen
+    utilities.norm_chosen = norm
+    try:
+        reference = reference_master(A, v, Inventories, norm)
+        backends = BACKENDS if norm == 1 else ['gurobi']
+        for backend in backends:
+            check_same(backend_master(backend, A, v, Inventories), reference, Inventories.T)
+    finally:
+        utilities.norm_chosen = norm_chosen
+
+
+def test_L1():
+    check_norm(1)
+
+
+def test_L2():
+    check_norm(2)
+
+
+def test_init_without_columns():
+    [Inventories, v, A] = instance(*SIZE_L1)
+    reference = backend_master('gurobi', A, v, Inventories)
+    for backend in BACKENDS:
+        check_same(backend_master(backend, A, v, Inventories, init_empty=True), reference, Inventories.T)
+
+
+if __name__ == '__main__':
+    for test in [test_L1, test_L2, test_init_without_columns]:
+        test()
+        print(test.__name__, "OK")
@@ -0,0 +1,47 @@
+#This test checks the stopping of the mini-batch learning of the GDT (see gen_GDT.run_GDT_minibatch):
+# - sales on random assortments are generated with a MMNL choice model, with a seeded RNG
+# - with all the sales on the no-choice option, no column can be split on any batch: the learning, with eps_stop > 0
+#   and no periodic solve on the full data, must stop after one rotation of the batches with 'no column to split'
+# - on the MMNL sales, the batches add columns: the learning must run its ITERATIONS_MAX iterations
+# The functions test_* can also be run with pytest.
+#
+# Example of call: 'python test_minibatch.py'
+
+from context import sample
+import numpy as np
+
+import lib.gen_GDT as gen_GDT
+import lib.utilities as utilities
+from test_stabilization import mmnl_instance
+
+BATCH_SIZE = 10
+NB_ITER = 8
+BACKEND = 'highs'
+
+
+def test_no_column_to_split():
+    [Inventories, Proba_product] = mmnl_instance(0)
+    Proba_product = np.zeros(Proba_product.shape, dtype=np.float32)
+    Proba_product[:, 0] = 1
+    np.random.seed(0)
+    stopping = utilities.StoppingPolicy()
+    [sigmas, lambdas, obj_val_master, history_obj_val] = gen_GDT.run_GDT_minibatch(
+        Inventories, Proba_product, eps_stop=0.01, backend=BACKEND, batch_size=BATCH_SIZE, full_solve_every=10 ** 9,
+        stopping=stopping)
+    assert stopping.criterion == 'no column to split'
+    assert np.isclose(obj_val_master, 0, atol=1e-6)
+
+
+def test_iterations():
+    [Inventories, Proba_product] = mmnl_instance(0)
+    np.random.seed(0)
+    stopping = utilities.StoppingPolicy()
+    gen_GDT.run_GDT_minibatch(Inventories, Proba_product, NB_ITER, backend=BACKEND, batch_size=BATCH_SIZE,
+                              full_solve_every=2, stopping=stopping)
+    assert stopping.criterion == 'iterations'
+
+
+if __name__ == '__main__':
+    for test in [test_no_column_to_split, test_iterations]:
+        test()
+        print(test.__name__, "OK")
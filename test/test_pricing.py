@@ -0,0 +1,92 @@
+#This test checks the exhaustive pricing of the GDT (see gen_GDT.exhaustive_lowest_reduced_cost) and measures it:
+# - sales on random assortments are generated with a MMNL choice model, with a seeded RNG
+# - the reduced costs of the children of all the columns of a learning, scored in one batch at random duals
+#   (gen_GDT.children_reduced_costs), must be the ones of the children built one node at a time by children_GDT
+# - the children kept by the exhaustive pricing must be the ones of lowest reduced costs among all these children
+# - GDT choice models are learned until eps_stop with the sampled and the exhaustive pricing, with the fixed and the
+#   adaptive branching schedules (utilities.BranchingSchedule): the iterations and the wall time are printed
+# The functions test_* can also be run with pytest.
+#
+# Example of call: 'python test_pricing.py' or 'python test_pricing.py 0.005' for another eps_stop
+
+from context import sample
+import sys
+import time
+import numpy as np
+
+import lib.gen_GDT as gen_GDT
+import lib.utilities as utilities
+import lib.choice_engine as choice_engine
+import lib.column_pool as column_pool
+import lib.dataset as dataset
+from test_stabilization import mmnl_instance
+
+EPS_STOP = 0.01
+NB_ITER = 8
+N_NEW_BRANCHES = 25
+BACKEND = 'highs'
+
+
+# Returns the pool of the columns of a learning on the assortments (the initial columns and the ones of the model),
+# and random duals
+def learned_pool(assortments):
+    [Inventories, Proba_product] = mmnl_instance(0)
+    np.random.seed(0)
+    sigmas = gen_GDT.run_GDT(Inventories, Proba_product, NB_ITER, backend=BACKEND)[0]
+    nb_prod = Inventories.shape[1]
+    sigma_init = np.full((nb_prod, nb_prod), fill_value=nb_prod - 1, dtype=np.int32)
+    np.fill_diagonal(sigma_init, 0)
+    sigmas = np.vstack((sigma_init, sigmas))
+    pool = column_pool.ColumnPool(nb_prod, len(Inventories))
+    pool.append(sigmas, choice_engine.batch_choices(sigmas, assortments))
+    rng = np.random.default_rng(0)
+    return [pool, rng.normal(size=(nb_prod, len(Inventories))), rng.normal()]
+
+
+def check_children(assortments):
+    [pool, alpha, nu] = learned_pool(assortments)
+    nb_prod = pool.sigma().shape[1]
+    rc = gen_GDT.children_reduced_costs(pool.sigma(), pool.A(), alpha, nu, assortments)
+    for k in range(len(pool)):
+        if pool.sigma()[k, 0] != nb_prod - 1:
+            assert np.isinf(rc[k]).all()
+            continue
+        [children, children_A] = gen_GDT.children_GDT(pool.sigma()[k], pool.A()[k], assortments)
+        products = np.argmax(children != pool.sigma()[k], axis=1)
+        assert np.isfinite(rc[k]).sum() == len(children)
+        assert np.allclose(rc[k, products], gen_GDT.reduced_cost_matrix(children_A, alpha, nu, assortments))
+    [new_sigma_GDT, new_A, new_rc] = gen_GDT.exhaustive_lowest_reduced_cost(pool, nb_prod, alpha, nu, assortments,
+                                                                            N_NEW_BRANCHES)
+    assert np.array_equal(new_A, choice_engine.batch_choices(new_sigma_GDT, assortments))
+    assert np.allclose(new_rc, np.sort(rc[np.isfinite(rc)])[:N_NEW_BRANCHES])
+
+
+def test_children_dense():
+    check_children(mmnl_instance(0)[0])
+
+
+def test_children_sparse():
+    check_children(dataset.AssortmentData(*mmnl_instance(0)))
+
+
+# Returns [iterations, time] of a learning until eps_stop
+def learn(pricing, adaptive, eps_stop):
+    [Inventories, Proba_product] = mmnl_instance(0)
+    np.random.seed(0)
+    t1 = time.time()
+    history_obj_val = gen_GDT.run_GDT(Inventories, Proba_product, eps_stop=eps_stop, backend=BACKEND, pricing=pricing,
+                                      branching=utilities.BranchingSchedule(adaptive))[3]
+    return [len(history_obj_val) - 1, time.time() - t1]
+
+
+if __name__ == '__main__':
+    for test in [test_children_dense, test_children_sparse]:
+        test()
+        print(test.__name__, "OK")
+    eps_stop = float(sys.argv[1]) if len(sys.argv) > 1 else EPS_STOP
+    rows = [[pricing, adaptive] + learn(pricing, adaptive, eps_stop)
+            for pricing in ['sampled', 'exhaustive'] for adaptive in [False, True]]
+    print("Iterations and time to eps_stop =", eps_stop)
+    for [pricing, adaptive, nb_iterations, total_time] in rows:
+        print("pricing=%-10s adaptive branching=%-5s iterations=%-5d time=%8.2fs"
+              % (pricing, adaptive, nb_iterations, total_time))
@@ -0,0 +1,63 @@
+#This test measures the effect of the dual smoothing (see utilities.DualSmoothing) on the convergence of the learning:
+# - sales on random assortments are generated with a MMNL choice model, with a seeded RNG
+# - GDT and BM choice models are learned until eps_stop, with several weights of smoothing
+# - the number of iterations and the wall time to reach eps_stop are printed for each weight
+# The learnings start from the same random state for each weight; the first weight, 0, is the learning without
+# stabilization.
+#
+# Example of call: 'python test_stabilization.py' or 'python test_stabilization.py 0.02' for another eps_stop
+
+from context import sample
+import sys
+import time
+import numpy as np
+
+import lib.gen_GDT as gen_GDT
+import lib.gen_BM as gen_BM
+
+# size of the instance, and parameters of the MMNL generating the sales
+NB_PROD = 20
+NB_ASST = 30
+T = 5
+L = 10
+NB_FAV_PROD = 4
+# weights of smoothing compared
+SMOOTHINGS = [0, 0.3, 0.6, 0.9]
+EPS_STOP = 0.01
+
+
+# Returns random assortments (the no-choice option 0 is always offered) and their sales under a random MMNL model
+def mmnl_instance(seed):
+    rng = np.random.default_rng(seed)
+    u = np.log(rng.random((T, NB_PROD)))
+    for t in range(T):
+        u[t, rng.permutation(NB_PROD)[:NB_FAV_PROD]] += np.log(L)
+    p = rng.dirichlet(np.ones(T))
+    Inventories = rng.random((NB_ASST, NB_PROD)) < 0.5
+    Inventories[:, 0] = True
+    exp_u = np.exp(u)[:, None, :] * Inventories[None, :, :]
+    Proba_product = np.einsum('t,tmi->mi', p, exp_u / exp_u.sum(axis=2, keepdims=True))
+    return [Inventories, Proba_product.astype(np.float32)]
+
+
+def measure(run, Inventories, Proba_product, eps_stop):
+    rows = []
+    for smoothing in SMOOTHINGS:
+        np.random.seed(0)
+        t1 = time.time()
+        [sigmas, lambdas, obj_val_master, history_obj_val] = run(Inventories, Proba_product, eps_stop=eps_stop,
+                                                                 smoothing=smoothing)
+        rows.append([smoothing, len(history_obj_val) - 1, time.time() - t1, obj_val_master])
+    return rows
+
+
+if __name__ == '__main__':
+    eps_stop = float(sys.argv[1]) if len(sys.argv) > 1 else EPS_STOP
+    [Inventories, Proba_product] = mmnl_instance(0)
+    results = [[name, measure(run, Inventories, Proba_product, eps_stop)]
+               for [name, run] in [['GDT', gen_GDT.run_GDT], ['BM', gen_BM.run_BM]]]
+    print("Iterations and time to eps_stop =", eps_stop)
+    for [name, rows] in results:
+        for [smoothing, nb_iterations, total_time, obj_val_master] in rows:
+            print("%-3s smoothing=%-4s iterations=%-6d time=%8.2fs objective=%.6f"
+                  % (name, smoothing, nb_iterations, total_time, obj_val_master))
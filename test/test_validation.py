@@ -0,0 +1,95 @@
+#This test checks the validation error of the learnings (see utilities.Validation):
+# - sales on random assortments are generated with a MMNL choice model, with a seeded RNG, and split into a training
+#   set and a validation set (dataset.split)
+# - the validation error, updated incrementally as columns are added and lambdas change, must be the error given by
+#   gen_GDT.compute_eps on the validation set, for the columns of a learning added a few at a time with new lambdas
+# - the model returned by a learning with early stopping must be the one of lowest validation error
+# - the iterations, columns and errors of the learnings with and without early stopping are printed
+# The functions test_* can also be run with pytest.
+#
+# Example of call: 'python test_validation.py'
+
+from context import sample
+import numpy as np
+
+import lib.gen_GDT as gen_GDT
+import lib.gen_BM as gen_BM
+import lib.utilities as utilities
+import lib.dataset as dataset
+import lib.choice_engine as choice_engine
+from test_stabilization import mmnl_instance
+
+NB_ITER = 60
+VALIDATION_FRACTION = 0.3
+PATIENCE = 5
+BACKEND = 'highs'
+
+
+# Returns the training set and the validation set of the instance
+def instance():
+    [Inventories, Proba_product] = mmnl_instance(0)
+    return dataset.split(dataset.AssortmentData(Inventories, Proba_product), None, VALIDATION_FRACTION)
+
+
+# Returns the error of the model (sigmas, lambdas) on the validation set, computed from scratch
+def error_from_scratch(sigmas, lambdas, validation, indifference):
+    return gen_GDT.compute_eps(choice_engine.batch_choices(sigmas, validation, indifference), lambdas, None,
+                               validation)
+
+
+def check_incremental(run, indifference):
+    [train, validation] = instance()
+    np.random.seed(0)
+    sigmas = run(train, None, NB_ITER, backend=BACKEND)[0]
+    validation_set = utilities.Validation(validation, None, indifference)
+    rng = np.random.default_rng(0)
+    lambdas = np.zeros(0)
+    for nb_columns in range(1, len(sigmas) + 1, 3):
+        # new columns, and new lambdas for a part of the columns only
+        lambdas = np.concatenate((lambdas, np.zeros(nb_columns - len(lambdas))))
+        changed = rng.random(nb_columns) < 0.5
+        changed[-1] = True
+        lambdas[changed] = rng.random(np.count_nonzero(changed))
+        lambdas /= lambdas.sum()
+        assert np.isclose(validation_set.error(sigmas[:nb_columns], lambdas),
+                          error_from_scratch(sigmas[:nb_columns], lambdas, validation, indifference), atol=1e-6)
+
+
+# Returns [iterations, columns, objective, validation error] of a learning, with early stopping if patience > 0
+def learn(run, indifference, patience):
+    [train, validation] = instance()
+    np.random.seed(0)
+    stopping = utilities.StoppingPolicy(patience=patience)
+    [sigmas, lambdas, obj_val_master, history_obj_val] = run(train, None, NB_ITER, backend=BACKEND, stopping=stopping,
+                                                             validation=validation if patience > 0 else None)
+    validation_error = error_from_scratch(sigmas, lambdas, validation, indifference)
+    if patience > 0:
+        assert np.isclose(validation_error, min(stopping.validation_history), atol=1e-6)
+    return [len(history_obj_val), np.count_nonzero(lambdas), obj_val_master, validation_error]
+
+
+def test_incremental_GDT():
+    check_incremental(gen_GDT.run_GDT, True)
+
+
+def test_incremental_BM():
+    check_incremental(gen_BM.run_BM, False)
+
+
+def test_early_stopping_GDT():
+    learn(gen_GDT.run_GDT, True, PATIENCE)
+
+
+def test_early_stopping_BM():
+    learn(gen_BM.run_BM, False, PATIENCE)
+
+
+if __name__ == '__main__':
+    for test in [test_incremental_GDT, test_incremental_BM, test_early_stopping_GDT, test_early_stopping_BM]:
+        test()
+        print(test.__name__, "OK")
+    for [name, run, indifference] in [['GDT', gen_GDT.run_GDT, True], ['BM', gen_BM.run_BM, False]]:
+        for patience in [0, PATIENCE]:
+            [nb_iterations, nb_columns, obj_val_master, validation_error] = learn(run, indifference, patience)
+            print("%-3s patience=%-2d iterations=%-4d columns=%-4d objective=%.6f validation error=%.6f"
+                  % (name, patience, nb_iterations, nb_columns, obj_val_master, validation_error))